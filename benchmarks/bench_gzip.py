@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gzip decompression benchmark - compares GzipInputObject throughput
+with the raw zlib decompression of the same data.
+
+Usage: python benchmarks/bench_gzip.py [--lines N] [--block-size B]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_objects'))
+import input_obj  # noqa: E402
+from bench_readline import gen_data  # noqa: E402
+
+
+def gzip_data(data):
+    """
+    Compresses data to the gzip format
+    :param data:
+    :return:
+    """
+    comp = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return comp.compress(data) + comp.flush()
+
+
+def run_zlib(gz, block_size):
+    decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    total = 0
+    for idx in range(0, len(gz), block_size):
+        total += len(decomp.decompress(gz[idx:idx + block_size]))
+    return total + len(decomp.flush())
+
+
+def run_read(gz, block_size):
+    iobj = input_obj.GzipInputObject(input_obj.FileLikeInputObject(fh=io.BytesIO(gz)), block_size=block_size)
+    iobj.__enter__()
+    total = 0
+    while True:
+        data = iobj.read(65536)
+        if not data:
+            break
+        total += len(data)
+    return total
+
+
+def run_readinto(gz, block_size):
+    iobj = input_obj.GzipInputObject(input_obj.FileLikeInputObject(fh=io.BytesIO(gz)), block_size=block_size)
+    iobj.__enter__()
+    buf = bytearray(65536)
+    total = 0
+    while True:
+        n = iobj.readinto(buf)
+        if not n:
+            break
+        total += n
+    return total
+
+
+def run_readline(gz, block_size):
+    iobj = input_obj.GzipInputObject(input_obj.FileLikeInputObject(fh=io.BytesIO(gz)), block_size=block_size)
+    iobj.__enter__()
+    total = 0
+    for line in iobj:
+        total += len(line)
+    return total
+
+
+def run_pipelined(gz, block_size):
+    iobj = input_obj.GzipInputObject(input_obj.FileLikeInputObject(fh=io.BytesIO(gz)), block_size=block_size,
+                                     pipelined=True)
+    with iobj:
+        total = 0
+        while True:
+            data = iobj.read(65536)
+            if not data:
+                break
+            total += len(data)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gzip decompression benchmark')
+    parser.add_argument('--lines', dest='lines', type=int, default=500000,
+                        help='number of lines to generate')
+    parser.add_argument('--line-size', dest='line_size', type=int, default=200,
+                        help='approximate line size in bytes')
+    parser.add_argument('--block-size', dest='block_size', type=int, default=65536,
+                        help='compressed input block size')
+    args = parser.parse_args()
+
+    data = gen_data(args.lines, args.line_size)
+    gz = gzip_data(data)
+    print('Data: %.2f MB, compressed %.2f MB' % (len(data) / 1024.0 / 1024.0, len(gz) / 1024.0 / 1024.0))
+
+    for name, fnc in [('zlib', run_zlib), ('read', run_read), ('readinto', run_readinto),
+                      ('readline', run_readline), ('pipelined', run_pipelined)]:
+        time_start = time.time()
+        total = fnc(gz, args.block_size)
+        elapsed = time.time() - time_start
+        print('%-10s %8.3f s %8.2f MB/s' % (name, elapsed, total / elapsed / 1024.0 / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Line reading benchmark - compares LineBuffer based InputObject.readline
+with the previous concatenate & slice implementation.
+
+Usage: python benchmarks/bench_readline.py [--lines N] [--line-size B]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_objects'))
+import input_obj  # noqa: E402
+
+
+class LegacyLineInputObject(input_obj.FileLikeInputObject):
+    """
+    Line reading as implemented before the LineBuffer - buffer concatenation
+    and re-slicing of the remainder after each line.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(LegacyLineInputObject, self).__init__(*args, **kwargs)
+        self._data = b''
+
+    def _legacy_fill(self, num_bytes):
+        if self._done:
+            return
+
+        while not num_bytes or len(self._data) < num_bytes:
+            data = self.read(32768)
+            if not data:
+                self._done = True
+                break
+
+            self._data = self._data + data
+
+    def _read(self, size=0):
+        self._legacy_fill(size)
+        if size:
+            data = self._data[:size]
+            self._data = self._data[size:]
+        else:
+            data = self._data
+            self._data = b''
+        self._offset = self._offset + len(data)
+        return data
+
+    def readline(self):
+        while not self._done and b'\n' not in self._data:
+            self._legacy_fill(len(self._data) + 512)
+
+        pos = self._data.find(b'\n') + 1
+        if pos <= 0:
+            return self._read()
+        return self._read(pos)
+
+
+def gen_data(lines, line_size):
+    """
+    Generates JSON-lines like test data
+    :param lines:
+    :param line_size:
+    :return:
+    """
+    rec = b'{"id": %d, "data": "%s"}\n'
+    pad = b'x' * max(0, line_size - len(rec))
+    return b''.join(rec % (i, pad) for i in range(lines))
+
+
+def run(cls, data):
+    """
+    Reads all lines from the data, returns (lines, seconds)
+    :param cls:
+    :param data:
+    :return:
+    """
+    iobj = cls(fh=io.BytesIO(data))
+    iobj.__enter__()
+    lines = 0
+    time_start = time.time()
+    for _ in iobj:
+        lines += 1
+    elapsed = time.time() - time_start
+    return lines, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Line reading benchmark')
+    parser.add_argument('--lines', dest='lines', type=int, default=500000,
+                        help='number of lines to generate')
+    parser.add_argument('--line-size', dest='line_size', type=int, default=200,
+                        help='approximate line size in bytes')
+    args = parser.parse_args()
+
+    data = gen_data(args.lines, args.line_size)
+    print('Data: %s lines, %.2f MB' % (args.lines, len(data) / 1024.0 / 1024.0))
+
+    for name, cls in [('legacy', LegacyLineInputObject), ('linebuffer', input_obj.FileLikeInputObject)]:
+        lines, elapsed = run(cls, data)
+        print('%-12s %10d lines %8.3f s %12.0f lines/s %8.2f MB/s'
+              % (name, lines, elapsed, lines / elapsed, len(data) / elapsed / 1024.0 / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
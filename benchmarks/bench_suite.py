@@ -0,0 +1,483 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Reproducible offline benchmark suite - input object classes and common stacks over local files
+and the local fault injecting HTTP server (see faultserver.py).
+
+Each case runs in a fresh process, reports MB/s, lines/s, CPU time, peak RSS, reconnections
+and reconnect recovery latency. Results are written as JSON, --compare checks them against
+a baseline JSON, e.g., from the previous commit, and fails on throughput regressions.
+
+Usage: python benchmarks/bench_suite.py [--lines N] [--repeat R] [--output results.json]
+                                        [--cases PATTERN] [--compare baseline.json]
+"""
+
+import argparse
+import collections
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'input_objects'))
+import input_obj  # noqa: E402
+from bench_readline import gen_data  # noqa: E402
+from faultserver import FaultServer, FaultPlan  # noqa: E402
+
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+
+
+RESULTS_VERSION = 1
+"""Version of the results JSON format"""
+
+READ_SIZE = 65536
+"""Size of the read() calls in the read mode"""
+
+PARTS = 4
+"""Number of the source parts of the merged cases"""
+
+FAULT_PLANS = collections.OrderedDict([
+    ('clean', dict()),
+    ('drop', dict(drop=0.3)),
+    ('truncate', dict(truncate=0.3)),
+    ('stall', dict(stall=0.3)),
+    ('no_length', dict(no_length=0.5)),
+])
+"""Fault plans by name, FaultPlan arguments"""
+
+
+#
+# Stacks - build(env) returns the input object, not entered
+#
+
+def _retry(env):
+    return input_obj.RetryPolicy(first_delay=0.01, base_delay=0.05, max_delay=1.0, max_attempts=100)
+
+
+def stack_file(env):
+    return input_obj.FileInputObject(env['files']['plain'])
+
+
+def stack_file_mmap(env):
+    return input_obj.FileInputObject(env['files']['plain'], use_mmap=True)
+
+
+def stack_filelike(env):
+    return input_obj.FileLikeInputObject(open_call=lambda x: open(env['files']['plain'], 'rb'))
+
+
+def stack_gzip_file(env):
+    return input_obj.GzipInputObject(input_obj.FileInputObject(env['files']['gzip']))
+
+
+def stack_gzip_pipelined(env):
+    return input_obj.GzipInputObject(input_obj.FileInputObject(env['files']['gzip']), pipelined=True)
+
+
+def stack_lz4_file(env):
+    return input_obj.Lz4InputObject(input_obj.FileInputObject(env['files']['lz4']))
+
+
+def stack_link(env):
+    return input_obj.LinkInputObject(env['urls']['plain'], timeout=env['timeout'])
+
+
+def stack_reconnecting(env):
+    return input_obj.ReconnectingLinkInputObject(env['urls']['plain'], timeout=env['timeout'], retry=_retry(env))
+
+
+def stack_gzip_tee_reconnecting(env):
+    link = input_obj.ReconnectingLinkInputObject(env['urls']['gzip'], timeout=env['timeout'], retry=_retry(env))
+    tee = input_obj.TeeInputObject(link, copy_fname=os.path.join(env['work_dir'], 'tee-copy.gz'))
+    return input_obj.GzipInputObject(tee)
+
+
+def stack_merged_reconnecting(env):
+    return input_obj.MergedInputObject([
+        input_obj.ReconnectingLinkInputObject(url, timeout=env['timeout'], retry=_retry(env))
+        for url in env['urls']['parts']])
+
+
+STACKS = collections.OrderedDict([
+    ('file', stack_file),
+    ('file_mmap', stack_file_mmap),
+    ('filelike', stack_filelike),
+    ('gzip_file', stack_gzip_file),
+    ('gzip_pipelined', stack_gzip_pipelined),
+    ('lz4_file', stack_lz4_file),
+    ('link', stack_link),
+    ('reconnecting', stack_reconnecting),
+    ('gzip_tee_reconnecting', stack_gzip_tee_reconnecting),
+    ('merged_reconnecting', stack_merged_reconnecting),
+])
+"""Stacks by name, all read the generated data"""
+
+REMOTE_STACKS = ('link', 'reconnecting', 'gzip_tee_reconnecting', 'merged_reconnecting')
+"""Stacks reading from the HTTP server"""
+
+FAULT_STACKS = ('reconnecting', 'gzip_tee_reconnecting', 'merged_reconnecting')
+"""Stacks benchmarked with the fault plans, able to recover"""
+
+
+def build_cases(have_lz4=True):
+    """
+    Returns the benchmark cases as a list of (name, stack, mode, fault plan)
+    :param have_lz4:
+    :return:
+    """
+    cases = []
+    for stack in STACKS:
+        if stack == 'lz4_file' and not have_lz4:
+            continue
+        plans = FAULT_PLANS.keys() if stack in FAULT_STACKS else ['clean']
+        for plan in plans:
+            for mode in ('read', 'readline'):
+                name = '%s.%s' % (stack, mode) if plan == 'clean' else '%s.%s@%s' % (stack, mode, plan)
+                cases.append((name, stack, mode, plan))
+    return cases
+
+
+#
+# Case process
+#
+
+def peak_rss():
+    """
+    Returns the peak resident set size of the process in bytes, None if unknown.
+    Linux VmHWM is preferred, ru_maxrss is inherited from the parent process over fork and exec.
+    :return:
+    """
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+
+def consume(iobj, mode):
+    """
+    Reads the entered input object to the end
+    :param iobj:
+    :param mode: read or readline
+    :return: (bytes, lines)
+    """
+    total = lines = 0
+    if mode == 'readline':
+        for line in iobj:
+            total += len(line)
+            lines += 1
+        return total, lines
+
+    while True:
+        data = iobj.read(READ_SIZE)
+        if not data:
+            break
+        total += len(data)
+        lines += data.count(b'\n')
+    return total, lines
+
+
+def reconnect_stats(iobj):
+    """
+    Sums the reconnect metrics of the reconnecting links in the stack
+    :param iobj:
+    :return:
+    """
+    js = collections.OrderedDict([('reconnections', 0), ('retries', 0), ('recoveries', 0), ('gave_up', 0),
+                                  ('mean_recovery', None), ('max_recovery', None)])
+    latencies = []
+    for x in input_obj.iter_input_objects(iobj):
+        if not isinstance(x, input_obj.ReconnectingLinkInputObject):
+            continue
+        stats = x.retry_state.stats()
+        js['reconnections'] += max(0, x.reconnections - 1)  # the first request is not a reconnect
+        js['retries'] += stats['retries']
+        js['recoveries'] += stats['recoveries']
+        js['gave_up'] += stats['gave_up']
+        latencies += [o.latency for o in x.retry_state.outages if o.recovered]
+    if latencies:
+        js['mean_recovery'] = sum(latencies) / len(latencies)
+        js['max_recovery'] = max(latencies)
+    return js
+
+
+def run_case(env, stack, mode):
+    """
+    Runs the case in this process
+    :param env:
+    :param stack:
+    :param mode:
+    :return: result dict
+    """
+    iobj = STACKS[stack](env)
+    if env.get('digest') is not None:
+        input_obj.set_digest_policy(iobj, env['digest'], layer=input_obj.DIGEST_LAYER_ALL)
+
+    cpu_start, time_start = cpu_time(), time.time()
+    with iobj:
+        total, lines = consume(iobj, mode)
+        hexdigest = iobj.digest.hexdigest() if iobj.digest.name == 'sha256' else None
+        elapsed = time.time() - time_start
+        cpu = cpu_time() - cpu_start
+    mb = total / 1024.0 / 1024.0
+
+    js = collections.OrderedDict()
+    js['ok'] = total == env['size'] and (hexdigest is None or hexdigest == env['hexdigest'])
+    js['bytes'] = total
+    js['lines'] = lines
+    js['wall'] = elapsed
+    js['cpu'] = cpu
+    js['mb_s'] = mb / elapsed if elapsed > 0 else None
+    js['lines_s'] = lines / elapsed if elapsed > 0 else None
+    js['peak_rss'] = peak_rss()
+    js.update(reconnect_stats(iobj))
+    return js
+
+
+def spawn_case(env, stack, mode, verbose=False):
+    """
+    Runs the case in a fresh process, so the peak RSS and the imports do not leak between cases
+    :param env:
+    :param stack:
+    :param mode:
+    :param verbose:
+    :return: result dict
+    """
+    args = [sys.executable, os.path.abspath(__file__), '--run-case', stack, '--mode', mode, '--env', json.dumps(env)]
+    if verbose:
+        args.append('--verbose')
+    p = subprocess.Popen(args, stdout=subprocess.PIPE)
+    out, _ = p.communicate()
+    if p.returncode != 0:
+        return collections.OrderedDict([('ok', False), ('error', 'exit code %s' % p.returncode)])
+    return json.loads(out.decode('utf8').strip().splitlines()[-1], object_pairs_hook=collections.OrderedDict)
+
+
+#
+# Suite
+#
+
+def median(values):
+    values = sorted(x for x in values if x is not None)
+    if not values:
+        return None
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2.0
+
+
+def summarize(runs):
+    """
+    Medians of the metrics over the repeated runs, peak RSS is the maximum
+    :param runs:
+    :return:
+    """
+    js = collections.OrderedDict()
+    js['ok'] = all(x.get('ok') for x in runs)
+    for key in ('wall', 'cpu', 'mb_s', 'lines_s', 'reconnections', 'retries', 'mean_recovery', 'max_recovery'):
+        js[key] = median([x.get(key) for x in runs])
+    rss = [x.get('peak_rss') for x in runs if x.get('peak_rss') is not None]
+    js['peak_rss'] = max(rss) if rss else None
+    return js
+
+
+def git_commit():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BENCH_DIR, stderr=subprocess.STDOUT)
+        return out.decode('utf8').strip()
+    except Exception:
+        return None
+
+
+def prepare_data(work_dir, lines, line_size):
+    """
+    Generates the data files
+    :param work_dir:
+    :param lines:
+    :param line_size:
+    :return: (files, contents, size of the data, sha256 hex digest of the data)
+    """
+    data = gen_data(lines, line_size)
+    comp = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    contents = collections.OrderedDict([('plain', data), ('gzip', comp.compress(data) + comp.flush())])
+    if lz4frame is not None:
+        contents['lz4'] = lz4frame.compress(data)
+
+    offsets = [0]
+    for idx in range(1, PARTS):  # split at the line boundaries
+        offsets.append(data.find(b'\n', len(data) * idx // PARTS) + 1 or len(data))
+    offsets.append(len(data))
+    for idx in range(PARTS):
+        contents['part%s' % idx] = data[offsets[idx]:offsets[idx + 1]]
+
+    files = collections.OrderedDict()
+    for name, content in contents.items():
+        files[name] = os.path.join(work_dir, 'data.%s' % name)
+        with open(files[name], 'wb') as fh:
+            fh.write(content)
+
+    return files, contents, len(data), hashlib.sha256(data).hexdigest()
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the throughput change against the baseline results
+    :param results:
+    :param baseline:
+    :param threshold: relative slowdown reported as a regression, e.g., 0.1
+    :return: list of the regressed case names
+    """
+    base = dict((x['case'], x['summary']) for x in baseline['results'])
+    regressions = []
+    print('\nCompared with %s' % (baseline.get('commit') or 'baseline'))
+    for res in results['results']:
+        old = base.get(res['case'])
+        new = res['summary']
+        if old is None or not old.get('mb_s') or not new.get('mb_s'):
+            continue
+        ratio = new['mb_s'] / old['mb_s']
+        flag = ''
+        if ratio < 1.0 - threshold:
+            flag = '  REGRESSION'
+            regressions.append(res['case'])
+        print('%-44s %9.2f -> %9.2f MB/s %+7.1f %%%s' % (res['case'], old['mb_s'], new['mb_s'],
+                                                         (ratio - 1.0) * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Input objects benchmark suite')
+    parser.add_argument('--lines', dest='lines', type=int, default=200000, help='number of lines to generate')
+    parser.add_argument('--line-size', dest='line_size', type=int, default=200, help='approximate line size')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3, help='runs of each case')
+    parser.add_argument('--cases', dest='cases', default=None,
+                        help='comma separated case name patterns, e.g., "gzip*,reconnecting.*"')
+    parser.add_argument('--digest', dest='digest', default=None, help='digest of all layers, e.g., none')
+    parser.add_argument('--timeout', dest='timeout', type=float, default=0.5, help='HTTP timeout, seconds')
+    parser.add_argument('--stall-time', dest='stall_time', type=float, default=2.0, help='injected stall seconds')
+    parser.add_argument('--seed', dest='seed', type=int, default=1, help='fault injection seed')
+    parser.add_argument('--output', dest='output', default=None, help='results JSON file')
+    parser.add_argument('--compare', dest='compare', default=None, help='baseline results JSON file')
+    parser.add_argument('--threshold', dest='threshold', type=float, default=0.1,
+                        help='relative throughput drop reported as a regression')
+    parser.add_argument('--list', dest='list', action='store_true', help='lists the cases')
+    parser.add_argument('--verbose', dest='verbose', action='store_true', help='library logging')
+    parser.add_argument('--run-case', dest='run_case', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--mode', dest='mode', default='read', help=argparse.SUPPRESS)
+    parser.add_argument('--env', dest='env', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.env), args.run_case, args.mode)))
+        return
+
+    cases = build_cases(have_lz4=lz4frame is not None)
+    if args.cases:
+        patterns = args.cases.split(',')
+        cases = [x for x in cases if any(fnmatch.fnmatch(x[0], p) for p in patterns)]
+    if args.list:
+        for case in cases:
+            print(case[0])
+        return
+
+    work_dir = tempfile.mkdtemp(prefix='bench-io-')
+    server = None
+    try:
+        files, contents, size, hexdigest = prepare_data(work_dir, args.lines, args.line_size)
+        server = FaultServer(dict(('/data.%s' % k, v) for k, v in contents.items())).start()
+        urls = {'plain': server.url('/data.plain'), 'gzip': server.url('/data.gzip'),
+                'parts': [server.url('/data.part%s' % idx) for idx in range(PARTS)]}
+        env = {'files': files, 'urls': urls, 'size': size, 'hexdigest': hexdigest, 'work_dir': work_dir,
+               'timeout': args.timeout, 'digest': args.digest}
+        print('Data: %s lines, %.2f MB, %s cases x %s runs'
+              % (args.lines, size / 1024.0 / 1024.0, len(cases), args.repeat))
+
+        results = collections.OrderedDict()
+        results['version'] = RESULTS_VERSION
+        results['commit'] = git_commit()
+        results['timestamp'] = time.time()
+        results['python'] = platform.python_version()
+        results['platform'] = platform.platform()
+        results['params'] = collections.OrderedDict([
+            ('lines', args.lines), ('line_size', args.line_size), ('bytes', size),
+            ('repeat', args.repeat), ('read_size', READ_SIZE), ('digest', args.digest), ('timeout', args.timeout),
+            ('stall_time', args.stall_time), ('seed', args.seed)])
+        results['results'] = []
+
+        for name, stack, mode, plan_name in cases:
+            plan = FaultPlan(seed=args.seed, stall_time=args.stall_time, **FAULT_PLANS[plan_name])
+            runs = []
+            faults = collections.Counter()
+            for _ in range(args.repeat):
+                server.set_plan(plan)
+                before = server.stats()
+                runs.append(spawn_case(env, stack, mode, verbose=args.verbose))
+                after = server.stats()
+                for key in ('drop', 'truncate', 'stall', 'no_length'):
+                    faults[key] += after.get(key, 0) - before.get(key, 0)
+
+            res = collections.OrderedDict()
+            res['case'] = name
+            res['stack'] = stack
+            res['mode'] = mode
+            res['faults'] = plan_name
+            res['plan'] = plan.to_state() if stack in REMOTE_STACKS else None
+            res['injected'] = dict(faults)
+            res['summary'] = summarize(runs)
+            res['runs'] = runs
+            results['results'].append(res)
+
+            s = res['summary']
+            print('%-44s %s %8.2f MB/s %10.0f lines/s cpu %7.3f s rss %7.1f MB reconn %4s rec %s'
+                  % (name, 'ok ' if s['ok'] else 'BAD', s['mb_s'] or 0, s['lines_s'] or 0, s['cpu'] or 0,
+                     (s['peak_rss'] or 0) / 1024.0 / 1024.0, s['reconnections'],
+                     '%.3f s' % s['mean_recovery'] if s['mean_recovery'] is not None else '-'))
+
+        if args.output:
+            with open(args.output, 'w') as fh:
+                json.dump(results, fh, indent=2)
+            print('Results stored to %s' % args.output)
+
+        if args.compare:
+            with open(args.compare) as fh:
+                baseline = json.load(fh)
+            if compare(results, baseline, args.threshold):
+                sys.exit(1)
+
+    finally:
+        if server is not None:
+            server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
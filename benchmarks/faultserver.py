@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Local HTTP server with fault injection for the benchmarks - serves in-memory files
+with HEAD, Range requests and Accept-Ranges, GET responses can be broken on purpose:
+
+- drop: the connection is reset in the middle of the body
+- truncate: the body ends early, the connection is closed cleanly
+- stall: the body stops for stall_time seconds, then continues
+- no_length: the response has no Content-Length, the body ends by closing the connection
+
+Faults are drawn from a seeded random generator in the request order, so a single
+stream sees the same faults in every run. Every fault hits at a random point of the body.
+
+Usage: python benchmarks/faultserver.py --port 8080 --drop 0.2 FILE [FILE ...]
+"""
+
+import argparse
+import collections
+import os
+import random
+import re
+import socket
+import struct
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+FAULT_DROP = 'drop'
+FAULT_TRUNCATE = 'truncate'
+FAULT_STALL = 'stall'
+FAULT_NO_LENGTH = 'no_length'
+
+WRITE_BLOCK = 65536
+"""Size of the body blocks written to the socket"""
+
+
+class FaultPlan(object):
+    """
+    Probabilities of the faults injected into GET responses, at most one fault per response.
+    max_faults limits the total number of faults injected, None = unlimited.
+    """
+    def __init__(self, drop=0.0, truncate=0.0, stall=0.0, stall_time=1.0, no_length=0.0, seed=0,
+                 max_faults=None):
+        self.drop = drop
+        self.truncate = truncate
+        self.stall = stall
+        self.stall_time = stall_time
+        self.no_length = no_length
+        self.seed = seed
+        self.max_faults = max_faults
+
+    def __repr__(self):
+        return 'FaultPlan(drop=%r, truncate=%r, stall=%r, stall_time=%r, no_length=%r, seed=%r, max_faults=%r)' \
+               % (self.drop, self.truncate, self.stall, self.stall_time, self.no_length, self.seed, self.max_faults)
+
+    def to_state(self):
+        js = collections.OrderedDict()
+        js['drop'] = self.drop
+        js['truncate'] = self.truncate
+        js['stall'] = self.stall
+        js['stall_time'] = self.stall_time
+        js['no_length'] = self.no_length
+        js['seed'] = self.seed
+        js['max_faults'] = self.max_faults
+        return js
+
+    @classmethod
+    def from_state(cls, js):
+        return cls(**dict(js))
+
+
+NO_FAULTS = FaultPlan()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _file(self):
+        data = self.server.files.get(self.path.split('?', 1)[0])
+        if data is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        return data
+
+    def _range(self, size):
+        """
+        Returns (start, end, status) of the requested range, None if not satisfiable
+        :param size:
+        :return:
+        """
+        header = self.headers.get('Range')
+        if not header:
+            return 0, size, 200
+
+        m = re.match(r'bytes=(\d*)-(\d*)$', header.strip())
+        if m is None:
+            return 0, size, 200
+        if not m.group(1):  # suffix range
+            return max(0, size - int(m.group(2))), size, 206
+
+        start = int(m.group(1))
+        end = min(size, int(m.group(2)) + 1) if m.group(2) else size
+        if start >= size or start >= end:
+            return None
+        return start, end, 206
+
+    def do_HEAD(self):
+        data = self._file()
+        if data is None:
+            return
+        self.server.count('head')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"%x"' % len(data))
+        self.end_headers()
+
+    def do_GET(self):
+        data = self._file()
+        if data is None:
+            return
+        rng = self._range(len(data))
+        if rng is None:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%s' % len(data))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start, end, status = rng
+        fault, cut = self.server.next_fault(end - start)
+        self.server.count('get')
+        self.send_response(status)
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', 'bytes %s-%s/%s' % (start, end - 1, len(data)))
+        if fault == FAULT_NO_LENGTH:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        else:
+            self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+
+        view = memoryview(data)
+        if fault in (FAULT_DROP, FAULT_TRUNCATE):
+            end = start + cut
+        stall_at = start + cut if fault == FAULT_STALL else None
+        pos = start
+        try:
+            while pos < end:
+                if stall_at is not None and pos >= stall_at:
+                    time.sleep(self.server.plan.stall_time)
+                    stall_at = None
+                nxt = min(end, pos + WRITE_BLOCK)
+                if stall_at is not None:
+                    nxt = min(nxt, stall_at)
+                self.wfile.write(view[pos:nxt])
+                pos = nxt
+            self.wfile.flush()
+        except socket.error:
+            self.close_connection = True
+            return
+        finally:
+            self.server.count('bytes', pos - start)
+
+        if fault == FAULT_DROP:  # reset, not a clean close
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.close_connection = True
+        elif fault == FAULT_TRUNCATE:
+            self.close_connection = True
+
+
+class FaultServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server serving the files dict {path: bytes} with the fault plan.
+    stats() reports the requests, bytes sent and faults injected.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, files=None, plan=None, host='127.0.0.1', port=0):
+        HTTPServer.__init__(self, (host, port), _Handler)
+        self.files = dict(files or {})
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = collections.Counter()
+        self.set_plan(plan or NO_FAULTS)
+
+    def __repr__(self):
+        return 'FaultServer(url=%r, plan=%r)' % (self.url(''), self.plan)
+
+    def set_plan(self, plan):
+        """
+        Replaces the fault plan, the random generator restarts with the plan seed
+        :param plan:
+        :return:
+        """
+        with self._lock:
+            self.plan = plan
+            self._random = random.Random(plan.seed)
+            self._faults = 0
+
+    def next_fault(self, size):
+        """
+        Draws the fault of the next GET response
+        :param size: body size
+        :return: (fault or None, byte position of the fault in the body)
+        """
+        plan = self.plan
+        with self._lock:
+            x = self._random.random()
+            cut = self._random.randint(0, max(0, size - 1))
+            if plan.max_faults is not None and self._faults >= plan.max_faults:
+                return None, cut
+
+            fault = None
+            for name, p in ((FAULT_DROP, plan.drop), (FAULT_TRUNCATE, plan.truncate),
+                            (FAULT_STALL, plan.stall), (FAULT_NO_LENGTH, plan.no_length)):
+                if x < p:
+                    fault = name
+                    break
+                x -= p
+            if fault is not None:
+                self._faults += 1
+                self._stats[fault] += 1
+            return fault, cut
+
+    def count(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def url(self, path):
+        return 'http://%s:%s%s' % (self.server_address[0], self.server_address[1], path)
+
+    def start(self):
+        """
+        Serves on a background thread
+        :return:
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name='fault-server')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fault injecting HTTP server')
+    parser.add_argument('--host', dest='host', default='127.0.0.1')
+    parser.add_argument('--port', dest='port', type=int, default=8080)
+    parser.add_argument('--drop', dest='drop', type=float, default=0.0, help='connection reset probability')
+    parser.add_argument('--truncate', dest='truncate', type=float, default=0.0, help='truncated body probability')
+    parser.add_argument('--stall', dest='stall', type=float, default=0.0, help='stalled body probability')
+    parser.add_argument('--stall-time', dest='stall_time', type=float, default=1.0, help='stall seconds')
+    parser.add_argument('--no-length', dest='no_length', type=float, default=0.0,
+                        help='missing Content-Length probability')
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    parser.add_argument('files', nargs='+', help='files served as /<basename>')
+    args = parser.parse_args()
+
+    files = {}
+    for fname in args.files:
+        with open(fname, 'rb') as fh:
+            files['/' + os.path.basename(fname)] = fh.read()
+
+    plan = FaultPlan(drop=args.drop, truncate=args.truncate, stall=args.stall, stall_time=args.stall_time,
+                     no_length=args.no_length, seed=args.seed)
+    server = FaultServer(files, plan, host=args.host, port=args.port)
+    print('Serving %s' % ', '.join(server.url(x) for x in sorted(files)))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Minimal asyncio HTTP/1.1 client for the async input objects - HEAD and streamed GET
+over asyncio streams, Content-Length, chunked and read-until-close bodies, redirects,
+basic auth and keep-alive connection reuse. Python 3 only.
+
+Any session object with async head(url, **kwargs) / get(url, **kwargs) returning a response
+with status_code, headers, async read(size), raise_for_status() and close() can be used instead,
+e.g., a thin aiohttp wrapper. Proxies are not supported by this client, use such a session for them.
+"""
+
+import asyncio
+import base64
+import collections
+import logging
+import ssl
+
+from urllib.parse import urlsplit, urljoin
+
+from requests.structures import CaseInsensitiveDict
+
+
+logger = logging.getLogger(__name__)
+
+
+MAX_REDIRECTS = 10
+"""Maximal number of followed redirects"""
+
+MAX_IDLE_PER_HOST = 8
+"""Maximal number of idle keep-alive connections kept per host"""
+
+READ_LIMIT = 256 * 1024
+"""asyncio stream buffer limit, also the maximal header line length"""
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+class AsyncHttpError(IOError):
+    """
+    HTTP protocol error or error status
+    """
+    def __init__(self, message, status_code=None):
+        super(AsyncHttpError, self).__init__(message)
+        self.status_code = status_code
+
+
+class AsyncHttpResponse(object):
+    """
+    Streamed response, read() returns b'' at the end of the body.
+    A body shorter than the Content-Length raises AsyncHttpError.
+    The connection returns to the client pool after the whole body is read.
+    """
+    def __init__(self, client, key, reader, writer, method, url, status_code, reason, headers, timeout=None):
+        self.client = client
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.timeout = timeout
+        self._key = key
+        self._reader = reader
+        self._writer = writer
+
+        self._chunked = 'chunked' in headers.get('Transfer-Encoding', '').lower()
+        self._remaining = None  # body bytes left, None = until close
+        self._chunk_left = 0
+        self._eof = False
+        self._keep_alive = headers.get('Connection', '').lower() != 'close'
+
+        if method == 'HEAD' or status_code in (204, 304) or 100 <= status_code < 200:
+            self._remaining = 0
+        elif not self._chunked and 'Content-Length' in headers:
+            self._remaining = int(headers['Content-Length'])
+        elif not self._chunked:
+            self._keep_alive = False
+        if self._remaining == 0:
+            self._finish()
+
+    def __repr__(self):
+        return 'AsyncHttpResponse(url=%r, status_code=%r)' % (self.url, self.status_code)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise AsyncHttpError('%s %s for url %s' % (self.status_code, self.reason, self.url),
+                                 status_code=self.status_code)
+
+    async def read(self, size=None):
+        """
+        Reads up to size bytes of the body, everything if size is None
+        :param size:
+        :return: bytes, b'' at the end of the body
+        """
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                data = await self.read(READ_LIMIT)
+                if not data:
+                    return b''.join(chunks)
+                chunks.append(data)
+
+        if self._eof or size == 0:
+            return b''
+        if self._chunked:
+            return await self._read_chunked(size)
+
+        if self._remaining is not None:
+            size = min(size, self._remaining)
+        data = await _wait(self._reader.read(size), self.timeout)
+        if self._remaining is None:
+            if not data:
+                self._finish()
+            return data
+
+        if not data:
+            self._fail()
+            raise AsyncHttpError('Connection closed, %s body bytes missing from %s' % (self._remaining, self.url))
+        self._remaining -= len(data)
+        if self._remaining == 0:
+            self._finish()
+        return data
+
+    async def _read_chunked(self, size):
+        if self._chunk_left == 0:
+            line = await _wait(self._reader.readline(), self.timeout)
+            try:
+                self._chunk_left = int(line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                self._fail()
+                raise AsyncHttpError('Invalid chunk header %r from %s' % (line[:64], self.url))
+
+            if self._chunk_left == 0:
+                while True:  # trailers
+                    line = await _wait(self._reader.readline(), self.timeout)
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                self._finish()
+                return b''
+
+        data = await _wait(self._reader.read(min(size, self._chunk_left)), self.timeout)
+        if not data:
+            self._fail()
+            raise AsyncHttpError('Connection closed in a chunk from %s' % self.url)
+        self._chunk_left -= len(data)
+        if self._chunk_left == 0:
+            await _wait(self._reader.readline(), self.timeout)  # chunk CRLF
+        return data
+
+    def _finish(self):
+        """
+        Body read completely, keep-alive connection goes back to the pool
+        :return:
+        """
+        self._eof = True
+        if self._writer is None:
+            return
+        if self._keep_alive:
+            self.client._release(self._key, self._reader, self._writer)
+        else:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    def _fail(self):
+        self._eof = True
+        self._keep_alive = False
+        self.close()
+
+    def close(self):
+        """
+        Closes the connection unless the body was read completely and it went back to the pool
+        :return:
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+
+class AsyncHttpClient(object):
+    """
+    asyncio HTTP client with per-host keep-alive connection reuse,
+    the counterpart of ConnectionPool shareable by the async link objects.
+    """
+    def __init__(self, max_idle_per_host=MAX_IDLE_PER_HOST, keep_alive=True, ssl_context=None):
+        self.max_idle_per_host = max_idle_per_host
+        self.keep_alive = keep_alive
+        self.ssl_context = ssl_context
+        self._idle = collections.defaultdict(list)  # (scheme, host, port) -> [(reader, writer)]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def __repr__(self):
+        return 'AsyncHttpClient(max_idle_per_host=%r, keep_alive=%r)' % (self.max_idle_per_host, self.keep_alive)
+
+    async def head(self, url, **kwargs):
+        return await self.request('HEAD', url, **kwargs)
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def request(self, method, url, headers=None, auth=None, timeout=None, allow_redirects=True):
+        """
+        Sends the request, returns the response with the headers read and the body not read
+        :param method:
+        :param url:
+        :param headers:
+        :param auth: (user, password) for the basic authentication
+        :param timeout: seconds for connecting and for each network read
+        :param allow_redirects:
+        :return: AsyncHttpResponse
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            r = await self._request(method, url, headers, auth, timeout)
+            if not allow_redirects or r.status_code not in REDIRECT_CODES or 'Location' not in r.headers:
+                return r
+
+            r.close()
+            location = urljoin(url, r.headers['Location'])
+            if _origin(location) != _origin(url):
+                # credentials are not sent to another host, as in requests
+                auth = None
+                headers = CaseInsensitiveDict(headers or {})
+                headers.pop('Authorization', None)
+            url = location
+            if r.status_code == 303:
+                method = 'GET' if method != 'HEAD' else method
+        raise AsyncHttpError('Too many redirects for url %s' % url)
+
+    async def _request(self, method, url, headers, auth, timeout):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise AsyncHttpError('Unsupported URL scheme %s' % url)
+        key = _origin(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        req_headers = CaseInsensitiveDict()
+        req_headers['Host'] = parts.netloc.rsplit('@', 1)[-1]
+        req_headers['User-Agent'] = 'input_objects-async'
+        req_headers['Accept-Encoding'] = 'identity'
+        if not self.keep_alive:
+            req_headers['Connection'] = 'close'
+        if auth is not None:
+            token = base64.b64encode(('%s:%s' % auth).encode('utf8')).decode('ascii')
+            req_headers['Authorization'] = 'Basic %s' % token
+        req_headers.update(headers or {})
+        head = ''.join(['%s %s HTTP/1.1\r\n' % (method, path)] +
+                       ['%s: %s\r\n' % (k, v) for k, v in req_headers.items()] + ['\r\n']).encode('latin1')
+
+        # a pooled connection may have been closed by the server meanwhile, retried once on a new one
+        while True:
+            reader, writer, reused = await self._connect(key, timeout)
+            try:
+                writer.write(head)
+                await _wait(writer.drain(), timeout)
+                status_line = await _wait(reader.readline(), timeout)
+                if not status_line:
+                    raise AsyncHttpError('Connection closed before the response from %s' % url)
+                break
+            except (AsyncHttpError, ConnectionError):
+                writer.close()
+                if not reused:
+                    raise
+            except BaseException:
+                writer.close()
+                raise
+
+        try:
+            proto, status, reason = (status_line.decode('latin1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+            status_code = int(status)
+            resp_headers = CaseInsensitiveDict()
+            while True:
+                line = await _wait(reader.readline(), timeout)
+                if line in (b'\r\n', b'\n'):
+                    break
+                if not line:
+                    raise AsyncHttpError('Connection closed in the response headers from %s' % url)
+                name, _, value = line.decode('latin1').partition(':')
+                name, value = name.strip(), value.strip()
+                resp_headers[name] = '%s, %s' % (resp_headers[name], value) if name in resp_headers else value
+        except ValueError:
+            writer.close()
+            raise AsyncHttpError('Invalid response status %r from %s' % (status_line[:64], url))
+        except BaseException:
+            writer.close()
+            raise
+
+        r = AsyncHttpResponse(self, key, reader, writer, method, url, status_code, reason, resp_headers,
+                              timeout=timeout)
+        if proto == 'HTTP/1.0' and resp_headers.get('Connection', '').lower() != 'keep-alive':
+            r._keep_alive = False
+        return r
+
+    async def _connect(self, key, timeout):
+        """
+        Returns an idle pooled connection for the host or a new one
+        :param key:
+        :param timeout:
+        :return: (reader, writer, reused)
+        """
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+
+        scheme, host, port = key
+        ssl_ctx = None
+        if scheme == 'https':
+            ssl_ctx = self.ssl_context or ssl.create_default_context()
+        reader, writer = await _wait(asyncio.open_connection(host, port, ssl=ssl_ctx, limit=READ_LIMIT), timeout)
+        return reader, writer, False
+
+    def _release(self, key, reader, writer):
+        """
+        Returns the connection with the body read completely to the pool
+        :param key:
+        :param reader:
+        :param writer:
+        :return:
+        """
+        idle = self._idle[key]
+        if not self.keep_alive or len(idle) >= self.max_idle_per_host or reader.at_eof():
+            writer.close()
+            return
+        idle.append((reader, writer))
+
+    async def close(self):
+        """
+        Closes the idle connections
+        :return:
+        """
+        for idle in self._idle.values():
+            for _, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+
+def _origin(url):
+    """
+    Returns (scheme, host, port) of the URL
+    :param url:
+    :return:
+    """
+    parts = urlsplit(url)
+    return parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80)
+
+
+async def _wait(coro, timeout):
+    if timeout is None:
+        return await coro
+    return await asyncio.wait_for(coro, timeout)
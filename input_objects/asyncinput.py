@@ -0,0 +1,1107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+asyncio input objects - async counterparts of the link, reconnecting link, merged, tee and gzip
+input objects, many streams share one event loop instead of a thread each. Python 3 only.
+
+Objects support async with, await read(), async for line in obj and readline().
+to_state() produces the same dictionaries as the blocking objects, so a checkpoint
+can be resumed by async_from_state() or by the blocking from_state().
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import random
+import shutil
+import time
+import traceback
+
+from asynchttp import AsyncHttpClient
+from gzipinputstream import GzipInputStream
+from linebuffer import LineBuffer
+from retry import to_retry_policy
+from sinks import to_writer, SINK_BLOCK, SINK_MAX_BYTES
+from digest import to_policy, close_digest, DEFAULT_DIGEST
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRequestFailedTooManyTimes(Exception):
+    """Request just keeps failing"""
+
+
+class AsyncRequestReturnedEmptyResponse(Exception):
+    """Internally used exception to signalize need for reconnect"""
+
+
+class AsyncInputObject(object):
+    """
+    Async input stream object, see InputObject.
+    digest - DigestPolicy or algorithm name of the hash computed over the read data, None disables hashing.
+    """
+    def __init__(self, rec=None, aux=None, digest=DEFAULT_DIGEST, *args, **kwargs):
+        self.digest = to_policy(digest).new_digest()
+        self.data_read = 0
+        self._digest_offset = 0
+        self._resume_offset = None
+
+        self.rec = rec
+        self.aux = aux
+
+        # readline iterators
+        self._buffer = LineBuffer()
+        self._done = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        close_digest(self.digest)
+
+    def __repr__(self):
+        return 'AsyncInputObject(data_read=%r)' % self.data_read
+
+    def set_digest(self, digest):
+        """
+        Replaces the digest, DigestPolicy or algorithm name. Has to be called before reading.
+        :param digest:
+        :return:
+        """
+        close_digest(self.digest)
+        self.digest = to_policy(digest).new_digest()
+
+    def _account(self, data):
+        """
+        Accounts the data returned by read - digest and the number of bytes read
+        :param data:
+        :return:
+        """
+        self.digest.update(data)
+        self.data_read += len(data)
+
+    def check(self):
+        """
+        Checks if stream is readable
+        :return:
+        """
+
+    def size(self):
+        return -1
+
+    async def read(self, size=None):
+        """
+        Reads size of data
+        :param size:
+        :return:
+        """
+        raise NotImplementedError('Not implemented - base class')
+
+    async def readinto(self, b):
+        """
+        Reads data to the pre-allocated writable buffer b, returns number of bytes read
+        :param b:
+        :return:
+        """
+        data = await self.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+    def to_state(self):
+        """
+        Returns state dictionary for serialization, same as the blocking counterpart
+        :return:
+        """
+        js = collections.OrderedDict()
+        js['type'] = 'InputObject'
+        js['data_read'] = self.data_read
+        js['digest'] = self.digest.name
+        js['hexdigest'] = self.digest.hexdigest()
+        js['digest_offset'] = self._digest_offset
+        return js
+
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        """
+        Creates the input object from the to_state() dictionary, see async_from_state()
+        :param js: state dictionary
+        :param build: build(js, position) rebuilds the wrapped input objects
+        :param session: shared AsyncHttpClient for the link objects
+        :return:
+        """
+        raise ValueError('Input object %s cannot be rebuilt from the state' % js.get('type'))
+
+    def _resume_at(self, position):
+        """
+        Sets the position the input object continues at after entering
+        :param position:
+        :return:
+        """
+        self._resume_offset = position
+        self._digest_offset = position
+
+    def short_desc(self):
+        return self.__repr__()
+
+    def tell(self):
+        return self.data_read - len(self._buffer)
+
+    def seekable(self):
+        return False
+
+    async def seek(self, offset, whence=0):
+        """
+        Changes the read position, see InputObject.seek()
+        :param offset:
+        :param whence:
+        :return: new position
+        """
+        if not self.seekable():
+            raise IOError('Seek is not supported by %s' % self.__class__.__name__)
+
+        if whence == 0:
+            position = offset
+        elif whence == 1:
+            position = self.data_read - len(self._buffer) + offset
+        else:
+            raise IOError('Illegal argument')
+        if position < 0:
+            raise IOError('Negative seek position')
+
+        await self._seek(position)
+        self._buffer.clear()
+        self._done = False
+        return position
+
+    async def _seek(self, position):
+        raise NotImplementedError('Not implemented - base class')
+
+    def flush(self):
+        pass
+
+    def children(self):
+        """
+        Returns input objects wrapped by this one
+        :return:
+        """
+        return []
+
+    #
+    # Line reading
+    #
+
+    async def _fill(self, num_bytes):
+        """
+        Fill the internal buffer with 'num_bytes' of data.
+        @param num_bytes: int, number of bytes to read in (0 = everything)
+        """
+        if self._done:
+            return
+
+        while not num_bytes or len(self._buffer) < num_bytes:
+            data = await self.read(32768)
+            if not data:
+                self._done = True
+                break
+
+            self._buffer.feed(data)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        line = await self.readline()
+        if not line:
+            raise StopAsyncIteration()
+        return line
+
+    async def readline(self):
+        """
+        Read a single line
+        :return:
+        """
+        buf = self._buffer
+        while True:
+            line = buf.readline()
+            if line is not None:
+                return line
+
+            # no complete line buffered, the rest is the last line
+            if self._done:
+                return buf.read()
+
+            await self._fill(len(buf) + 1)
+
+    async def readlines(self):
+        lines = []
+        while True:
+            line = await self.readline()
+            if not line:
+                break
+            lines.append(line)
+        return lines
+
+
+class AsyncLinkInputObject(AsyncInputObject):
+    """
+    Async counterpart of LinkInputObject - single streamed GET.
+    session is a shared AsyncHttpClient, by default the object uses its own.
+    """
+    def __init__(self, url, headers=None, auth=None, timeout=None, session=None, digest=DEFAULT_DIGEST,
+                 *args, **kwargs):
+        super(AsyncLinkInputObject, self).__init__(digest=digest, *args, **kwargs)
+        self.url = url
+        self.headers = headers
+        self.auth = auth
+        self.r = None
+        self.timeout = timeout
+        self.session = session
+        self._own_session = None
+
+    def _http(self):
+        """
+        Returns the HTTP client - shared session if set
+        :return:
+        """
+        if self.session is not None:
+            return self.session
+        if self._own_session is None:
+            self._own_session = AsyncHttpClient()
+        return self._own_session
+
+    async def __aenter__(self):
+        await super(AsyncLinkInputObject, self).__aenter__()
+        headers = self.headers
+        if self._resume_offset:
+            headers = dict(self.headers) if self.headers is not None else {}
+            headers['Range'] = 'bytes=%s-' % self._resume_offset
+
+        self.r = await self._http().get(self.url, headers=headers, auth=self.auth, timeout=self.timeout)
+        if self._resume_offset:
+            await self._skip_to_resume()
+        return self
+
+    async def _skip_to_resume(self):
+        """
+        Skips the data before the resume position if the server ignored the Range header
+        :return:
+        """
+        if self.r.status_code != 206:
+            logger.info('Link %s ignored the range request, skipping %s bytes' % (self.url, self._resume_offset))
+            to_skip = self._resume_offset
+            while to_skip > 0:
+                data = await self.r.read(min(to_skip, 65536))
+                if not data:
+                    break
+                to_skip -= len(data)
+        self.data_read = self._resume_offset
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await super(AsyncLinkInputObject, self).__aexit__(exc_type, exc_val, exc_tb)
+        if self.r is not None:
+            self.r.close()
+        if self._own_session is not None:
+            await self._own_session.close()
+
+    def __repr__(self):
+        return 'AsyncLinkInputObject(url=%r)' % self.url
+
+    def __str__(self):
+        return self.url
+
+    def check(self):
+        return True
+
+    async def read(self, size=None):
+        data = await self.r.read(size)
+        self._account(data)
+        return data
+
+    def to_state(self):
+        js = super(AsyncLinkInputObject, self).to_state()
+        js['type'] = 'LinkInputObject'
+        js['url'] = self.url
+        js['headers'] = self.headers
+        js['timeout'] = self.timeout
+        js['rec'] = self.rec
+        return js
+
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        iobj = cls(js['url'], headers=js.get('headers'), timeout=js.get('timeout'), session=session,
+                   digest=js.get('digest', DEFAULT_DIGEST))
+        iobj.rec = js.get('rec')
+        return iobj
+
+
+class AsyncReconnectingLinkInputObject(AsyncInputObject):
+    """
+    Async counterpart of ReconnectingLinkInputObject - HEAD for the length and range support,
+    reconnects with the Range header after errors, retry is the RetryPolicy.
+    Backoff waits are asyncio sleeps, close() or cancelling the reading task stops them at once.
+    The parallel range download is not supported, run more objects concurrently instead.
+    """
+    def __init__(self, url, rec=None, headers=None, auth=None, timeout=None,
+                 max_reconnects=None, start_offset=0, pre_data_reconnect_hook=None,
+                 session=None, retry=None, digest=DEFAULT_DIGEST, *args, **kwargs):
+        super(AsyncReconnectingLinkInputObject, self).__init__(digest=digest, *args, **kwargs)
+        self.url = url
+        self.headers = headers
+        self.auth = auth
+        self.rec = rec
+        self.timeout = timeout
+        self.max_reconnects = max_reconnects
+        self.start_offset = start_offset
+        self.pre_data_reconnect_hook = pre_data_reconnect_hook
+        self.session = session
+        self.retry = to_retry_policy(retry, max_reconnects)
+
+        # Overall state
+        self.stop_event = asyncio.Event()
+        self.retry_state = self.retry.new_state()
+        self.content_length = None
+        self.total_reconnections = 0
+        self.reconnections = 0
+        self.last_reconnection = 0
+        self.head_headers = None
+        self.range_bytes_supported = False
+
+        # Current state
+        self.r = None
+        self.current_content_length = 0
+        self._own_session = None
+
+    def _http(self):
+        """
+        Returns the HTTP client - shared session if set
+        :return:
+        """
+        if self.session is not None:
+            return self.session
+        if self._own_session is None:
+            self._own_session = AsyncHttpClient()
+        return self._own_session
+
+    def close(self):
+        """
+        Stops retrying, pending backoff sleeps end at once
+        :return:
+        """
+        self.stop_event.set()
+
+    async def _backoff(self, op, current_attempt, since):
+        """
+        Waits before the next attempt w.r.t. the retry policy
+        :param op: operation name for the metrics
+        :param current_attempt: failed attempts in a row
+        :param since: time of the first failure in the row
+        :return:
+        """
+        delay = self.retry_state.next_delay(op, current_attempt, since)
+        if delay is None:
+            if self.stop_event.is_set():
+                return
+            raise AsyncRequestFailedTooManyTimes()
+        try:
+            await asyncio.wait_for(self.stop_event.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _load_info(self):
+        """
+        Performs head request on the url to load info & capabilities
+        :return:
+        """
+        r = None
+        current_attempt = 0
+        since = None
+
+        while not self.stop_event.is_set():
+            try:
+                r = await self._http().head(self.url, headers=self.headers, auth=self.auth, timeout=self.timeout)
+                if r.status_code // 100 != 2:
+                    logger.error('Link %s does not support head request or link is broken' % self.url)
+                    return
+                break
+
+            except Exception as e:
+                logger.warning('Exception in fetching the url: %s' % e)
+                logger.debug(traceback.format_exc())
+                current_attempt += 1
+                since = since or time.time()
+                await self._backoff('head', current_attempt, since)
+
+        self.retry_state.finished('head', current_attempt, since)
+        if r is None:  # cancelled
+            return
+        self.head_headers = r.headers
+
+        try:
+            self.content_length = int(r.headers['Content-Length'])
+        except KeyError:
+            logger.error('Link %s does not return content length' % self.url)
+
+        if 'Accept-Ranges' in r.headers:
+            self.range_bytes_supported = 'bytes' in r.headers['Accept-Ranges']
+
+        logger.debug('URL %s head loaded. Content length: %s, accept range: %s'
+                     % (self.url, self.content_length, self.range_bytes_supported))
+
+    def _get_headers(self):
+        """
+        Builds headers for the request
+        :return:
+        """
+        headers = dict(self.headers) if self.headers is not None else {}
+
+        if (self.start_offset is None or self.start_offset == 0) and self.data_read == 0:
+            return headers
+
+        headers['Range'] = 'bytes=%s-' % (self.start_offset + self.data_read)
+        return headers
+
+    def _is_all_data_loaded(self):
+        """
+        Returns true if all requested data is loaded already.
+        :return:
+        """
+        if self.content_length is None:
+            logger.warning('Could not determine if finished...')
+            return None
+
+        return self.content_length - self.start_offset - self.data_read <= 0
+
+    async def _request(self):
+        """
+        Connects to the server
+        :return:
+        """
+        headers = self._get_headers()
+        if self.r is not None:
+            self.r.close()
+            self.r = None
+
+        current_attempt = 0
+        since = None
+        while not self.stop_event.is_set():
+            try:
+                logger.info('Reconnecting[%02d, %02d] to the url: %s, timeout: %s, headers: %s'
+                            % (current_attempt, self.reconnections, self.url, self.timeout, headers))
+                self.r = await self._http().get(self.url, headers=headers, auth=self.auth, timeout=self.timeout)
+                self.r.raise_for_status()
+                if 'Range' in headers and self.r.status_code != 206:
+                    raise ValueError('Range request not honored, status %s' % self.r.status_code)
+                break
+
+            except Exception as e:
+                logger.warning('Exception in fetching the url: %s' % e)
+                logger.debug(traceback.format_exc())
+                if self.r is not None:
+                    self.r.close()
+                    self.r = None
+                current_attempt += 1
+                since = since or time.time()
+                await self._backoff('request', current_attempt, since)
+
+        self.retry_state.finished('request', current_attempt, since)
+        self.reconnections += 1
+        self.last_reconnection = time.time()
+        if self.r is None:  # stopped
+            return
+
+        try:
+            self.current_content_length = int(self.r.headers['Content-Length'])
+        except KeyError:
+            logger.error('Link %s does not return content length' % self.url)
+
+    async def __aenter__(self):
+        await super(AsyncReconnectingLinkInputObject, self).__aenter__()
+        if self._resume_offset:
+            self.data_read = self._resume_offset
+        if self.head_headers is None:
+            await self._load_info()
+        await self._request()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await super(AsyncReconnectingLinkInputObject, self).__aexit__(exc_type, exc_val, exc_tb)
+        self.stop_event.set()
+        if self.r is not None:
+            self.r.close()
+            self.r = None
+        if self._own_session is not None:
+            await self._own_session.close()
+
+    def __repr__(self):
+        return 'AsyncReconnectingLinkInputObject(url=%r)' % self.url
+
+    def __str__(self):
+        return self.url
+
+    def check(self):
+        return True
+
+    async def read(self, size=None):
+        """
+        Reading a given size of data from the stream, reconnects on errors
+        :param size:
+        :return:
+        """
+        current_attempt = 0
+        since = None
+        while not self.stop_event.is_set():
+            try:
+                if self.r is None:
+                    raise AsyncRequestReturnedEmptyResponse()
+                data = await self.r.read(size)
+
+                if len(data) == 0:
+                    logger.info('Empty data read, total so far: %s, offset: %s, content length: %s'
+                                % (self.data_read, self.start_offset, self.content_length))
+
+                    all_data_loaded = self._is_all_data_loaded()
+                    if all_data_loaded is None or all_data_loaded is True:
+                        return data
+                    raise AsyncRequestReturnedEmptyResponse()
+
+                self._account(data)
+                self.retry_state.finished('read', current_attempt, since)
+                return data
+
+            except Exception as e:
+                logger.error('Exception when reading data: %s' % e)
+                logger.debug(traceback.format_exc())
+
+                if self.pre_data_reconnect_hook is not None:
+                    self.pre_data_reconnect_hook(self)
+                current_attempt += 1
+                since = since or time.time()
+                await self._backoff('read', current_attempt, since)
+                await self._request()
+
+        return b''
+
+    def seekable(self):
+        return self.range_bytes_supported
+
+    async def _seek(self, position):
+        self.data_read = position
+        await self._request()
+
+    def to_state(self):
+        js = super(AsyncReconnectingLinkInputObject, self).to_state()
+        js['type'] = 'ReconnectingLinkInputObject'
+        js['url'] = self.url
+        js['start_offset'] = self.start_offset
+        js['headers'] = dict(self.headers) if self.headers is not None else None
+        js['timeout'] = self.timeout
+        js['rec'] = self.rec
+
+        js['max_reconnects'] = self.max_reconnects
+        js['retry'] = self.retry.to_state()
+        js['retry_stats'] = self.retry_state.stats()
+        js['content_length'] = self.content_length
+        js['total_reconnections'] = self.total_reconnections
+        js['reconnections'] = self.reconnections
+        js['last_reconnection'] = self.last_reconnection
+        js['head_headers'] = dict(self.head_headers) if self.head_headers is not None else None
+        js['range_bytes_supported'] = self.range_bytes_supported
+        js['current_content_length'] = self.current_content_length
+        js['parallel_connections'] = None
+        return js
+
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        return cls(js['url'], rec=js.get('rec'), headers=js.get('headers'), timeout=js.get('timeout'),
+                   max_reconnects=js.get('max_reconnects'), start_offset=js.get('start_offset') or 0,
+                   retry=js.get('retry'), session=session, digest=js.get('digest', DEFAULT_DIGEST))
+
+
+class AsyncTeeInputObject(AsyncInputObject):
+    """
+    Async counterpart of TeeInputObject - copies the read data to copy_fh or the copy_fname file
+    (written to a temporary file, renamed on exit) and to the write-behind sinks.
+    File writes are local and done in the loop thread. A full SINK_BLOCK sink is waited for
+    in the default executor, so the loop keeps running other streams.
+    """
+    def __init__(self, parent_fh, copy_fh=None, close_copy_on_exit=False, copy_fname=None,
+                 sinks=None, sink_policy=SINK_BLOCK, sink_max_bytes=SINK_MAX_BYTES, *args, **kwargs):
+        super(AsyncTeeInputObject, self).__init__(*args, **kwargs)
+        self.parent_fh = parent_fh
+        self.copy_fh = copy_fh
+        self.copy_fname = copy_fname
+        self.copy_fname_tmp = None
+        self.close_copy_on_exit = close_copy_on_exit
+        self.sink_policy = sink_policy
+        self.sink_max_bytes = sink_max_bytes
+        self.writers = [to_writer(x, policy=sink_policy, max_bytes=sink_max_bytes, name='tee-sink-%s' % idx)
+                        for idx, x in enumerate(sinks or [])]
+        self._replay_fh = None  # copy written before the resume, served before the parent data
+        self._replay_left = 0
+
+    async def __aenter__(self):
+        await super(AsyncTeeInputObject, self).__aenter__()
+        if self.copy_fh is None and self.copy_fname is not None and \
+                (self._resume_offset is None or self.copy_fname_tmp is None):
+            self.copy_fname_tmp = '%s.%s.%s' % (self.copy_fname, int(time.time()*1000), random.randint(0, 1000))
+            self.copy_fh = open(self.copy_fname_tmp, 'wb')
+            logger.debug('Tee to temp file %s' % self.copy_fname_tmp)
+
+        await self.parent_fh.__aenter__()
+        if self._resume_offset is not None:
+            await self._resume_copy()
+        for writer in self.writers:
+            writer.start()
+        return self
+
+    async def _resume_copy(self):
+        """
+        Continues the copy at the position of the resumed parent, see TeeInputObject._resume_copy()
+        :return:
+        """
+        if self.copy_fh is None:
+            self.copy_fh = open(self.copy_fname_tmp, 'r+b')
+            self.copy_fh.truncate(self.parent_fh.tell())
+            self.copy_fh.seek(0, os.SEEK_END)
+            logger.debug('Tee resumed to temp file %s at %s' % (self.copy_fname_tmp, self.parent_fh.tell()))
+
+        self.data_read = self.parent_fh.tell()
+        if self._resume_offset < self.data_read:
+            self.copy_fh.flush()
+            self._replay_fh = open(self.copy_fname_tmp, 'rb')
+            self._replay_fh.seek(self._resume_offset)
+            self._replay_left = self.data_read - self._resume_offset
+            self.data_read = self._resume_offset
+            return
+
+        while self.data_read < self._resume_offset:
+            data = await self.parent_fh.read(min(self._resume_offset - self.data_read, 65536))
+            if not data:
+                break
+            self.copy_fh.write(data)
+            self.data_read += len(data)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await super(AsyncTeeInputObject, self).__aexit__(exc_type, exc_val, exc_tb)
+        self._close_replay()
+        try:
+            await self.parent_fh.__aexit__(exc_type, exc_val, exc_tb)
+        except Exception as e:
+            logger.debug('Exception when exiting to the parent fh %s' % e)
+            logger.debug(traceback.format_exc())
+
+        loop = asyncio.get_event_loop()
+        for writer in self.writers:
+            try:
+                await loop.run_in_executor(None, writer.close)
+            except Exception as e:
+                logger.warning('Exception when closing the sink %s: %s' % (writer, e))
+                logger.debug(traceback.format_exc())
+
+        if self.close_copy_on_exit or self.copy_fname_tmp is not None:
+            try:
+                self.copy_fh.close()
+            except Exception as e:
+                logger.debug('Exception when closing copy fh %s' % e)
+                logger.debug(traceback.format_exc())
+
+        if self.copy_fname_tmp is not None:
+            logger.debug('Moving %s -> %s' % (self.copy_fname_tmp, self.copy_fname))
+            shutil.move(self.copy_fname_tmp, self.copy_fname)
+
+    def __repr__(self):
+        return 'AsyncTeeInputObject(parent_fh=%r, copy_fh=%r)' % (self.parent_fh, self.copy_fh)
+
+    def __str__(self):
+        return str(self.parent_fh)
+
+    def check(self):
+        return self.parent_fh.check()
+
+    def size(self):
+        return self.parent_fh.size()
+
+    def _close_replay(self):
+        if self._replay_fh is not None:
+            self._replay_fh.close()
+            self._replay_fh = None
+            self._replay_left = 0
+
+    def _read_replay(self, size=None):
+        """
+        Reads the data written to the copy before the resume, see TeeInputObject._read_replay()
+        :param size:
+        :return:
+        """
+        data = self._replay_fh.read(self._replay_left if size is None or size < 0 else min(size, self._replay_left))
+        if not data:
+            raise IOError('Tee copy %s is shorter than recorded' % self.copy_fname_tmp)
+        self._replay_left -= len(data)
+        if self._replay_left == 0:
+            self._close_replay()
+        return data
+
+    async def read(self, size=None):
+        if self._replay_fh is not None:
+            data = self._read_replay(size)
+            self._account(data)
+        else:
+            data = await self.parent_fh.read(size)
+            self._account(data)
+            if self.copy_fh is not None:
+                self.copy_fh.write(data)
+
+        for writer in self.writers:
+            if writer.policy == SINK_BLOCK and writer.full(len(data)):
+                await asyncio.get_event_loop().run_in_executor(None, writer.put, data)
+            else:
+                writer.put(data)
+        return data
+
+    def children(self):
+        return [self.parent_fh]
+
+    def sink_stats(self):
+        return [x.stats() for x in self.writers]
+
+    def to_state(self):
+        js = super(AsyncTeeInputObject, self).to_state()
+        js['type'] = 'TeeInputObject'
+        js['copy_fname'] = self.copy_fname
+        js['copy_fname_tmp'] = self.copy_fname_tmp
+        js['close_copy_on_exit'] = self.close_copy_on_exit
+        js['write_behind'] = False
+        js['sink_policy'] = self.sink_policy
+        js['sink_stats'] = self.sink_stats()
+        js['parent'] = self.parent_fh.to_state()
+        return js
+
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        copy_fname, copy_fname_tmp = js.get('copy_fname'), js.get('copy_fname_tmp')
+        if copy_fname is None:
+            raise ValueError('TeeInputObject without copy_fname cannot be rebuilt from the state')
+
+        position = js['data_read']
+        if copy_fname_tmp is not None and os.path.exists(copy_fname_tmp):
+            position = min(position, os.path.getsize(copy_fname_tmp))
+        else:
+            position, copy_fname_tmp = 0, None
+
+        iobj = cls(build(js['parent'], position), copy_fname=copy_fname,
+                   close_copy_on_exit=js.get('close_copy_on_exit', False),
+                   sink_policy=js.get('sink_policy', SINK_BLOCK), digest=js.get('digest', DEFAULT_DIGEST))
+        iobj.copy_fname_tmp = copy_fname_tmp
+        return iobj
+
+    def short_desc(self):
+        return 'AsyncTeeInputObject(parent=%s)' % (self.parent_fh.short_desc())
+
+    def flush(self):
+        for writer in self.writers:
+            writer.flush()
+        if self.copy_fh is not None:
+            self.copy_fh.flush()
+
+
+class AsyncMergedInputObject(AsyncInputObject):
+    """
+    Async counterpart of MergedInputObject - reads the input objects one after another.
+    With share_session the link objects without own session share one AsyncHttpClient.
+    With open_ahead=K the next K sources are opened concurrently while the current one is read.
+    """
+    def __init__(self, iobjs, close_after_use=True, session=None, share_session=True, open_ahead=0,
+                 *args, **kwargs):
+        super(AsyncMergedInputObject, self).__init__(*args, **kwargs)
+        self.iobjs = iobjs
+        self.cur_iobj = 0
+        self.finished = False
+        self._close_after_use = close_after_use
+        self._do_close = [False] * len(self.iobjs)
+        self.session = session
+        self._own_session = False
+        if share_session:
+            self._share_session()
+
+        self.open_ahead = open_ahead or 0
+        self._opening = {}  # idx -> opening task
+        self._consumed = [0] * len(self.iobjs)
+
+    def _share_session(self):
+        links = [x for iobj in self.iobjs for x in iter_async_input_objects(iobj)
+                 if isinstance(x, (AsyncLinkInputObject, AsyncReconnectingLinkInputObject)) and x.session is None]
+        if len(links) == 0:
+            return
+
+        if self.session is None:
+            self.session = AsyncHttpClient()
+            self._own_session = True
+        for x in links:
+            x.session = self.session
+
+    async def __aenter__(self):
+        await super(AsyncMergedInputObject, self).__aenter__()
+        if len(self.iobjs) > 0 and not self.finished:
+            await self._enter_sub(self.cur_iobj)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await super(AsyncMergedInputObject, self).__aexit__(exc_type, exc_val, exc_tb)
+        for idx in range(len(self.iobjs)):
+            try:
+                await self._close_sub(idx)
+            except Exception as e:
+                logger.debug('Exception when exiting from the sub fh %s %s' % (idx, e))
+                logger.debug(traceback.format_exc())
+
+        if self._own_session:
+            await self.session.close()
+
+    async def _enter_sub(self, idx):
+        if idx in self._opening:
+            await self._opening.pop(idx)
+        else:
+            await self.iobjs[idx].__aenter__()
+            self._do_close[idx] = True
+        self._open_next(idx)
+
+    def _open_next(self, idx):
+        for nxt in range(idx + 1, min(idx + 1 + self.open_ahead, len(self.iobjs))):
+            if nxt in self._opening or self._do_close[nxt]:
+                continue
+            self._opening[nxt] = asyncio.ensure_future(self._open_sub(nxt))
+
+    async def _open_sub(self, idx):
+        await self.iobjs[idx].__aenter__()
+        self._do_close[idx] = True
+
+    async def _close_sub(self, idx):
+        task = self._opening.pop(idx, None)
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+        if self._do_close[idx]:
+            self._do_close[idx] = False
+            await self.iobjs[idx].__aexit__(None, None, None)
+
+    def __repr__(self):
+        return 'AsyncMergedInputObject(iobjs=%r)' % (self.iobjs)
+
+    def check(self):
+        return self.iobjs[self.cur_iobj].check()
+
+    async def read(self, size=None):
+        while not self.finished:
+            data = await self.iobjs[self.cur_iobj].read(size)
+            if not data:
+                if self.cur_iobj + 1 == len(self.iobjs):
+                    self.finished = True
+                    return b''
+
+                if self._close_after_use:
+                    await self._close_sub(self.cur_iobj)
+                self.cur_iobj += 1
+                await self._enter_sub(self.cur_iobj)
+                continue
+
+            self._account(data)
+            self._consumed[self.cur_iobj] += len(data)
+            return data
+        return b''
+
+    def children(self):
+        return list(self.iobjs)
+
+    def to_state(self):
+        js = super(AsyncMergedInputObject, self).to_state()
+        js['type'] = 'MergedInputObject'
+        js['open_ahead'] = self.open_ahead
+        js['cur_iobj_idx'] = self.cur_iobj
+        js['finished'] = self.finished
+        js['consumed'] = self._consumed
+        js['do_close'] = self._do_close
+        js['cur_iobj'] = self.iobjs[self.cur_iobj].to_state()
+        js['iobjs'] = [x.to_state() for x in self.iobjs]
+        return js
+
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        cur = js['cur_iobj_idx']
+        consumed = js.get('consumed') or [0] * len(js['iobjs'])
+        iobjs = [build(x, consumed[idx] if idx == cur else 0) for idx, x in enumerate(js['iobjs'])]
+        iobj = cls(iobjs, open_ahead=js.get('open_ahead'), session=session, digest=js.get('digest', DEFAULT_DIGEST))
+        iobj.cur_iobj = cur
+        iobj.finished = js.get('finished', False)
+        iobj._consumed = list(consumed)
+        return iobj
+
+    def _resume_at(self, position):
+        super(AsyncMergedInputObject, self)._resume_at(position)
+        self.data_read = position
+
+    def short_desc(self):
+        return 'AsyncMergedInputObject(data_read=%r, cur=%s)' \
+               % (self.data_read, self.iobjs[self.cur_iobj].short_desc())
+
+    def flush(self):
+        self.iobjs[self.cur_iobj].flush()
+
+
+class _FedSource(object):
+    """
+    Compressed data source of GzipInputStream filled by the async reader.
+    read() returns None when no data is pending - the stream stops filling, starved is set.
+    """
+    def __init__(self):
+        self.pending = None
+        self.starved = False
+
+    def read(self, size=None):
+        data = self.pending
+        if data is None:
+            self.starved = True
+            return None
+        self.pending = None
+        return data
+
+
+class AsyncGzipInputObject(AsyncInputObject):
+    """
+    Async counterpart of GzipInputObject - the compressed blocks are read asynchronously
+    and decompressed by GzipInputStream in the loop thread, concatenated members included.
+    block_size sets the size of compressed blocks read from the underlying input object.
+    """
+    def __init__(self, iobj, block_size=None, *args, **kwargs):
+        super(AsyncGzipInputObject, self).__init__(*args, **kwargs)
+        self.iobj = iobj
+        self.block_size = block_size
+        self.gzip_fh = None
+        self._source = _FedSource()
+
+    async def __aenter__(self):
+        await super(AsyncGzipInputObject, self).__aenter__()
+        await self.iobj.__aenter__()
+        self.gzip_fh = GzipInputStream(fileobj=self._source, block_size=self.block_size)
+        if self._resume_offset:
+            # decompressed again from the start
+            to_skip = self._resume_offset
+            while to_skip > 0:
+                data = await self._decompress(min(to_skip, 65536))
+                if not data:
+                    break
+                to_skip -= len(data)
+            self.data_read = self._resume_offset - to_skip
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await super(AsyncGzipInputObject, self).__aexit__(exc_type, exc_val, exc_tb)
+        try:
+            await self.iobj.__aexit__(exc_type, exc_val, exc_tb)
+            if self.gzip_fh is not None:
+                self.gzip_fh.close()
+        except Exception as e:
+            logger.debug('Exception when exiting to the parent fh %s' % e)
+            logger.debug(traceback.format_exc())
+
+    async def _decompress(self, size):
+        """
+        Returns the decompressed data, reads compressed blocks while the stream starves
+        :param size:
+        :return: b'' at the end of the stream
+        """
+        source = self._source
+        while True:
+            source.starved = False
+            data = self.gzip_fh.read(size)
+            if data or not source.starved:
+                return data
+            source.pending = await self.iobj.read(self.gzip_fh.block_size)
+
+    def __repr__(self):
+        return 'AsyncGzipInputObject(iobj=%r)' % (self.iobj)
+
+    def check(self):
+        return self.iobj.check()
+
+    async def read(self, size=None):
+        data = await self._decompress(size)
+        self._account(data)
+        return data
+
+    def children(self):
+        return [self.iobj]
+
+    def to_state(self):
+        js = super(AsyncGzipInputObject, self).to_state()
+        js['type'] = 'GzipInputObject'
+        js['block_size'] = self.block_size
+        js['pipelined'] = False
+        js['parallel_workers'] = None
+        js['index_fname'] = None
+        js['index'] = None
+        js['iobj'] = self.iobj.to_state()
+        return js
+
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        return cls(build(js['iobj'], 0), block_size=js.get('block_size'), digest=js.get('digest', DEFAULT_DIGEST))
+
+    def short_desc(self):
+        return 'AsyncGzipInputObject(data_read=%r, iobj=%s)' % (self.data_read, self.iobj.short_desc())
+
+    def flush(self):
+        self.iobj.flush()
+
+
+def iter_async_input_objects(iobj):
+    """
+    Iterates the async input object stack depth first, starting with the given object
+    :param iobj:
+    :return:
+    """
+    yield iobj
+    for child in iobj.children():
+        for x in iter_async_input_objects(child):
+            yield x
+
+
+ASYNC_STATE_TYPES = {
+    'LinkInputObject': AsyncLinkInputObject,
+    'ReconnectingLinkInputObject': AsyncReconnectingLinkInputObject,
+    'TeeInputObject': AsyncTeeInputObject,
+    'MergedInputObject': AsyncMergedInputObject,
+    'GzipInputObject': AsyncGzipInputObject,
+}
+"""Async input object classes rebuilt by async_from_state(), by the to_state() type"""
+
+
+def async_from_state(js, factory=None, session=None, position=None):
+    """
+    Rebuilds the async input object stack from the to_state() dictionary, see from_state().
+    States of the blocking objects are accepted too, as long as each type has an async counterpart.
+    :param js: state dictionary
+    :param factory: optional callable(js) returning the input object for the state or None
+    :param session: shared AsyncHttpClient for the link objects
+    :param position: resume position, overrides the recorded data_read
+    :return:
+    """
+    def build(sub_js, sub_position):
+        return async_from_state(sub_js, factory=factory, session=session, position=sub_position)
+
+    iobj = factory(js) if factory is not None else None
+    if iobj is None:
+        cls = ASYNC_STATE_TYPES.get(js['type'])
+        if cls is None:
+            raise ValueError('Input object %s has no async counterpart, use factory' % js['type'])
+        iobj = cls._from_state(js, build, session=session)
+
+    iobj._resume_at(js.get('data_read', 0) if position is None else position)
+    return iobj
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Local on-disk content cache for remote input objects.
+
+Entries are keyed by the URL and the validators from the HEAD response (ETag, Last-Modified,
+Content-Length), a changed remote file gets a new key. A complete entry is stored as <key>.data,
+an entry being filled as <key>.part - kept when the download is interrupted and resumed later.
+
+Several processes may use the same cache directory: the entry is filled by the process holding
+the <key>.lock file lock, the others read the remote object directly. Completed entries are
+renamed atomically. Least recently used entries are evicted when the cache exceeds max_bytes,
+hits update the entry mtime. Open entries stay readable after eviction on POSIX systems.
+"""
+
+import collections
+import hashlib
+import logging
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+
+DATA_SUFFIX = '.data'
+"""Suffix of the complete entries"""
+
+PART_SUFFIX = '.part'
+"""Suffix of the entries being filled"""
+
+LOCK_SUFFIX = '.lock'
+"""Suffix of the entry fill lock files"""
+
+EVICT_LOCK = 'evict.lock'
+"""Lock file serializing the evictions"""
+
+
+class FileLock(object):
+    """
+    Exclusive inter-process lock on a lock file, flock based.
+    Without fcntl (Windows) the lock always succeeds, concurrent use is then not safe.
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        self.fh = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def __repr__(self):
+        return 'FileLock(fname=%r, locked=%r)' % (self.fname, self.fh is not None)
+
+    def acquire(self, blocking=True):
+        """
+        Acquires the lock
+        :param blocking: wait for the lock, otherwise return False if held by somebody else
+        :return: True if acquired
+        """
+        fh = open(self.fname, 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except (IOError, OSError):
+                fh.close()
+                return False
+        self.fh = fh
+        return True
+
+    def release(self):
+        if self.fh is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self.fh.fileno(), fcntl.LOCK_UN)
+        self.fh.close()
+        self.fh = None
+
+
+class ContentCache(object):
+    """
+    Size bounded content cache directory, see the module description.
+    max_bytes None = unbounded.
+    """
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):  # created concurrently otherwise
+                    raise
+
+    def __repr__(self):
+        return 'ContentCache(directory=%r, max_bytes=%r)' % (self.directory, self.max_bytes)
+
+    @staticmethod
+    def key(url, headers):
+        """
+        Returns the cache key of the URL with the HEAD response headers,
+        None if the response has no validator (ETag or Last-Modified) - not cacheable
+        :param url:
+        :param headers: HEAD response headers
+        :return:
+        """
+        if headers is None:
+            return None
+        validators = [headers.get('ETag'), headers.get('Last-Modified')]
+        if validators == [None, None]:
+            return None
+
+        validators.append(headers.get('Content-Length'))
+        material = '\n'.join([url] + ['' if x is None else x for x in validators])
+        return hashlib.sha256(material.encode('utf8')).hexdigest()
+
+    def data_fname(self, key):
+        return os.path.join(self.directory, key + DATA_SUFFIX)
+
+    def part_fname(self, key):
+        return os.path.join(self.directory, key + PART_SUFFIX)
+
+    def lock_fname(self, key):
+        return os.path.join(self.directory, key + LOCK_SUFFIX)
+
+    def lookup(self, key):
+        """
+        Returns the file name of the complete entry, None on a miss. Marks the entry as recently used.
+        :param key:
+        :return:
+        """
+        fname = self.data_fname(key)
+        try:
+            os.utime(fname, None)
+            return fname
+        except OSError:
+            return None
+
+    def lock_fill(self, key):
+        """
+        Locks the entry for filling
+        :param key:
+        :return: FileLock or None if another process fills the entry
+        """
+        lock = FileLock(self.lock_fname(key))
+        return lock if lock.acquire(blocking=False) else None
+
+    def part_size(self, key):
+        """
+        Returns the size of the partially filled entry, 0 if none
+        :param key:
+        :return:
+        """
+        try:
+            return os.path.getsize(self.part_fname(key))
+        except OSError:
+            return 0
+
+    def commit(self, key):
+        """
+        Publishes the filled entry, the fill lock has to be held. Evicts old entries.
+        :param key:
+        :return: file name of the entry
+        """
+        fname = self.data_fname(key)
+        os.rename(self.part_fname(key), fname)
+        logger.debug('Cache entry %s committed' % fname)
+        self.evict()
+        return fname
+
+    def discard(self, key):
+        """
+        Removes the partially filled entry, the fill lock has to be held
+        :param key:
+        :return:
+        """
+        try:
+            os.remove(self.part_fname(key))
+        except OSError:
+            pass
+
+    def entries(self):
+        """
+        Returns the cache entries as a list of (mtime, size, key, file name), complete and partial
+        :return:
+        """
+        res = []
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            if ext not in (DATA_SUFFIX, PART_SUFFIX):
+                continue
+            fname = os.path.join(self.directory, name)
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            res.append((st.st_mtime, st.st_size, key, fname))
+        return res
+
+    def size(self):
+        """
+        Returns the total size of the cache entries
+        :return:
+        """
+        return sum(x[1] for x in self.entries())
+
+    def evict(self, max_bytes=None):
+        """
+        Removes the least recently used entries until the cache fits max_bytes.
+        Entries being filled by other processes are skipped.
+        :param max_bytes: defaults to the cache max_bytes
+        :return: number of bytes freed
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if max_bytes is None:
+            return 0
+
+        freed = 0
+        with FileLock(os.path.join(self.directory, EVICT_LOCK)):
+            entries = sorted(self.entries())
+            total = sum(x[1] for x in entries)
+            for mtime, size, key, fname in entries:
+                if total <= max_bytes:
+                    break
+
+                lock = self.lock_fill(key)
+                if lock is None:
+                    continue
+                try:
+                    os.remove(fname)
+                    total -= size
+                    freed += size
+                    logger.debug('Cache entry %s evicted, unused for %.0f s' % (fname, time.time() - mtime))
+                except OSError as e:
+                    logger.warning('Cache entry %s could not be evicted: %s' % (fname, e))
+                finally:
+                    lock.release()
+        return freed
+
+    def to_state(self):
+        js = collections.OrderedDict()
+        js['directory'] = self.directory
+        js['max_bytes'] = self.max_bytes
+        return js
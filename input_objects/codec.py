@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compression codec detection by magic bytes and the frame decompressors for FramedInputStream.
+"""
+
+import bz2
+import logging
+
+from lz4inputstream import new_decompressor as new_lz4_decompressor
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+
+
+CODEC_AUTO = 'auto'
+CODEC_NONE = 'none'
+CODEC_GZIP = 'gzip'
+CODEC_LZ4 = 'lz4'
+CODEC_ZSTD = 'zstd'
+CODEC_BZ2 = 'bz2'
+CODEC_XZ = 'xz'
+
+CODEC_MAGIC = [
+    (CODEC_GZIP, b'\x1f\x8b'),
+    (CODEC_LZ4, b'\x04\x22\x4d\x18'),
+    (CODEC_ZSTD, b'\x28\xb5\x2f\xfd'),
+    (CODEC_BZ2, b'BZh'),
+    (CODEC_XZ, b'\xfd7zXZ\x00'),
+]
+"""Codecs by the magic bytes at the stream start"""
+
+MAGIC_SIZE = max(len(x[1]) for x in CODEC_MAGIC)
+"""Number of bytes needed to detect the codec"""
+
+
+def detect_codec(head):
+    """
+    Detects the codec from the first bytes of the stream
+    :param head: at least MAGIC_SIZE bytes of the stream start, unless shorter
+    :return: codec name, CODEC_NONE if not compressed by a known codec
+    """
+    for codec, magic in CODEC_MAGIC:
+        if head[:len(magic)] == magic:
+            return codec
+    return CODEC_NONE
+
+
+class StreamDecompressor(object):
+    """
+    Decompressor without max_length support (Python 2 bz2, zstandard) with the
+    lz4.frame.LZ4FrameDecompressor interface. Data after the end of the stream goes to unused_data.
+    """
+
+    def __init__(self, decompressor):
+        self._dec = decompressor
+        self.eof = False
+        self.needs_input = True
+        self.unused_data = b''
+
+    def decompress(self, data, max_length=-1):
+        if self.eof:
+            self.unused_data += data
+            return b''
+
+        try:
+            out = self._dec.decompress(data)
+        except EOFError:  # Python 2 bz2 after the end of the stream
+            self.eof = True
+            self.unused_data = data
+            return b''
+
+        rest = getattr(self._dec, 'unused_data', b'')
+        if rest or getattr(self._dec, 'eof', False):
+            self.eof = True
+            self.unused_data = rest
+        return out
+
+
+def new_bz2_decompressor():
+    dec = bz2.BZ2Decompressor()
+    return dec if hasattr(dec, 'needs_input') else StreamDecompressor(dec)
+
+
+def new_xz_decompressor():
+    return lzma.LZMADecompressor()
+
+
+def new_zstd_decompressor():
+    return StreamDecompressor(zstandard.ZstdDecompressor().decompressobj())
+
+
+def decompressor_factory(codec):
+    """
+    Returns callable creating the frame decompressor for the codec, for FramedInputStream.
+    Gzip is handled by GzipInputStream.
+    :param codec:
+    :return:
+    """
+    if codec == CODEC_LZ4:
+        return new_lz4_decompressor
+    if codec == CODEC_BZ2:
+        return new_bz2_decompressor
+    if codec == CODEC_XZ:
+        if lzma is None:
+            raise ImportError('xz decompression requires lzma (backports.lzma on Python 2)')
+        return new_xz_decompressor
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ImportError('zstd decompression requires zstandard')
+        return new_zstd_decompressor
+    raise ValueError('Unsupported codec %s' % codec)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Digest policies for input objects - which hash is computed over the read data and where.
+"""
+
+import collections
+import hashlib
+import logging
+import struct
+import threading
+import zlib
+
+
+logger = logging.getLogger(__name__)
+
+
+DIGEST_NONE = 'none'
+"""No hashing"""
+
+DEFAULT_DIGEST = 'sha256'
+"""Digest computed by input objects by default"""
+
+DIGEST_LAYER_ALL = 'all'
+"""Every input object in the stack hashes"""
+
+DIGEST_LAYER_OUTER = 'outer'
+"""Only the outermost input object hashes"""
+
+DIGEST_LAYER_SOURCE = 'source'
+"""Only the source input objects, not wrapping other input objects, hash"""
+
+DIGEST_QUEUE_BYTES = 8 * 1024 * 1024
+"""Default maximal number of bytes waiting for the background hashing"""
+
+
+class NullDigest(object):
+    """
+    No hashing
+    """
+    name = DIGEST_NONE
+
+    def update(self, data):
+        pass
+
+    def digest(self):
+        return None
+
+    def hexdigest(self):
+        return None
+
+    def close(self):
+        pass
+
+
+class Crc32Digest(object):
+    """
+    CRC32 checksum with hashlib like interface
+    """
+    name = 'crc32'
+
+    def __init__(self):
+        self._crc = 0
+
+    def update(self, data):
+        self._crc = zlib.crc32(data, self._crc) & 0xffffffff
+
+    def digest(self):
+        return struct.pack('>I', self._crc)
+
+    def hexdigest(self):
+        return '%08x' % self._crc
+
+    def close(self):
+        pass
+
+
+class ThreadedDigest(object):
+    """
+    Hashes on a background thread fed by a bounded queue.
+    update() blocks only when max_bytes are waiting for the hashing.
+    """
+
+    def __init__(self, hasher, max_bytes=DIGEST_QUEUE_BYTES):
+        self.hasher = hasher
+        self.name = hasher.name
+        self.max_bytes = max_bytes
+
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._bytes = 0
+        self._busy = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._work, name='digest-%s' % self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                data = self._queue.popleft()
+                self._busy = True
+
+            self.hasher.update(data)
+            with self._cond:
+                self._busy = False
+                self._bytes -= len(data)
+                self._cond.notify_all()
+
+    def update(self, data):
+        if not isinstance(data, bytes):
+            data = memoryview(data).tobytes()  # the caller may reuse the buffer
+        with self._cond:
+            if self._closed:
+                self.hasher.update(data)
+                return
+            while self._bytes >= self.max_bytes and not self._closed:
+                self._cond.wait()
+            self._queue.append(data)
+            self._bytes += len(data)
+            self._cond.notify_all()
+
+    def join(self):
+        """
+        Waits until all queued data is hashed
+        :return:
+        """
+        with self._cond:
+            while self._queue or self._busy:
+                self._cond.wait()
+
+    def digest(self):
+        self.join()
+        return self.hasher.digest()
+
+    def hexdigest(self):
+        self.join()
+        return self.hasher.hexdigest()
+
+    def close(self):
+        """
+        Hashes the queued data and stops the thread, digest remains available
+        :return:
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+
+def new_hasher(algorithm):
+    """
+    Creates a new hasher for the algorithm name - hashlib algorithms, crc32 or none
+    :param algorithm:
+    :return:
+    """
+    if algorithm is None or algorithm == DIGEST_NONE:
+        return NullDigest()
+    if algorithm == 'crc32':
+        return Crc32Digest()
+    return hashlib.new(algorithm)
+
+
+class DigestPolicy(object):
+    """
+    Which digest an input object computes over the data it returns.
+    algorithm: hashlib name (sha256, blake2b, ...), crc32 or none.
+    threaded: hash on a background thread, off the consumer's critical path.
+    """
+
+    def __init__(self, algorithm=DEFAULT_DIGEST, threaded=False, max_queue_bytes=DIGEST_QUEUE_BYTES):
+        self.algorithm = algorithm or DIGEST_NONE
+        self.threaded = threaded
+        self.max_queue_bytes = max_queue_bytes
+
+    def __repr__(self):
+        return 'DigestPolicy(algorithm=%r, threaded=%r)' % (self.algorithm, self.threaded)
+
+    def new_digest(self):
+        """
+        Creates a new digest object according to the policy
+        :return:
+        """
+        hasher = new_hasher(self.algorithm)
+        if self.threaded and not isinstance(hasher, NullDigest):
+            return ThreadedDigest(hasher, max_bytes=self.max_queue_bytes)
+        return hasher
+
+
+def close_digest(digest):
+    """
+    Stops the background hashing of the digest if it has any, hashlib objects need no closing
+    :param digest:
+    :return:
+    """
+    close = getattr(digest, 'close', None)
+    if close is not None:
+        close()
+
+
+NO_DIGEST = DigestPolicy(DIGEST_NONE)
+"""Policy disabling the hashing"""
+
+
+def to_policy(digest):
+    """
+    Converts digest specification to DigestPolicy - accepts policy, algorithm name or None (= no hashing)
+    :param digest:
+    :return:
+    """
+    if isinstance(digest, DigestPolicy):
+        return digest
+    return DigestPolicy(digest)
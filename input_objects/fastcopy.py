@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+In-kernel file to file copies - os.copy_file_range (Linux, Python 3.8+), os.sendfile
+(Linux, Python 3.3+), the data does not pass through Python. Unsupported combinations
+raise ZeroCopyUnsupported so callers fall back to read / write.
+"""
+
+import errno
+import logging
+import os
+import stat
+import sys
+
+
+logger = logging.getLogger(__name__)
+
+
+COPY_BLOCK_SIZE = 16 * 1024 * 1024
+"""Maximal size of a single kernel copy call"""
+
+HAS_COPY_FILE_RANGE = hasattr(os, 'copy_file_range')
+HAS_SENDFILE = hasattr(os, 'sendfile') and sys.platform.startswith('linux')
+"""sendfile() to a regular file is supported only on Linux"""
+
+ZERO_COPY_SUPPORTED = HAS_COPY_FILE_RANGE or HAS_SENDFILE
+
+_FALLBACK_ERRNOS = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EBADF, errno.EOPNOTSUPP)
+
+
+class ZeroCopyUnsupported(Exception):
+    """
+    Kernel copy is not possible for the descriptors
+    """
+
+
+def regular_fd(fh):
+    """
+    Returns the file descriptor of the file like object if it is a regular file, None otherwise
+    :param fh:
+    :return:
+    """
+    try:
+        fd = fh.fileno()
+        return fd if stat.S_ISREG(os.fstat(fd).st_mode) else None
+    except (AttributeError, ValueError, EnvironmentError):  # io.UnsupportedOperation is a ValueError
+        return None
+
+
+def copy_range(src_fd, dst_fd, offset, count):
+    """
+    Copies count bytes at offset of src_fd to the current position of dst_fd in the kernel.
+    The src_fd position is not changed, the dst_fd one is advanced.
+    If copy_file_range is not usable for the descriptors, sendfile is used for the rest of the call,
+    the fallback does not affect other calls.
+    :param src_fd:
+    :param dst_fd:
+    :param offset: source offset
+    :param count:
+    :return: number of bytes copied, less than count at the end of the source or if the kernel copy
+             stopped working after some data were copied
+    """
+    use_copy_file_range = HAS_COPY_FILE_RANGE
+    copied = 0
+    while copied < count:
+        size = min(count - copied, COPY_BLOCK_SIZE)
+        try:
+            if use_copy_file_range:
+                n = os.copy_file_range(src_fd, dst_fd, size, offset + copied)
+            elif HAS_SENDFILE:
+                n = os.sendfile(dst_fd, src_fd, offset + copied, size)
+            else:
+                raise ZeroCopyUnsupported('No kernel copy available')
+
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+            if use_copy_file_range:  # e.g., across file systems on older kernels, try sendfile
+                logger.debug('copy_file_range not usable: %s' % e)
+                use_copy_file_range = False
+                continue
+            if copied:
+                break
+            raise ZeroCopyUnsupported('Kernel copy failed: %s' % e)
+
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+
+def copy_file(src_fh, dst_fh, offset=0, count=None):
+    """
+    Copies the regular source file from the offset to the destination file in the kernel
+    :param src_fh:
+    :param dst_fh:
+    :param offset:
+    :param count: None = to the end of the source
+    :return: number of bytes copied
+    """
+    src_fd, dst_fd = regular_fd(src_fh), regular_fd(dst_fh)
+    if src_fd is None or dst_fd is None or not ZERO_COPY_SUPPORTED:
+        raise ZeroCopyUnsupported('Kernel copy requires regular files')
+
+    if count is None:
+        count = max(0, os.fstat(src_fd).st_size - offset)
+    return copy_range(src_fd, dst_fd, offset, count)
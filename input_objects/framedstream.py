@@ -0,0 +1,202 @@
+"""
+Streaming decompression of concatenated compressed frames.
+"""
+
+from linebuffer import LineBuffer, iter_buffer_lines
+
+
+BLOCK_SIZE = 65536
+"""Default read block size"""
+
+MAX_CHUNK_SIZE = 1024 * 1024
+"""Maximal size of the output produced by a single decompression step"""
+
+
+class FramedInputStream(object):
+    """
+    Streaming reads from compressed files made of one or more concatenated frames
+    (LZ4 frames, bzip2 / xz streams, zstd frames).
+
+    new_decompressor() creates the decompressor of a single frame, with the interface of
+    lz4.frame.LZ4FrameDecompressor / bz2.BZ2Decompressor: decompress(data, max_length),
+    eof, unused_data and needs_input. A new decompressor is started after each frame.
+
+    Compressed blocks of block_size are read from the fileobj, a single decompression
+    step produces at most max_chunk_size bytes (if the decompressor supports max_length),
+    the output is kept in a LineBuffer.
+
+    comp_offset / tell() report the compressed / uncompressed position separately,
+    frame_comp_offset / frame_uncomp_offset the start of the current frame - a restart point.
+    With the offsets set, the fileobj has to be positioned at comp_offset, at a frame start.
+    """
+
+    def __init__(self, fileobj, new_decompressor, block_size=BLOCK_SIZE, max_chunk_size=MAX_CHUNK_SIZE,
+                 comp_offset=0, uncomp_offset=0):
+        """
+        Initialize with the given file-like object.
+        @param fileobj: file-like object,
+        @param new_decompressor: callable creating the frame decompressor
+        @param block_size: int, size of the compressed blocks read from the fileobj
+        @param max_chunk_size: int, maximal size of the decompressed output per step
+        @param comp_offset: int, compressed offset of the fileobj, frame start
+        @param uncomp_offset: int, uncompressed offset corresponding to comp_offset
+        """
+        self._file = fileobj
+        self._new_decompressor = new_decompressor
+        self._dec = None  # current frame decompressor, None between frames
+        self._pending = b''  # compressed data after the end of the last frame
+        self._eof = False
+        self._offset = uncomp_offset  # position in the uncompressed stream
+        self._buffer = LineBuffer()
+        self.block_size = block_size or BLOCK_SIZE
+        self.max_chunk_size = max_chunk_size or MAX_CHUNK_SIZE
+
+        self.comp_offset = comp_offset  # compressed bytes decompressed
+        self.out_offset = uncomp_offset  # uncompressed bytes produced
+        self.frame_comp_offset = comp_offset
+        self.frame_uncomp_offset = uncomp_offset
+        self.frames = 0
+
+    def __fill(self, num_bytes):
+        """
+        Fill the internal buffer with 'num_bytes' of data.
+        @param num_bytes: int, number of bytes to read in (0 = everything)
+        """
+        if self._eof:
+            return
+
+        while not num_bytes or len(self._buffer) < num_bytes:
+            if self._dec is None:
+                data = self._pending or self._file.read(self.block_size)
+                self._pending = b''
+                if data is None:
+                    break  # interrupted read-ahead, not the end of the stream
+                if not data:
+                    self._eof = True
+                    break
+
+                # new frame starts here
+                self._dec = self._new_decompressor()
+                self.frame_comp_offset = self.comp_offset
+                self.frame_uncomp_offset = self.out_offset
+                self.frames += 1
+
+            elif self._dec.needs_input:
+                data = self._file.read(self.block_size)
+                if data is None:
+                    break
+                if not data:
+                    raise IOError('Stream truncated inside the frame starting at %s' % self.frame_comp_offset)
+            else:
+                data = b''
+
+            self.comp_offset += len(data)
+            out = self._dec.decompress(data, self.max_chunk_size)
+            self._buffer.feed(out)
+            self.out_offset += len(out)
+
+            if self._dec.eof:
+                self._pending = self._dec.unused_data or b''
+                self.comp_offset -= len(self._pending)
+                self._dec = None
+
+    def set_fileobj(self, fileobj):
+        """
+        Replaces the file-like object compressed data is read from, e.g., by a read-ahead buffer over it.
+        @param fileobj: file-like object positioned where the current one is
+        """
+        self._file = fileobj
+
+    def __iter__(self):
+        return self
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            position = offset
+        elif whence == 1:
+            position = self._offset + offset
+        else:
+            raise IOError("Illegal argument")
+        if position < self._offset:
+            raise IOError("Cannot seek backwards")
+
+        # skip forward, in blocks
+        while position > self._offset:
+            if not self.read(min(position - self._offset, self.max_chunk_size)):
+                break
+
+    def tell(self):
+        return self._offset
+
+    def close(self):
+        self._buffer.clear()
+        self._file = None
+        self._dec = None
+
+    def read(self, size=0):
+        self.__fill(size)
+        data = self._buffer.read(size)
+        self._offset = self._offset + len(data)
+        return data
+
+    def readinto(self, b):
+        """
+        Reads decompressed data directly to the pre-allocated writable buffer b
+        @param b: writable buffer, e.g., bytearray
+        @return: int, number of bytes read, 0 on EOF
+        """
+        self.__fill(len(b))
+        n = self._buffer.readinto(b)
+        self._offset = self._offset + n
+        return n
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration()
+        return line
+
+    __next__ = next
+
+    def readline(self):
+        # make sure we have an entire line, the newline search resumes where it stopped
+        buf = self._buffer
+        while True:
+            line = buf.readline()
+            if line is not None:
+                break
+            if self._eof:
+                line = buf.read()
+                break
+            self.__fill(len(buf) + 1)
+
+        self._offset = self._offset + len(line)
+        return line
+
+    def iter_lines(self, batch=None, keepends=True, account=None):
+        """
+        Yields lists of lines, every decompressed block is split at once, see iter_buffer_lines()
+        @param batch: int, number of lines per list, None = lines of one block
+        @param keepends: bool, keep the newlines
+        @param account: callable, account(memoryview) called with the data of each list
+        """
+        def fill():
+            if self._eof:
+                return False
+            self.__fill(len(self._buffer) + 1)
+            return True
+
+        def consume(size):
+            self._buffer.consume(size, account)
+            self._offset = self._offset + size
+
+        return iter_buffer_lines(self._buffer, fill, consume, batch=batch, keepends=keepends)
+
+    def readlines(self):
+        lines = []
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            lines.append(line)
+        return lines
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Random access checkpoint index for gzip streams, zran style.
+
+A checkpoint maps a compressed offset to an uncompressed offset together with
+the 32 kB decompressor window preceding it, so the decompression can be restarted
+at the checkpoint with a raw inflate primed by the window.
+
+Python's zlib does not expose inflatePrime() nor deflate block boundaries, so
+checkpoints are taken only at byte aligned restart points - right after the empty
+stored blocks (00 00 ff ff) emitted by sync / full flushes (pigz, flushing producers).
+Streams without flush points get only the stream start checkpoint.
+"""
+
+import bisect
+import collections
+import logging
+import os
+import struct
+import sys
+import zlib
+
+
+logger = logging.getLogger(__name__)
+
+
+INDEX_SPACING = 16 * 1024 * 1024
+"""Default minimal distance between checkpoints, in uncompressed bytes"""
+
+WINDOW_SIZE = 32768
+"""Deflate window size"""
+
+SYNC_MARKER = b'\x00\x00\xff\xff'
+"""LEN / NLEN of an empty stored block, emitted by Z_SYNC_FLUSH and Z_FULL_FLUSH"""
+
+ZDICT_SUPPORTED = sys.version_info >= (3, 3)
+"""Priming the raw inflate with a window requires zlib zdict support"""
+
+INDEX_MAGIC = b'IOGZIX01'
+INDEX_HEADER = struct.Struct('<QQBI')
+CHECKPOINT_HEADER = struct.Struct('<QQI')
+
+
+GzipCheckpoint = collections.namedtuple('GzipCheckpoint', ['comp_offset', 'uncomp_offset', 'window'])
+"""Checkpoint - window is None for a gzip member start (fresh gzip decompressor)"""
+
+
+def index_fname(fname):
+    """
+    Returns the sidecar index file name for the given gzip file
+    :param fname:
+    :return:
+    """
+    return '%s.gzidx' % fname
+
+
+def new_decompressor(checkpoint=None):
+    """
+    Creates zlib decompressor able to continue from the checkpoint
+    :param checkpoint:
+    :return:
+    """
+    if checkpoint is None or checkpoint.window is None:
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if not checkpoint.window:
+        return zlib.decompressobj(-zlib.MAX_WBITS)
+    return zlib.decompressobj(-zlib.MAX_WBITS, zdict=checkpoint.window)
+
+
+class GzipIndex(object):
+    """
+    Sorted list of gzip checkpoints.
+    Built incrementally by GzipInputStream during a sequential pass, persisted as a sidecar file.
+    """
+
+    def __init__(self, spacing=INDEX_SPACING):
+        self.spacing = spacing
+        self.complete = False
+        self.total_out = None  # uncompressed size, known when complete
+        self.checkpoints = [GzipCheckpoint(0, 0, None)]
+        self._keys = [0]
+
+    def __len__(self):
+        return len(self.checkpoints)
+
+    def __repr__(self):
+        return 'GzipIndex(checkpoints=%r, complete=%r, total_out=%r)' \
+               % (len(self.checkpoints), self.complete, self.total_out)
+
+    @property
+    def last(self):
+        return self.checkpoints[-1]
+
+    def is_due(self, uncomp_offset):
+        """
+        Returns true if a new checkpoint would be useful at the given uncompressed offset
+        :param uncomp_offset:
+        :return:
+        """
+        return ZDICT_SUPPORTED and uncomp_offset - self._keys[-1] >= self.spacing
+
+    def add(self, comp_offset, uncomp_offset, window):
+        """
+        Adds a new checkpoint, ignored if it is not beyond the last one
+        :param comp_offset:
+        :param uncomp_offset:
+        :param window:
+        :return:
+        """
+        if uncomp_offset <= self._keys[-1]:
+            return False
+
+        self.checkpoints.append(GzipCheckpoint(comp_offset, uncomp_offset, window))
+        self._keys.append(uncomp_offset)
+        return True
+
+    def finish(self, total_out):
+        """
+        Marks the index as complete, covering the whole stream
+        :param total_out:
+        :return:
+        """
+        self.complete = True
+        self.total_out = total_out
+
+    def find(self, uncomp_offset):
+        """
+        Returns the last checkpoint at or before the uncompressed offset
+        :param uncomp_offset:
+        :return:
+        """
+        return self.checkpoints[bisect.bisect_right(self._keys, uncomp_offset) - 1]
+
+    def to_state(self):
+        js = collections.OrderedDict()
+        js['type'] = 'GzipIndex'
+        js['spacing'] = self.spacing
+        js['checkpoints'] = len(self.checkpoints)
+        js['complete'] = self.complete
+        js['total_out'] = self.total_out
+        return js
+
+    def save(self, fname):
+        """
+        Writes the index to the file, atomically
+        :param fname:
+        :return:
+        """
+        fname_tmp = '%s.%s.tmp' % (fname, os.getpid())
+        with open(fname_tmp, 'wb') as fh:
+            fh.write(INDEX_MAGIC)
+            fh.write(INDEX_HEADER.pack(self.spacing, self.total_out or 0, 1 if self.complete else 0,
+                                       len(self.checkpoints)))
+            for cp in self.checkpoints:
+                window = b'' if cp.window is None else zlib.compress(cp.window)
+                wlen = 0xffffffff if cp.window is None else len(window)
+                fh.write(CHECKPOINT_HEADER.pack(cp.comp_offset, cp.uncomp_offset, wlen))
+                fh.write(window)
+        os.rename(fname_tmp, fname)
+
+    @classmethod
+    def load(cls, fname):
+        """
+        Loads the index from the file
+        :param fname:
+        :return:
+        """
+        with open(fname, 'rb') as fh:
+            if fh.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise ValueError('File %s is not a gzip index' % fname)
+
+            spacing, total_out, complete, count = INDEX_HEADER.unpack(fh.read(INDEX_HEADER.size))
+            idx = cls(spacing=spacing)
+            idx.checkpoints = []
+            idx._keys = []
+            for _ in range(count):
+                comp_offset, uncomp_offset, wlen = CHECKPOINT_HEADER.unpack(fh.read(CHECKPOINT_HEADER.size))
+                window = None if wlen == 0xffffffff else zlib.decompress(fh.read(wlen))
+                idx.checkpoints.append(GzipCheckpoint(comp_offset, uncomp_offset, window))
+                idx._keys.append(uncomp_offset)
+
+        if complete:
+            idx.finish(total_out)
+        return idx
@@ -1,12 +1,25 @@
 import zlib
-import string
+from linebuffer import LineBuffer, iter_buffer_lines
+from gzipindex import SYNC_MARKER, WINDOW_SIZE, new_decompressor
 
 BLOCK_SIZE = 16384
-"""Read block size"""
+"""Default read block size"""
+
+MAX_CHUNK_SIZE = 1024 * 1024
+"""Maximal size of the output produced by a single decompression step"""
 
 WINDOW_BUFFER_SIZE = 16 + zlib.MAX_WBITS
 """zlib window buffer size, set to gzip's format"""
 
+VERIFY_SIZE = 65536
+"""Amount of output compared when verifying index restart points"""
+
+GZIP_MAGIC = b'\x1f\x8b'
+"""gzip member header magic"""
+
+GZIP_TRAILER_SIZE = 8
+"""gzip member trailer size, CRC32 and ISIZE"""
+
 
 class GzipInputStream(object):
     """
@@ -14,17 +27,49 @@ class GzipInputStream(object):
     Python 2.x gzip.GZipFile relies on .seek() and .tell(), so it
     doesn't support this (@see: http://bo4.me/YKWSsL).
     Adapted from: http://effbot.org/librarybook/zlib-example-4.py
+
+    Concatenated gzip members (multi-member files, bgzip) are decompressed one after another.
+
+    Decompressed data is kept in a LineBuffer with a read cursor, so reads
+    and line scanning never re-copy the unread remainder. A single decompression
+    step produces at most max_chunk_size bytes, the rest of the compressed block
+    waits in the decompressor's unconsumed tail, so the memory is bounded
+    even for highly compressible inputs.
+
+    With index set, random access checkpoints are recorded to the GzipIndex
+    during the sequential pass. With checkpoint set, the decompression starts
+    at the checkpoint, fileobj has to be positioned at its compressed offset.
     """
 
-    def __init__(self, fileobj):
+    def __init__(self, fileobj, block_size=BLOCK_SIZE, max_chunk_size=MAX_CHUNK_SIZE, index=None, checkpoint=None):
         """
         Initialize with the given file-like object.
         @param fileobj: file-like object,
+        @param block_size: int, size of the compressed blocks read from the fileobj
+        @param max_chunk_size: int, maximal size of the decompressed output per step
+        @param index: GzipIndex, index to build during reading
+        @param checkpoint: GzipCheckpoint, checkpoint to start decompression from
         """
         self._file = fileobj
-        self._zip = zlib.decompressobj(WINDOW_BUFFER_SIZE)
+        self._zip = new_decompressor(checkpoint)
+        self._raw = checkpoint is not None and checkpoint.window is not None  # raw inflate, no gzip framing
+        self._trailer = 0  # member trailer bytes still to skip after the raw inflate
+        self._member_start = checkpoint is None or checkpoint.window is None  # nothing fed to the member yet
         self._offset = 0  # position in unzipped stream
-        self._data = ""
+        self._buffer = LineBuffer()
+        self.block_size = block_size or BLOCK_SIZE
+        self.max_chunk_size = max_chunk_size or MAX_CHUNK_SIZE
+
+        # index building state
+        self._index = index
+        self._in_offset = 0  # compressed offset of the next block read from the file
+        self._out_offset = 0  # uncompressed offset of the next decompressed output
+        self._window = b''  # tail of the decompressed output, tracked only close to the next checkpoint
+        self._restart = None  # (compressed offset, rest of the block, decompressor) of the pending restart point
+
+        if checkpoint is not None:
+            self._in_offset = checkpoint.comp_offset
+            self._offset = self._out_offset = checkpoint.uncomp_offset
 
     def __fill(self, num_bytes):
         """
@@ -35,14 +80,138 @@ class GzipInputStream(object):
         if not self._zip:
             return
 
-        while not num_bytes or len(self._data) < num_bytes:
-            data = self._file.read(BLOCK_SIZE)
+        while not num_bytes or len(self._buffer) < num_bytes:
+            data = self._zip.unconsumed_tail
+            if not data and self._restart is not None:
+                data = self.__restart_point()
             if not data:
-                self._data = self._data + self._zip.flush()
-                self._zip = None  # no more data
-                break
+                data = self._file.read(self.block_size)
+                if data is None:
+                    break  # interrupted read-ahead, not the end of the stream
+                if not data:
+                    self.__output(self._zip.flush())
+                    self._zip = None  # no more data
+                    if self._index is not None:
+                        self._index.finish(self._out_offset)
+                    break
+
+                self._in_offset += len(data)
+                if self._member_start:
+                    data = self.__member_data(data)
+                    if not data:
+                        continue
+                    self._member_start = False
+                elif self._index is not None:
+                    data = self.__index_block(data)
+
+            self.__output(self._zip.decompress(data, self.max_chunk_size))
+            while self._zip.unused_data or getattr(self._zip, 'eof', False):
+                self.__next_member()
+
+    def __next_member(self):
+        """
+        Starts decompression of the next gzip member, the member start is a checkpoint
+        """
+        rest = self._zip.unused_data
+        if self._raw:
+            # raw inflate started at a window checkpoint leaves the member trailer in the unused data
+            self._raw = False
+            self._trailer = GZIP_TRAILER_SIZE
+        rest = self.__member_data(rest)
+        self._zip = new_decompressor()
+        self._member_start = not rest
+        if self._index is not None and self._index.is_due(self._out_offset):
+            self._index.add(self._in_offset - len(rest), self._out_offset, None)
+        if rest:
+            self.__output(self._zip.decompress(rest, self.max_chunk_size))
+
+    def __member_data(self, data):
+        """
+        Strips the rest of the previous member trailer and zero padding from the data preceding the next member
+        @param data: compressed data after the member end
+        @return: the data starting with the next member, empty if more data is needed
+        """
+        if self._trailer:
+            skip = min(self._trailer, len(data))
+            self._trailer -= skip
+            data = data[skip:]
+
+        data = data.lstrip(b'\x00')  # zero padding after the last member
+        if data and not GZIP_MAGIC.startswith(data[:len(GZIP_MAGIC)]):
+            raise IOError('Not a gzip member at the compressed offset %s' % (self._in_offset - len(data)))
+        return data
+
+    def __output(self, data):
+        """
+        Adds decompressed data to the buffer
+        @param data: decompressed data
+        """
+        self._buffer.feed(data)
+        self._out_offset += len(data)
+
+        # Keep the window only when approaching a checkpoint
+        if self._index is not None and self._index.is_due(self._out_offset + WINDOW_SIZE):
+            self._window = (self._window + data)[-WINDOW_SIZE:] if len(data) < WINDOW_SIZE \
+                else data[-WINDOW_SIZE:]
+
+    def __index_block(self, data):
+        """
+        Finds the first restart point in the fresh compressed block.
+        The checkpoint is recorded by __restart_point() once the block part up to it is decompressed.
+        @param data: compressed block just read from the file
+        @return: the block part to decompress first
+        """
+        block_offset = self._in_offset - len(data)
+        if not self._index.is_due(self._out_offset):
+            return data
+
+        pos = data.find(SYNC_MARKER)
+        if pos < 0:
+            return data
 
-            self._data = self._data + self._zip.decompress(data)
+        cut = pos + len(SYNC_MARKER)
+        self._restart = (block_offset + cut, data[cut:], self._zip)
+        return data[:cut]
+
+    def __restart_point(self):
+        """
+        Records a checkpoint at the pending restart point if verified,
+        the block part preceding it has been decompressed in bounded steps.
+        @return: the rest of the block to decompress
+        """
+        comp_offset, rest, decompressor = self._restart
+        self._restart = None
+        if decompressor is not self._zip:
+            return rest  # member ended before the restart point
+
+        self.__output(self._zip.decompress(b'', self.max_chunk_size))  # no pending output remains
+        if self._index.is_due(self._out_offset) and self.__verify_restart(rest):
+            self._index.add(comp_offset, self._out_offset, self._window)
+            self._window = b''
+        return rest
+
+    def __verify_restart(self, rest):
+        """
+        Verifies the restart point by comparing a restarted raw inflate with the main decompressor.
+        Sync marker byte pattern may also appear inside compressed data by accident.
+        @param rest: compressed data after the restart point
+        """
+        if not rest or len(self._window) < WINDOW_SIZE and self._out_offset > len(self._window):
+            return False
+
+        try:
+            restarted = zlib.decompressobj(-zlib.MAX_WBITS, zdict=self._window)
+            expected = self._zip.copy().decompress(rest, VERIFY_SIZE)
+            return len(expected) > 0 and restarted.decompress(rest, VERIFY_SIZE) == expected
+        except zlib.error:
+            return False
+
+    def set_fileobj(self, fileobj):
+        """
+        Replaces the file-like object compressed data is read from, e.g., by a read-ahead buffer over it.
+        @param fileobj: file-like object positioned where the current one is
+        """
+        self._file = fileobj
 
     def __iter__(self):
         return self
@@ -59,43 +228,75 @@ class GzipInputStream(object):
 
         # skip forward, in blocks
         while position > self._offset:
-            if not self.read(min(position - self._offset, BLOCK_SIZE)):
+            if not self.read(min(position - self._offset, self.block_size)):
                 break
 
     def tell(self):
         return self._offset
 
     def close(self):
-        self._data = ""
+        self._buffer.clear()
         self._file = None
         self._zip = None
 
     def read(self, size=0):
         self.__fill(size)
-        if size:
-            data = self._data[:size]
-            self._data = self._data[size:]
-        else:
-            data = self._data
-            self._data = ""
+        data = self._buffer.read(size)
         self._offset = self._offset + len(data)
         return data
 
+    def readinto(self, b):
+        """
+        Reads decompressed data directly to the pre-allocated writable buffer b
+        @param b: writable buffer, e.g., bytearray
+        @return: int, number of bytes read, 0 on EOF
+        """
+        self.__fill(len(b))
+        n = self._buffer.readinto(b)
+        self._offset = self._offset + n
+        return n
+
     def next(self):
         line = self.readline()
         if not line:
             raise StopIteration()
         return line
 
+    __next__ = next
+
     def readline(self):
-        # make sure we have an entire line
-        while self._zip and "\n" not in self._data:
-            self.__fill(len(self._data) + 512)
+        # make sure we have an entire line, the newline search resumes where it stopped
+        buf = self._buffer
+        while True:
+            line = buf.readline()
+            if line is not None:
+                break
+            if not self._zip:
+                line = buf.read()
+                break
+            self.__fill(len(buf) + 1)
 
-        pos = string.find(self._data, "\n") + 1
-        if pos <= 0:
-            return self.read()
-        return self.read(pos)
+        self._offset = self._offset + len(line)
+        return line
+
+    def iter_lines(self, batch=None, keepends=True, account=None):
+        """
+        Yields lists of lines, every decompressed block is split at once, see iter_buffer_lines()
+        @param batch: int, number of lines per list, None = lines of one block
+        @param keepends: bool, keep the newlines
+        @param account: callable, account(memoryview) called with the data of each list
+        """
+        def fill():
+            if not self._zip:
+                return False
+            self.__fill(len(self._buffer) + 1)
+            return True
+
+        def consume(size):
+            self._buffer.consume(size, account)
+            self._offset = self._offset + size
+
+        return iter_buffer_lines(self._buffer, fill, consume, batch=batch, keepends=keepends)
 
     def readlines(self):
         lines = []
@@ -105,4 +306,3 @@ class GzipInputStream(object):
                 break
             lines.append(line)
         return lines
-
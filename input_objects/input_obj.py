@@ -6,18 +6,43 @@ Input objects taken from polynomial verifiers
 """
 
 
-import hashlib
 import logging
+import mmap
 import os
+import stat
 import requests
+import requests.adapters
 import traceback
 import threading
 import time
 import collections
-import string
+import json
+import multiprocessing
 import random
 import shutil
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
 from gzipinputstream import GzipInputStream
+from gzipindex import GzipIndex, GzipCheckpoint, INDEX_SPACING, index_fname
+from lz4inputstream import Lz4InputStream
+from framedstream import FramedInputStream
+from codec import detect_codec, decompressor_factory, MAGIC_SIZE, CODEC_AUTO, CODEC_NONE, CODEC_GZIP, CODEC_LZ4
+from paralleldecode import PeekReader, new_parallel_decoder, PARALLEL_MAX_INFLIGHT
+from linebuffer import LineBuffer, MappedLines, iter_buffer_lines, LINES_BLOCK_SIZE, CHUNK_SIZE
+from newlines import count_newlines
+from rangefetch import RangeFetcher, RANGE_CHUNK_SIZE
+from prefetch import ReadAheadBuffer, DecodePipeline, PREFETCH_CHUNK_SIZE, PREFETCH_MAX_BYTES, PIPELINE_CHUNK_SIZE
+from retry import RetryPolicy, to_retry_policy
+from cache import ContentCache
+from lineindex import LineIndex, LINE_INDEX_SPACING, LINE_INDEX_BATCH, line_index_fname
+from metrics import instrument, uninstrument, MetricsRegistry, LayerMetrics, TimedDigest, KIND_IO, KIND_DECODE, \
+    KIND_OTHER
+from fastcopy import regular_fd, copy_range, copy_file, ZeroCopyUnsupported, ZERO_COPY_SUPPORTED
+from sinks import FileSink, SocketSink, DigestSink, WriteBehindSink, SinkFailed, to_writer, \
+    SINK_BLOCK, SINK_DROP, SINK_FAIL, SINK_MAX_BYTES
+from digest import to_policy, close_digest, NO_DIGEST, DIGEST_NONE, DEFAULT_DIGEST, DIGEST_LAYER_ALL, DIGEST_LAYER_OUTER, DIGEST_LAYER_SOURCE
 
 
 logger = logging.getLogger(__name__)
@@ -32,20 +57,135 @@ def is_empty(x):
     return x is None or len(x) == 0
 
 
+def skip_bytes(read, size, block_size=65536):
+    """
+    Reads and drops size bytes using the read function
+    :param read:
+    :param size:
+    :param block_size:
+    :return: number of bytes skipped, less than size at the end of the stream
+    """
+    skipped = 0
+    while skipped < size:
+        data = read(min(size - skipped, block_size))
+        if not data:
+            break
+        skipped += len(data)
+    return skipped
+
+
+def iter_input_objects(iobj):
+    """
+    Iterates the input object stack depth first, starting with the given object
+    :param iobj:
+    :return:
+    """
+    for x, _ in _iter_stack(iobj):
+        yield x
+
+
+def _iter_stack(iobj, depth=0):
+    """
+    Iterates the input object stack depth first, yields (input object, depth)
+    :param iobj:
+    :param depth:
+    :return:
+    """
+    yield iobj, depth
+    for child in iobj.children():
+        for x in _iter_stack(child, depth + 1):
+            yield x
+
+
+def set_digest_policy(iobj, digest, layer=DIGEST_LAYER_ALL):
+    """
+    Sets the digest in the input object stack so the data is hashed only at the selected layer,
+    other layers do not hash. Has to be called before reading.
+    :param iobj: the outermost input object
+    :param digest: DigestPolicy or algorithm name
+    :param layer: DIGEST_LAYER_ALL, DIGEST_LAYER_OUTER, DIGEST_LAYER_SOURCE or the depth (0 = outermost)
+    :return:
+    """
+    for x, depth in _iter_stack(iobj):
+        if layer == DIGEST_LAYER_ALL:
+            selected = True
+        elif layer == DIGEST_LAYER_OUTER:
+            selected = depth == 0
+        elif layer == DIGEST_LAYER_SOURCE:
+            selected = len(x.children()) == 0
+        else:
+            selected = depth == layer
+        x.set_digest(digest if selected else NO_DIGEST)
+
+
+class ConnectionPool(object):
+    """
+    Shareable HTTP connection pool for link input objects.
+    Wraps requests.Session so HEAD, GET and reconnects of all objects using
+    the pool reuse keep-alive connections instead of new TCP & TLS handshakes.
+    pool_maxsize should cover the number of concurrent connections per host,
+    e.g., parallel range download workers.
+    """
+    def __init__(self, pool_connections=10, pool_maxsize=10, keep_alive=True, session=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.session = session if session is not None else requests.Session()
+
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self):
+        return 'ConnectionPool(pool_connections=%r, pool_maxsize=%r, keep_alive=%r)' \
+               % (self.pool_connections, self.pool_maxsize, self.keep_alive)
+
+    def head(self, url, **kwargs):
+        return self.session.head(url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def close(self):
+        """
+        Closes all pooled connections
+        :return:
+        """
+        self.session.close()
+
+
 class InputObject(object):
     """
     Input stream object.
-    Can be a file, stream, or something else
+    Can be a file, stream, or something else.
+    digest - DigestPolicy or algorithm name of the hash computed over the read data, None disables hashing.
+    metrics - LayerMetrics when enabled by enable_metrics(), None otherwise.
     """
-    def __init__(self, rec=None, aux=None, *args, **kwargs):
-        self.sha256 = hashlib.sha256()
+    metrics_kind = KIND_OTHER
+    """Metrics layer kind, the exclusive read time is I/O for KIND_IO, decompression for KIND_DECODE"""
+
+    def __init__(self, rec=None, aux=None, digest=DEFAULT_DIGEST, *args, **kwargs):
+        self.digest = to_policy(digest).new_digest()
         self.data_read = 0
+        self._digest_offset = 0  # stream position the digest starts at, non-zero when resumed
+        self._resume_offset = None  # position to continue at on enter, set by from_state()
 
         self.rec = rec
         self.aux = aux
+        self.line_index = None
+        self.line_index_fname = None
+        self.metrics = None
 
         # readline iterators
-        self._data = ''
+        self._buffer = LineBuffer()
         self._offset = 0  # position in the read stream
         self._done = False
 
@@ -53,11 +193,131 @@ class InputObject(object):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        pass
+        close_digest(self.digest)
+        if self.line_index is not None and self.line_index.updated and self.line_index_fname is not None:
+            try:
+                self.line_index.save(self.line_index_fname)
+            except Exception as e:
+                logger.warning('Exception when saving the line index %s: %s' % (self.line_index_fname, e))
+                logger.debug(traceback.format_exc())
 
     def __repr__(self):
         return 'InputObject(data_read=%r)' % self.data_read
 
+    @property
+    def sha256(self):
+        """
+        Digest of the read data, name kept for compatibility, the algorithm depends on the digest policy
+        :return:
+        """
+        return self.digest
+
+    def set_digest(self, digest):
+        """
+        Replaces the digest, DigestPolicy or algorithm name. Has to be called before reading.
+        :param digest:
+        :return:
+        """
+        close_digest(self.digest)
+        self.digest = to_policy(digest).new_digest()
+        if self.metrics is not None:
+            self.digest = TimedDigest(self.digest, self.metrics)
+
+    def enable_metrics(self, registry=None, callback=None):
+        """
+        Starts recording the read metrics of this input object and the wrapped ones, see LayerMetrics.
+        Disabled metrics have no overhead, enabled ones time every read call.
+        :param registry: MetricsRegistry collecting the layers, e.g., for breakdown() and bottleneck()
+        :param callback: callback(metrics, op, size, elapsed) after every read call of any layer
+        :return: LayerMetrics of this input object
+        """
+        return instrument(self, registry=registry, callback=callback)
+
+    def disable_metrics(self, registry=None):
+        """
+        Stops recording the metrics of this input object and the wrapped ones
+        :param registry: registry to remove the layers from
+        :return:
+        """
+        uninstrument(self, registry=registry)
+
+    def _account(self, data):
+        """
+        Accounts the data returned by read - digest and the number of bytes read
+        :param data:
+        :return:
+        """
+        self.digest.update(data)
+        if self.line_index is not None:
+            self._index_lines(data)
+        self.data_read += len(data)
+
+    def _index_lines(self, data):
+        """
+        Feeds the data read at data_read to the line index, empty data mark the end of the stream
+        :param data:
+        :return:
+        """
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        if data:
+            self.line_index.feed(data, self.data_read)
+        elif self.data_read == self.line_index.scanned:
+            self.line_index.finish()
+
+    def _flush_line_index(self):
+        """
+        Feeds the data deferred by the line indexing to the index
+        :return:
+        """
+
+    def build_line_index(self, spacing=LINE_INDEX_SPACING, index_fname=None, persist=True):
+        """
+        Starts recording the offset of every spacing-th line during reading, enables seek_line().
+        Has to be called before reading. With persist the index is stored to the index_fname sidecar
+        on exit (defaults to <fname>.lidx for file sources), an existing sidecar not older than the file is loaded.
+        :param spacing:
+        :param index_fname:
+        :param persist:
+        :return: the line index
+        """
+        fname = getattr(self, 'fname', None)
+        if persist and index_fname is None and fname is not None:
+            index_fname = line_index_fname(fname)
+
+        self.line_index = None
+        self.line_index_fname = index_fname if persist else None
+        if self.line_index_fname is not None and os.path.exists(self.line_index_fname):
+            if fname is not None and os.path.getmtime(fname) > os.path.getmtime(self.line_index_fname):
+                logger.info('Line index %s is older than the source, rebuilding' % self.line_index_fname)
+            else:
+                self.line_index = LineIndex.load(self.line_index_fname)
+
+        if self.line_index is None:
+            self.line_index = LineIndex(spacing=spacing)
+        return self.line_index
+
+    def seek_line(self, line):
+        """
+        Moves to the start of the line, 0 based, using the line index - from the closest indexed line
+        only the remaining lines are read. Lines beyond the indexed part are read forward, extending the index.
+        :param line:
+        :return: new position, at the end of the stream if there are less lines
+        """
+        if self.line_index is None:
+            raise IOError('Line index is not built, see build_line_index()')
+
+        self._flush_line_index()
+        indexed, position = self.line_index.find(line)
+        self.seek(position)
+        for _ in range(line - indexed):
+            data = self.readline()
+            if not data:
+                break
+            position += len(data)
+        # tell() is the source position, ahead of the line start when lines are buffered
+        return position
+
     def check(self):
         """
         Checks if stream is readable
@@ -79,6 +339,17 @@ class InputObject(object):
         """
         raise NotImplementedError('Not implemented - base class')
 
+    def readinto(self, b):
+        """
+        Reads data to the pre-allocated writable buffer b, returns number of bytes read
+        :param b:
+        :return:
+        """
+        data = self.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
     #
     # Helper functions
     #
@@ -105,8 +376,35 @@ class InputObject(object):
         js = collections.OrderedDict()
         js['type'] = 'InputObject'
         js['data_read'] = self.data_read
+        js['digest'] = self.digest.name
+        js['hexdigest'] = self.digest.hexdigest()
+        js['digest_offset'] = self._digest_offset
+        if self.metrics is not None:
+            js['metrics'] = self.metrics.to_state()
         return js
 
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        """
+        Creates the input object from the to_state() dictionary, see from_state()
+        :param js: state dictionary
+        :param build: build(js, position) rebuilds the wrapped input objects
+        :param session: shared session for the link objects
+        :return:
+        """
+        raise ValueError('Input object %s cannot be rebuilt from the state' % js.get('type'))
+
+    def _resume_at(self, position):
+        """
+        Sets the position the input object continues at after entering.
+        The digest state cannot be restored, the digest covers the data from this position.
+        :param position:
+        :return:
+        """
+        self._resume_offset = position
+        self._digest_offset = position
+        self._offset = position
+
     def short_desc(self):
         """
         Short description of the current state, for logging
@@ -121,6 +419,47 @@ class InputObject(object):
         """
         return self.data_read
 
+    def seekable(self):
+        """
+        Returns true if the input object supports seek
+        :return:
+        """
+        return False
+
+    def seek(self, offset, whence=0):
+        """
+        Changes the read position. Offset is relative to the stream start (whence=0)
+        or to the current position (whence=1). Line reading buffers are reset.
+        :param offset:
+        :param whence:
+        :return: new position
+        """
+        if not self.seekable():
+            raise IOError('Seek is not supported by %s' % self.__class__.__name__)
+
+        if whence == 0:
+            position = offset
+        elif whence == 1:
+            position = self.data_read - len(self._buffer) + offset
+        else:
+            raise IOError('Illegal argument')
+        if position < 0:
+            raise IOError('Negative seek position')
+
+        self._seek(position)
+        self._buffer.clear()
+        self._offset = position
+        self._done = False
+        return position
+
+    def _seek(self, position):
+        """
+        Moves the underlying source to the absolute position, updates data_read
+        :param position:
+        :return:
+        """
+        raise NotImplementedError('Not implemented - base class')
+
     def close(self):
         """
         Closes the file object
@@ -135,6 +474,13 @@ class InputObject(object):
         """
         pass
 
+    def children(self):
+        """
+        Returns input objects wrapped by this one
+        :return:
+        """
+        return []
+
     #
     # Line reading
     #
@@ -147,13 +493,13 @@ class InputObject(object):
         if self._done:
             return
 
-        while not num_bytes or len(self._data) < num_bytes:
+        while not num_bytes or len(self._buffer) < num_bytes:
             data = self.read(32768)  # generic read method
             if not data:
                 self._done = True
                 break
 
-            self._data = self._data + data
+            self._buffer.feed(data)
 
     def __iter__(self):
         """
@@ -172,6 +518,8 @@ class InputObject(object):
             raise StopIteration()
         return line
 
+    __next__ = next
+
     def _read(self, size=0):
         """
         Sub read for line iterations - reading to the buffer
@@ -179,12 +527,7 @@ class InputObject(object):
         :return: 
         """
         self.__fill(size)
-        if size:
-            data = self._data[:size]
-            self._data = self._data[size:]
-        else:
-            data = self._data
-            self._data = ""
+        data = self._buffer.read(size)
         self._offset = self._offset + len(data)
         return data
 
@@ -193,14 +536,22 @@ class InputObject(object):
         Read a single line
         :return: 
         """
-        # make sure we have an entire line
-        while not self._done and "\n" not in self._data:
-            self.__fill(len(self._data) + 512)
+        buf = self._buffer
+        while True:
+            line = buf.readline()
+            if line is not None:
+                break
+
+            # no complete line buffered, the rest is the last line
+            if self._done:
+                line = buf.read()
+                break
+
+            # newline search resumes where it stopped, just add one more block
+            self.__fill(len(buf) + 1)
 
-        pos = string.find(self._data, "\n") + 1
-        if pos <= 0:
-            return self._read()
-        return self._read(pos)
+        self._offset = self._offset + len(line)
+        return line
 
     def readlines(self):
         """
@@ -215,28 +566,185 @@ class InputObject(object):
             lines.append(line)
         return lines
 
+    def _fill_block(self, block_size):
+        """
+        Reads one more block to the line buffer
+        :param block_size:
+        :return: False at the end of the stream
+        """
+        if self._done:
+            return False
+
+        data = self.read(block_size)
+        if not data:
+            self._done = True
+            return False
+        self._buffer.feed(data)
+        return True
+
+    def _consume_lines(self, size):
+        self._buffer.consume(size)
+        self._offset = self._offset + size
+
+    def iter_lines(self, batch=None, keepends=True, block_size=LINES_BLOCK_SIZE):
+        """
+        Yields lists of lines. Each read block is split to lines at once, which is much cheaper
+        than a readline() call per line. Lines not yielded yet stay buffered for readline().
+        :param batch: number of lines per list, None = the complete lines of each block
+        :param keepends: keep the newlines at the line ends
+        :param block_size: read block size
+        :return:
+        """
+        return iter_buffer_lines(self._buffer, lambda: self._fill_block(block_size), self._consume_lines,
+                                 batch=batch, keepends=keepends)
+
+    def iter_chunks(self, size=CHUNK_SIZE):
+        """
+        Yields the data in memoryviews of at most size bytes, read by readinto() to one reused buffer.
+        A view is valid only until the next one is yielded, it has to be copied to keep the data.
+        :param size:
+        :return:
+        """
+        buf = bytearray(size)
+        view = memoryview(buf)
+        while len(self._buffer):  # data buffered by the line reading first
+            n = self._buffer.readinto(view)
+            self._offset = self._offset + n
+            yield view[:n]
+
+        while True:
+            n = self.readinto(view)
+            if not n:
+                break
+            yield view[:n]
+
+    def count_lines(self, block_size=LINES_BLOCK_SIZE):
+        """
+        Counts the remaining lines without splitting them, e.g., to validate the record count of a dump.
+        Newlines are counted in whole blocks read by readinto(), a last line without the newline counts too.
+        :param block_size:
+        :return:
+        """
+        buf = bytearray(block_size)
+        count = 0
+        last = b'\n'
+        data = self._buffer.read()  # data buffered by the line reading first
+        if data:
+            self._offset = self._offset + len(data)
+            count, last = count_newlines(data), data[-1:]
+
+        while True:
+            n = self.readinto(buf)
+            if not n:
+                break
+            count += count_newlines(buf, 0, n)
+            last = buf[n - 1:n]
+        return count if last == b'\n' else count + 1
+
 
 class FileInputObject(InputObject):
     """
-    File input object - reading from the file
+    File input object - reading from the file.
+
+    With use_mmap the file is memory mapped: readinto() copies directly from the
+    mapping, read_view() returns zero-copy memoryviews, readline() finds newlines
+    directly in the mapping, seek() and size() are constant time.
+    Files which cannot be mapped (pipes, /proc entries, empty files) fall back to reads.
     """
-    def __init__(self, fname, *args, **kwargs):
+    metrics_kind = KIND_IO
+
+    def __init__(self, fname, use_mmap=False, *args, **kwargs):
         super(FileInputObject, self).__init__(*args, **kwargs)
         self.fname = fname
         self.fh = None
+        self.use_mmap = use_mmap
+        self.mm = None
+        self._mm_view = None
+        self._mm_pos = 0
 
     def __enter__(self):
         super(FileInputObject, self).__enter__()
-        self.fh = open(self.fname, 'r')
+        self.fh = open(self.fname, 'rb')
+        if self.use_mmap:
+            self._map()
+        if self._resume_offset:
+            self.seek(self._resume_offset)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self._flush_line_index()
         super(FileInputObject, self).__exit__(exc_type, exc_val, exc_tb)
+        try:
+            self._unmap()
+        except Exception as e:
+            logger.error('Error when unmapping file %s: %s' % (self.fname, e))
         try:
             self.fh.close()
         except:
             logger.error('Error when closing file %s descriptor' % self.fname)
 
+    def _map(self):
+        """
+        Memory maps the opened file, keeps reading from the file handle if not possible
+        :return:
+        """
+        try:
+            st = os.fstat(self.fh.fileno())
+            if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+                raise ValueError('not a regular file with known size')
+
+            self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self._mm_view = memoryview(self.mm)
+            except TypeError:  # Python 2 mmap has no buffer interface
+                self._mm_view = None
+            self._mm_pos = 0
+
+        except (ValueError, EnvironmentError) as e:
+            logger.info('File %s cannot be memory mapped, using reads: %s' % (self.fname, e))
+            self.mm = None
+
+    def _index_lines(self, data):
+        """
+        Mapped file is indexed from the mapping in batches, not per read line
+        :param data:
+        :return:
+        """
+        if self.mm is None:
+            return super(FileInputObject, self)._index_lines(data)
+
+        end = self.data_read + len(data)
+        if not data or end - self.line_index.scanned >= LINE_INDEX_BATCH:
+            self._flush_line_index(end)
+            if not data and end >= len(self.mm):
+                self.line_index.finish()
+
+    def _flush_line_index(self, end=None):
+        """
+        Indexes the mapping up to end, the current position by default
+        :param end:
+        :return:
+        """
+        if self.line_index is None or self.mm is None:
+            return
+        end = self.data_read if end is None else end
+        scanned = self.line_index.scanned
+        if end > scanned:
+            self.line_index.feed(self.mm[scanned:end], scanned)
+
+    def _unmap(self):
+        """
+        Closes the mapping. Fails if memoryviews returned by read_view() are still referenced.
+        :return:
+        """
+        if self.mm is None:
+            return
+        if self._mm_view is not None:
+            self._mm_view.release()
+            self._mm_view = None
+        self.mm.close()
+        self.mm = None
+
     def __repr__(self):
         return 'FileInputObject(file=%r)' % self.fname
 
@@ -248,16 +756,103 @@ class FileInputObject(InputObject):
             raise ValueError('File %s was not found' % self.fname)
 
     def size(self):
+        if self.mm is not None:
+            return len(self.mm)
         return os.path.getsize(self.fname)
 
+    def _mm_range(self, size):
+        """
+        Returns the mapping range of the next size bytes
+        :param size:
+        :return:
+        """
+        end = len(self.mm) if size is None or size < 0 else min(self._mm_pos + size, len(self.mm))
+        return self._mm_pos, end
+
     def read(self, size=None):
+        if self.mm is not None:
+            start, self._mm_pos = self._mm_range(size)
+            data = self.mm[start:self._mm_pos]
+            self._account(data)
+            return data
+
         if size is None:
             size = -1
         data = self.fh.read(size)
-        self.sha256.update(data)
-        self.data_read += len(data)
+        self._account(data)
+        return data
+
+    def readinto(self, b):
+        if self.mm is None:
+            n = self.fh.readinto(b)
+        else:
+            start, self._mm_pos = self._mm_range(len(b))
+            n = self._mm_pos - start
+            memoryview(b)[:n] = self._mm_view[start:self._mm_pos] if self._mm_view is not None \
+                else self.mm[start:self._mm_pos]
+
+        self._account(memoryview(b)[:n])
+        return n
+
+    def read_view(self, size=None):
+        """
+        Returns the next size bytes as a zero-copy memoryview of the mapping.
+        Falls back to read() if the file is not mapped. Views have to be released before exit.
+        :param size:
+        :return:
+        """
+        if self.mm is None or self._mm_view is None:
+            return memoryview(self.read(size))
+
+        start, self._mm_pos = self._mm_range(size)
+        data = self._mm_view[start:self._mm_pos]
+        self._account(data)
         return data
 
+    def readline(self):
+        if self.mm is None:
+            return super(FileInputObject, self).readline()
+
+        end = self.mm.find(b'\n', self._mm_pos)
+        end = len(self.mm) if end < 0 else end + 1
+        line = self.mm[self._mm_pos:end]
+        self._mm_pos = end
+        self._offset = end
+        self._account(line)
+        return line
+
+    def iter_lines(self, batch=None, keepends=True, block_size=LINES_BLOCK_SIZE):
+        """
+        Mapped file is split to lines directly from the mapping
+        :param batch:
+        :param keepends:
+        :param block_size:
+        :return:
+        """
+        if self.mm is None or len(self._buffer):
+            return super(FileInputObject, self).iter_lines(batch=batch, keepends=keepends, block_size=block_size)
+
+        lines = MappedLines(self.mm, self._mm_pos, block_size)
+
+        def consume(size):
+            start, self._mm_pos = self._mm_pos, self._mm_pos + size
+            self._offset = self._mm_pos
+            lines.consume(size)
+            self._account(self._mm_view[start:self._mm_pos] if self._mm_view is not None
+                          else self.mm[start:self._mm_pos])
+
+        return iter_buffer_lines(lines, lines.fill, consume, batch=batch, keepends=keepends)
+
+    def seekable(self):
+        return True
+
+    def _seek(self, position):
+        if self.mm is not None:
+            self._mm_pos = min(position, len(self.mm))
+        else:
+            self.fh.seek(position)
+        self.data_read = position
+
     def handle(self):
         return self.fh
 
@@ -269,8 +864,13 @@ class FileInputObject(InputObject):
         js = super(FileInputObject, self).to_state()
         js['type'] = 'FileInputObject'
         js['fname'] = self.fname
+        js['use_mmap'] = self.use_mmap
         return js
 
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        return cls(js['fname'], use_mmap=js.get('use_mmap', False), digest=js.get('digest', DEFAULT_DIGEST))
+
     def short_desc(self):
         """
         Short description of the current state, for logging
@@ -285,6 +885,7 @@ class FileLikeInputObject(InputObject):
     Does not close the handle on context exit.
     open_call can define how the file-handle is opened.
     """
+    metrics_kind = KIND_IO
 
     def __init__(self, fh=None, desc=None, open_call=None, aux=None, *args, **kwargs):
         super(FileLikeInputObject, self).__init__(*args, **kwargs)
@@ -323,34 +924,72 @@ class FileLikeInputObject(InputObject):
 
     def read(self, size=None):
         data = self.fh.read(size)
-        self.sha256.update(data)
-        self.data_read += len(data)
+        self._account(data)
         return data
 
     def handle(self):
         return self.fh
 
+    def to_state(self):
+        js = super(FileLikeInputObject, self).to_state()
+        js['type'] = 'FileLikeInputObject'
+        js['desc'] = self.desc
+        return js
+
 
 class LinkInputObject(InputObject):
     """
-    Input object using link - remote load
+    Input object using link - remote load.
+    session can be a shared ConnectionPool or requests.Session.
     """
-    def __init__(self, url, headers=None, auth=None, timeout=None, *args, **kwargs):
-        super(LinkInputObject, self).__init__(*args, **kwargs)
+    metrics_kind = KIND_IO
+
+    def __init__(self, url, headers=None, auth=None, timeout=None, session=None, digest=DEFAULT_DIGEST,
+                 *args, **kwargs):
+        super(LinkInputObject, self).__init__(digest=digest, *args, **kwargs)
         self.url = url
         self.headers = headers
         self.auth = auth
         self.r = None
         self.timeout = timeout
+        self.session = session
         self.kwargs = kwargs
 
+    def _http(self):
+        """
+        Returns the HTTP client - shared session if set
+        :return:
+        """
+        return self.session if self.session is not None else requests
+
     def __enter__(self):
         super(LinkInputObject, self).__enter__()
-        self.r = requests.get(self.url, stream=True, allow_redirects=True, headers=self.headers, auth=self.auth,
-                              timeout=self.timeout,
-                              **self.kwargs)
+        headers = self.headers
+        if self._resume_offset:
+            headers = dict(self.headers) if self.headers is not None else {}
+            headers['Range'] = 'bytes=%s-' % self._resume_offset
+
+        self.r = self._http().get(self.url, stream=True, allow_redirects=True, headers=headers, auth=self.auth,
+                                  timeout=self.timeout, **self.kwargs)
+        if self._resume_offset:
+            self._skip_to_resume()
         return self
 
+    def _skip_to_resume(self):
+        """
+        Skips the data before the resume position if the server ignored the Range header
+        :return:
+        """
+        if self.r.status_code != 206:
+            logger.info('Link %s ignored the range request, skipping %s bytes' % (self.url, self._resume_offset))
+            to_skip = self._resume_offset
+            while to_skip > 0:
+                data = self.r.raw.read(min(to_skip, 65536))
+                if not data:
+                    break
+                to_skip -= len(data)
+        self.data_read = self._resume_offset
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         super(LinkInputObject, self).__exit__(exc_type, exc_val, exc_tb)
         try:
@@ -372,14 +1011,12 @@ class LinkInputObject(InputObject):
 
     def read(self, size=None):
         data = self.r.raw.read(size)
-        self.sha256.update(data)
-        self.data_read += len(data)
+        self._account(data)
         return data
 
     def text(self):
         data = self.r.text.encode('utf8')
-        self.sha256.update(data)
-        self.data_read += len(data)
+        self._account(data)
         return data
 
     def handle(self):
@@ -398,6 +1035,13 @@ class LinkInputObject(InputObject):
         js['rec'] = self.rec
         return js
 
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        iobj = cls(js['url'], headers=js.get('headers'), timeout=js.get('timeout'), session=session,
+                   digest=js.get('digest', DEFAULT_DIGEST))
+        iobj.rec = js.get('rec')
+        return iobj
+
 
 class RequestFailedTooManyTimes(Exception):
     """Request just keeps failing"""
@@ -412,10 +1056,25 @@ class ReconnectingLinkInputObject(InputObject):
     Input object that is able to reconnect to the source in case of the problem.
     Link should support calling HEAD method and RangeBytes.
     If this is not supported no reconnection will be used.
+
+    With parallel_connections > 1 and range support the object is split to byte ranges
+    of range_chunk_size, fetched concurrently by a pool of worker threads, each reconnecting
+    on its own. read() still returns the data strictly in order, at most max_inflight_bytes
+    are held in fetched-but-unread ranges.
+
+    session can be a shared ConnectionPool or requests.Session.
+
+    retry is the RetryPolicy of the HEAD request, reconnects and range fetches, by default
+    capped exponential backoff with jitter giving up after max_reconnects failed attempts in a row.
+    Setting stop_event cancels the backoff sleeps at once. retry_state.stats() reports the retry metrics.
     """
+    metrics_kind = KIND_IO
+
     def __init__(self, url, rec=None, headers=None, auth=None, timeout=None,
-                 max_reconnects=None, start_offset=0, pre_data_reconnect_hook=None, *args, **kwargs):
-        super(ReconnectingLinkInputObject, self).__init__(*args, **kwargs)
+                 max_reconnects=None, start_offset=0, pre_data_reconnect_hook=None,
+                 parallel_connections=None, range_chunk_size=RANGE_CHUNK_SIZE, max_inflight_bytes=None,
+                 session=None, retry=None, digest=DEFAULT_DIGEST, *args, **kwargs):
+        super(ReconnectingLinkInputObject, self).__init__(digest=digest, *args, **kwargs)
         self.url = url
         self.headers = headers
         self.auth = auth
@@ -424,9 +1083,15 @@ class ReconnectingLinkInputObject(InputObject):
         self.max_reconnects = max_reconnects
         self.start_offset = start_offset
         self.pre_data_reconnect_hook = pre_data_reconnect_hook
+        self.parallel_connections = parallel_connections
+        self.range_chunk_size = range_chunk_size
+        self.max_inflight_bytes = max_inflight_bytes
+        self.session = session
+        self.retry = to_retry_policy(retry, max_reconnects)
 
         # Overall state
         self.stop_event = threading.Event()
+        self.retry_state = self.retry.new_state(self.stop_event)
         self.content_length = None
         self.total_reconnections = 0
         self.reconnections = 0
@@ -437,43 +1102,37 @@ class ReconnectingLinkInputObject(InputObject):
         # Current state
         self.r = None
         self.current_content_length = 0
+        self.fetcher = None
+        self._lock = threading.Lock()
 
         self.kwargs = kwargs
 
+    def _http(self):
+        """
+        Returns the HTTP client - shared session if set
+        :return:
+        """
+        return self.session if self.session is not None else requests
+
     def _interruptible_sleep(self, sleep_time):
         """
         Sleeps the current thread for given amount of seconds, stop event terminates the sleep - to exit the thread.
         :param sleep_time:
         :return:
         """
-        if sleep_time is None:
-            return
-
-        sleep_time = float(sleep_time)
-
-        if sleep_time == 0:
-            return
-
-        sleep_start = time.time()
-        while not self.stop_event.is_set():
-            time.sleep(0.1)
-            if time.time() - sleep_start >= sleep_time:
-                return
+        if sleep_time:
+            self.retry_state.sleep(float(sleep_time))
 
-    def _sleep_adaptive(self, current_attempt):
+    def _backoff(self, op, current_attempt, since):
         """
-        Sleeps amount of time w.r.t, attempt
-        :param current_attempt: 
-        :return: 
+        Sleeps before the next attempt w.r.t. the retry policy
+        :param op: operation name for the metrics
+        :param current_attempt: failed attempts in a row
+        :param since: time of the first failure in the row
+        :return:
         """
-        if current_attempt <= 5:
-            self._interruptible_sleep(10)
-        elif current_attempt <= 15:
-            self._interruptible_sleep(60)
-        elif current_attempt <= 25:
-            self._interruptible_sleep(5 * 60)
-        else:
-            self._interruptible_sleep(10 * 60)
+        if not self.retry_state.backoff(op, current_attempt, since) and not self.stop_event.is_set():
+            raise RequestFailedTooManyTimes()
 
     def _load_info(self):
         """
@@ -482,12 +1141,13 @@ class ReconnectingLinkInputObject(InputObject):
         """
         r = None
         current_attempt = 0
+        since = None
 
         # First - determine full length & partial request support
         while not self.stop_event.is_set():
             try:
-                r = requests.head(self.url, allow_redirects=True, headers=self.headers, auth=self.auth,
-                                  timeout=self.timeout)
+                r = self._http().head(self.url, allow_redirects=True, headers=self.headers, auth=self.auth,
+                                      timeout=self.timeout)
                 if r.status_code / 100 != 2:
                     logger.error('Link %s does not support head request or link is broken' % self.url)
                     return
@@ -498,10 +1158,12 @@ class ReconnectingLinkInputObject(InputObject):
                 logger.warning('Exception in fetching the url: %s' % e)
                 logger.debug(traceback.format_exc())
                 current_attempt += 1
-                if self.max_reconnects is not None and current_attempt >= self.max_reconnects:
-                    raise RequestFailedTooManyTimes()
-                self._sleep_adaptive(current_attempt)
+                since = since or time.time()
+                self._backoff('head', current_attempt, since)
 
+        self.retry_state.finished('head', current_attempt, since)
+        if r is None:  # cancelled
+            return
         self.head_headers = r.headers
 
         # Load content length, quite essential
@@ -547,6 +1209,7 @@ class ReconnectingLinkInputObject(InputObject):
         :return: 
         """
         headers = self._get_headers()
+        started = time.time()
 
         # Close previous connection
         try:
@@ -557,12 +1220,13 @@ class ReconnectingLinkInputObject(InputObject):
 
         # Iterate several times until we get the response
         current_attempt = 0
+        since = None
         while not self.stop_event.is_set():
             try:
                 logger.info('Reconnecting[%02d, %02d] to the url: %s, timeout: %s, headers: %s'
                             % (current_attempt, self.reconnections, self.url, self.timeout, headers))
-                self.r = requests.get(self.url, stream=True, allow_redirects=True, headers=headers, auth=self.auth,
-                                      timeout=self.timeout, **self.kwargs)
+                self.r = self._http().get(self.url, stream=True, allow_redirects=True, headers=headers,
+                                          auth=self.auth, timeout=self.timeout, **self.kwargs)
                 self.r.raise_for_status()
                 break
 
@@ -570,12 +1234,14 @@ class ReconnectingLinkInputObject(InputObject):
                 logger.warning('Exception in fetching the url: %s' % e)
                 logger.debug(traceback.format_exc())
                 current_attempt += 1
-                if self.max_reconnects is not None and current_attempt >= self.max_reconnects:
-                    raise RequestFailedTooManyTimes()
-                self._sleep_adaptive(current_attempt)
+                since = since or time.time()
+                self._backoff('request', current_attempt, since)
 
+        self.retry_state.finished('request', current_attempt, since)
         self.reconnections += 1
         self.last_reconnection = time.time()
+        if self.metrics is not None:
+            self.metrics.reconnect(self.last_reconnection - started)
 
         # Load content length
         try:
@@ -583,22 +1249,102 @@ class ReconnectingLinkInputObject(InputObject):
         except KeyError:
             logger.error('Link %s does not return content length' % self.url)
 
-    def __enter__(self):
-        super(ReconnectingLinkInputObject, self).__enter__()
-
-        # Load basic info
-        self._load_info()
+    def _is_parallel(self):
+        """
+        Returns true if the parallel range download can be used
+        :return:
+        """
+        return self.parallel_connections is not None and self.parallel_connections > 1 \
+            and self.range_bytes_supported and self.content_length is not None
 
-        # Initial request
-        self._request()
-        return self
+    def _start_fetcher(self):
+        """
+        Starts parallel range download from the current position to the end
+        :return:
+        """
+        if self.fetcher is not None:
+            self.fetcher.close()
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        super(ReconnectingLinkInputObject, self).__exit__(exc_type, exc_val, exc_tb)
-        try:
-            self.r.close()
-        except:
-            logger.error('Error when closing url %s descriptor' % self.url)
+        self.fetcher = RangeFetcher(self._fetch_range, self.start_offset + self.data_read, self.content_length,
+                                    chunk_size=self.range_chunk_size, workers=self.parallel_connections,
+                                    max_inflight=self.max_inflight_bytes, stop_event=self.stop_event)
+        self.fetcher.start_workers()
+
+    def _fetch_range(self, start, end):
+        """
+        Downloads the [start, end) byte range, reconnects on errors.
+        Called from the range fetcher worker threads.
+        :param start:
+        :param end:
+        :return: range data, None if interrupted
+        """
+        chunks = []
+        pos = start
+        current_attempt = 0
+        since = None
+        while pos < end:
+            if self.stop_event.is_set():
+                return None
+
+            headers = dict(self.headers) if self.headers is not None else {}
+            headers['Range'] = 'bytes=%s-%s' % (pos, end - 1)
+            r = None
+            try:
+                r = self._http().get(self.url, stream=True, allow_redirects=True, headers=headers, auth=self.auth,
+                                     timeout=self.timeout, **self.kwargs)
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise ValueError('Range request not honored, status %s' % r.status_code)
+
+                while pos < end:
+                    data = r.raw.read(min(end - pos, 65536))
+                    if not data:
+                        raise RequestReturnedEmptyResponse()
+                    chunks.append(data)
+                    pos += len(data)
+
+            except Exception as e:
+                logger.warning('Exception in fetching the url %s range %s-%s: %s' % (self.url, pos, end, e))
+                logger.debug(traceback.format_exc())
+                current_attempt += 1
+                with self._lock:
+                    self.reconnections += 1
+                    self.last_reconnection = time.time()
+                since = since or time.time()
+                self._backoff('range', current_attempt, since)
+
+            finally:
+                if r is not None:
+                    r.close()
+
+        self.retry_state.finished('range', current_attempt, since)
+        return b''.join(chunks)
+
+    def __enter__(self):
+        super(ReconnectingLinkInputObject, self).__enter__()
+
+        # Load basic info, unless already loaded, e.g., by CachedInputObject
+        if self.head_headers is None:
+            self._load_info()
+
+        # Initial request
+        if self._is_parallel():
+            self._start_fetcher()
+        else:
+            self._request()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        super(ReconnectingLinkInputObject, self).__exit__(exc_type, exc_val, exc_tb)
+        if self.fetcher is not None:
+            self.fetcher.close()
+            self.fetcher = None
+            return
+
+        try:
+            self.r.close()
+        except:
+            logger.error('Error when closing url %s descriptor' % self.url)
 
     def __repr__(self):
         return 'ReconnectingLinkInputObject(url=%r)' % self.url
@@ -618,6 +1364,14 @@ class ReconnectingLinkInputObject(InputObject):
         :param size: 
         :return: 
         """
+        if self.fetcher is not None:
+            data = self.fetcher.read(size)
+            if data:
+                self._account(data)
+            return data
+
+        current_attempt = 0
+        since = None
         while not self.stop_event.is_set():
             try:
                 data = self.r.raw.read(size)
@@ -638,8 +1392,8 @@ class ReconnectingLinkInputObject(InputObject):
                     raise RequestReturnedEmptyResponse()
 
                 # Non-null data, all went right -> pass further
-                self.sha256.update(data)
-                self.data_read += ln
+                self._account(data)
+                self.retry_state.finished('read', current_attempt, since)
                 return data
 
             except Exception as e:
@@ -649,13 +1403,30 @@ class ReconnectingLinkInputObject(InputObject):
                 # Going to reconnect, ask where we stopped
                 if self.pre_data_reconnect_hook is not None:
                     self.pre_data_reconnect_hook(self)
-                self._interruptible_sleep(10)
+                current_attempt += 1
+                since = since or time.time()
+                self._backoff('read', current_attempt, since)
                 self._request()
                 continue
 
         # Unreachable
         return None
 
+    def seekable(self):
+        return self.range_bytes_supported
+
+    def _seek(self, position):
+        """
+        Reconnects with the Range header at the new position, relative to start_offset
+        :param position:
+        :return:
+        """
+        self.data_read = position
+        if self.fetcher is not None:
+            self._start_fetcher()
+        else:
+            self._request()
+
     def handle(self):
         return self.r.raw
 
@@ -673,6 +1444,8 @@ class ReconnectingLinkInputObject(InputObject):
         js['rec'] = self.rec
 
         js['max_reconnects'] = self.max_reconnects
+        js['retry'] = self.retry.to_state()
+        js['retry_stats'] = self.retry_state.stats()
         js['content_length'] = self.content_length
         js['total_reconnections'] = self.total_reconnections
         js['reconnections'] = self.reconnections
@@ -680,47 +1453,199 @@ class ReconnectingLinkInputObject(InputObject):
         js['head_headers'] = dict(self.head_headers) if self.head_headers is not None else None
         js['range_bytes_supported'] = self.range_bytes_supported
         js['current_content_length'] = self.range_bytes_supported
+        js['parallel_connections'] = self.parallel_connections
         return js
 
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        return cls(js['url'], rec=js.get('rec'), headers=js.get('headers'), timeout=js.get('timeout'),
+                   max_reconnects=js.get('max_reconnects'), start_offset=js.get('start_offset') or 0,
+                   parallel_connections=js.get('parallel_connections'), retry=js.get('retry'), session=session,
+                   digest=js.get('digest', DEFAULT_DIGEST))
+
+    def _resume_at(self, position):
+        """
+        Requests continue with the Range header at start_offset + data_read
+        :param position:
+        :return:
+        """
+        super(ReconnectingLinkInputObject, self)._resume_at(position)
+        self.data_read = position
+
 
 class TeeInputObject(InputObject):
     """
     Tee input object - reading underlying data stream, with stream copy to a different file like object 
     (e.g., a file)
+
+    With write_behind the copy is written on a background thread, see WriteBehindSink,
+    sink_policy decides what happens if the copy lags more than sink_max_bytes.
+    sinks are additional sinks (FileSink, SocketSink, DigestSink, any object with write / flush / close)
+    always written behind, WriteBehindSink can set the policy of the sink. sink_stats() reports the lag.
+
+    With zero_copy (opt-in), if the parent is a FileInputObject / FileLikeInputObject over a regular file and
+    the copy is a regular file too, the copy is made in the kernel (copy_file_range, sendfile) from the source file
+    instead of writing the data read, the consumer still gets the data. The copy then comes from the file, not
+    from the data read and hashed, so it may differ if the source file is being written meanwhile.
     """
-    def __init__(self, parent_fh, copy_fh=None, close_copy_on_exit=False, copy_fname=None, *args, **kwargs):
+    def __init__(self, parent_fh, copy_fh=None, close_copy_on_exit=False, copy_fname=None, write_behind=False,
+                 sinks=None, sink_policy=SINK_BLOCK, sink_max_bytes=SINK_MAX_BYTES, zero_copy=False, *args, **kwargs):
         super(TeeInputObject, self).__init__(*args, **kwargs)
         self.parent_fh = parent_fh
         self.copy_fh = copy_fh
         self.copy_fname = copy_fname
         self.copy_fname_tmp = None
         self.close_copy_on_exit = close_copy_on_exit
+        self.write_behind = write_behind
+        self.sink_policy = sink_policy
+        self.sink_max_bytes = sink_max_bytes
+        self.writers = [to_writer(x, policy=sink_policy, max_bytes=sink_max_bytes, name='tee-sink-%s' % idx)
+                        for idx, x in enumerate(sinks or [])]
+        self._copy_writer = None
+        self.zero_copy = zero_copy
+        self._zero_copy_fds = None  # (source fd, copy fd) of the kernel copy
+        self._replay_fh = None  # copy written before the resume, served before the parent data
+        self._replay_left = 0
 
     def __enter__(self):
         super(TeeInputObject, self).__enter__()
 
-        # Open temporary file, write to it, on finish rename
-        if self.copy_fh is None and self.copy_fname is not None:
+        # Open temporary file, write to it, on finish rename. Resumed copy is reopened after the parent
+        if self.copy_fh is None and self.copy_fname is not None and \
+                (self._resume_offset is None or self.copy_fname_tmp is None):
             self.copy_fname_tmp = '%s.%s.%s' % (self.copy_fname, int(time.time()*1000), random.randint(0, 1000))
             self.copy_fh = open(self.copy_fname_tmp, 'wb')
             logger.debug('Tee to temp file %s' % self.copy_fname_tmp)
 
         try:
             self.parent_fh.__enter__()
+            if self._resume_offset is not None:
+                self._resume_copy()
+            self._start_zero_copy()
+            self._start_writers()
             return self
         except Exception as e:
             logger.debug('Exception when entering to the parent fh %s' % e)
             logger.debug(traceback.format_exc())
+            if self._resume_offset is not None:
+                raise
+
+    def _start_zero_copy(self):
+        """
+        Enables the kernel copy if both the source and the copy are regular files
+        :return:
+        """
+        if not self.zero_copy or not ZERO_COPY_SUPPORTED or self.write_behind or self.copy_fh is None \
+                or not isinstance(self.parent_fh, (FileInputObject, FileLikeInputObject)):
+            return
+
+        src_fd, dst_fd = regular_fd(self.parent_fh.handle()), regular_fd(self.copy_fh)
+        if src_fd is None or dst_fd is None:
+            return
+        self.copy_fh.flush()  # buffered data would be written after the kernel copies
+        self._zero_copy_fds = (src_fd, dst_fd)
+        logger.debug('Tee %s copied in the kernel' % self.parent_fh)
+
+    def _source_offset(self):
+        """
+        Offset of the next source read in the source file
+        :return:
+        """
+        if isinstance(self.parent_fh, FileInputObject):
+            return self.parent_fh.tell()
+        return self.parent_fh.handle().tell()
+
+    def _copy_zero(self, offset, size):
+        """
+        Copies the data just read in the kernel, disables the kernel copy if not possible
+        :param offset: source offset of the data
+        :param size:
+        :return: number of bytes copied
+        """
+        try:
+            return copy_range(self._zero_copy_fds[0], self._zero_copy_fds[1], offset, size)
+        except ZeroCopyUnsupported as e:
+            logger.info('Kernel copy of %s disabled: %s' % (self.parent_fh, e))
+            self._zero_copy_fds = None
+            return 0
+
+    def _start_writers(self):
+        """
+        Starts the write-behind threads of the copy and the sinks
+        :return:
+        """
+        if self.write_behind and self.copy_fh is not None:
+            self._copy_writer = WriteBehindSink(FileSink(self.copy_fh), policy=self.sink_policy,
+                                                max_bytes=self.sink_max_bytes, name='tee-copy')
+            self.writers.insert(0, self._copy_writer)
+        for writer in self.writers:
+            writer.start()
+
+    def _close_writers(self):
+        """
+        Writes the queued data and stops the write-behind threads
+        :return:
+        """
+        for writer in self.writers:
+            try:
+                writer.close()
+            except Exception as e:
+                logger.warning('Exception when closing the sink %s: %s' % (writer, e))
+                logger.debug(traceback.format_exc())
+        if self._copy_writer is not None:
+            self.writers.remove(self._copy_writer)
+            self._copy_writer = None
+
+    def sink_stats(self):
+        """
+        Returns the metrics of the write-behind sinks
+        :return:
+        """
+        return [x.stats() for x in self.writers]
+
+    def _resume_copy(self):
+        """
+        Continues the copy at the position of the resumed parent. The copy may have been
+        shorter than the recorded position (not flushed before the crash), the gap is re-read.
+        If the resume position precedes the parent, e.g., a gzip stream decompressed again from the start,
+        the data up to the parent position are served from the copy written so far.
+        :return:
+        """
+        if self.copy_fh is None:
+            self.copy_fh = open(self.copy_fname_tmp, 'r+b')
+            self.copy_fh.truncate(self.parent_fh.tell())
+            self.copy_fh.seek(0, os.SEEK_END)
+            logger.debug('Tee resumed to temp file %s at %s' % (self.copy_fname_tmp, self.parent_fh.tell()))
+
+        self.data_read = self.parent_fh.tell()
+        if self._resume_offset < self.data_read:
+            self.copy_fh.flush()
+            self._replay_fh = open(self.copy_fname_tmp, 'rb')
+            self._replay_fh.seek(self._resume_offset)
+            self._replay_left = self.data_read - self._resume_offset
+            self.data_read = self._resume_offset
+            logger.debug('Tee serves %s bytes from the copy %s before the parent'
+                         % (self._replay_left, self.copy_fname_tmp))
+            return
+
+        while self.data_read < self._resume_offset:
+            data = self.parent_fh.read(min(self._resume_offset - self.data_read, 65536))
+            if not data:
+                break
+            self.copy_fh.write(data)
+            self.data_read += len(data)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         super(TeeInputObject, self).__exit__(exc_type, exc_val, exc_tb)
+        self._close_replay()
         try:
             self.parent_fh.__exit__(exc_type, exc_val, exc_tb)
         except Exception as e:
             logger.debug('Exception when exiting to the parent fh %s' % e)
             logger.debug(traceback.format_exc())
 
-        if self.close_copy_on_exit:
+        self._close_writers()
+        if self.close_copy_on_exit or self.copy_fname_tmp is not None:  # own copy is flushed before the rename
             try:
                 self.copy_fh.close()
             except Exception as e:
@@ -743,15 +1668,62 @@ class TeeInputObject(InputObject):
     def size(self):
         return self.parent_fh.size()
 
+    def _close_replay(self):
+        """
+        Closes the copy served after the resume
+        :return:
+        """
+        if self._replay_fh is not None:
+            self._replay_fh.close()
+            self._replay_fh = None
+            self._replay_left = 0
+
+    def _read_replay(self, size=None):
+        """
+        Reads the data written to the copy before the resume, the copy is not written again
+        :param size:
+        :return:
+        """
+        data = self._replay_fh.read(self._replay_left if size is None or size < 0 else min(size, self._replay_left))
+        if not data:
+            raise IOError('Tee copy %s is shorter than recorded' % self.copy_fname_tmp)
+        self._replay_left -= len(data)
+        if self._replay_left == 0:
+            self._close_replay()
+
+        self._account(data)
+        for writer in self.writers:
+            writer.put(data)
+        return data
+
     def read(self, size=None):
+        if self._replay_fh is not None:
+            return self._read_replay(size)
+
+        offset = self._source_offset() if self._zero_copy_fds is not None else None
         data = self.parent_fh.read(size)
-        self.sha256.update(data)
-        self.data_read += len(data)
+        self._account(data)
+
+        for writer in self.writers:
+            writer.put(data)
+        if self._copy_writer is not None or self.copy_fh is None:
+            return data
+
+        rest = data
+        if offset is not None:
+            copied = self._copy_zero(offset, len(data))
+            if copied == len(data):
+                return data
+            rest = data[copied:]
+            if self._zero_copy_fds is not None:
+                # later kernel copies would overtake the buffered rest
+                logger.info('Kernel copy of %s disabled after a short copy' % self.parent_fh)
+                self._zero_copy_fds = None
 
         cur_ctr = 0
         while True:
             try:
-                self.copy_fh.write(data)
+                self.copy_fh.write(rest)
                 return data
 
             except Exception as e:
@@ -765,12 +1737,42 @@ class TeeInputObject(InputObject):
     def handle(self):
         return self.parent_fh.handle()
 
+    def children(self):
+        return [self.parent_fh]
+
     def to_state(self):
         js = super(TeeInputObject, self).to_state()
         js['type'] = 'TeeInputObject'
+        js['copy_fname'] = self.copy_fname
+        js['copy_fname_tmp'] = self.copy_fname_tmp
+        js['close_copy_on_exit'] = self.close_copy_on_exit
+        js['write_behind'] = self.write_behind
+        js['sink_policy'] = self.sink_policy
+        js['zero_copy'] = self.zero_copy
+        js['sink_stats'] = self.sink_stats()
         js['parent'] = self.parent_fh.to_state()
         return js
 
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        copy_fname, copy_fname_tmp = js.get('copy_fname'), js.get('copy_fname_tmp')
+        if copy_fname is None:
+            raise ValueError('TeeInputObject without copy_fname cannot be rebuilt from the state')
+
+        # parent resumes at the end of the copy written so far
+        position = js['data_read']
+        if copy_fname_tmp is not None and os.path.exists(copy_fname_tmp):
+            position = min(position, os.path.getsize(copy_fname_tmp))
+        else:
+            position, copy_fname_tmp = 0, None
+
+        iobj = cls(build(js['parent'], position), copy_fname=copy_fname,
+                   close_copy_on_exit=js.get('close_copy_on_exit', False), write_behind=js.get('write_behind', False),
+                   sink_policy=js.get('sink_policy', SINK_BLOCK), zero_copy=js.get('zero_copy', False),
+                   digest=js.get('digest', DEFAULT_DIGEST))
+        iobj.copy_fname_tmp = copy_fname_tmp
+        return iobj
+
     def short_desc(self):
         """
         Short description of the current state, for logging
@@ -779,169 +1781,848 @@ class TeeInputObject(InputObject):
         return 'TeeInputObject(parent=%s)' % (self.parent_fh.short_desc())
 
     def flush(self):
-        self.copy_fh.flush()
+        for writer in self.writers:
+            writer.flush()
+        if self.copy_fh is not None:
+            self.copy_fh.flush()
 
 
-class MergedInputObject(InputObject):
+class CachedInputObject(InputObject):
     """
-    Merges multiple file input objects into one. 
-    (e.g., a file)
+    Local on-disk cache of a remote input object (LinkInputObject, ReconnectingLinkInputObject), see ContentCache.
+    The cache key is built from the URL and the HEAD response validators (ETag, Last-Modified, Content-Length).
+
+    A hit is read from the memory mapped cache file, seekable. A miss is read from the remote
+    object and copied to the cache entry through TeeInputObject, the entry is published when
+    the whole object is read. An interrupted fill is resumed later - the stored part is read from the disk
+    and the rest is requested with the Range header. If another process fills the entry or the response
+    has no validators the remote object is read without caching.
     """
-    def __init__(self, iobjs, close_after_use=True, *args, **kwargs):
-        super(MergedInputObject, self).__init__(*args, **kwargs)
-        self.iobjs = iobjs
-        self.cur_iobj = 0
-        self.finished = False
-        self._close_after_use = close_after_use
-        self._do_close = [False] * len(self.iobjs)
+    metrics_kind = KIND_IO
+
+    def __init__(self, iobj, cache, *args, **kwargs):
+        super(CachedInputObject, self).__init__(*args, **kwargs)
+        self.iobj = iobj
+        self.cache = cache
+        self.key = None
+        self.hit = False
+        self.content_length = None
+        self._source = None  # input object read after the stored part
+        self._prefix = None  # stored part of the entry being filled
+        self._fill_lock = None
+        self._part_fh = None
 
     def __enter__(self):
-        super(MergedInputObject, self).__enter__()
-        if len(self.iobjs) == 0:
-            return
+        super(CachedInputObject, self).__enter__()
+        headers = self._head()
+        self.key = self.cache.key(self.iobj.url, headers)
+        try:
+            self.content_length = int(headers['Content-Length'])
+        except (TypeError, KeyError, ValueError):
+            self.content_length = None
+
+        if self.key is None:
+            logger.info('Link %s has no validators, not cached' % self.iobj.url)
+        elif not self._open_hit():
+            self._fill_lock = self.cache.lock_fill(self.key)
+            if self._fill_lock is None:
+                logger.info('Cache entry of %s is being filled by another process' % self.iobj.url)
+            elif not self._open_hit():  # committed by another process in the meantime
+                self._open_fill(headers)
+
+        if self._source is None:
+            self._source = self.iobj
+            self.iobj.__enter__()
+
+        if self._resume_offset:
+            if self.hit:
+                self._seek(self._resume_offset)
+            else:
+                self.data_read = skip_bytes(self._read, self._resume_offset)
+        return self
+
+    def _head(self):
+        """
+        Returns the HEAD response headers of the link, reuses the ReconnectingLinkInputObject info request
+        :return:
+        """
+        iobj = self.iobj
+        if isinstance(iobj, ReconnectingLinkInputObject):
+            if iobj.head_headers is None:
+                iobj._load_info()
+            return iobj.head_headers
 
         try:
-            self._enter_sub(self.cur_iobj)
-            return self
+            r = iobj._http().head(iobj.url, allow_redirects=True, headers=iobj.headers, auth=iobj.auth,
+                                  timeout=iobj.timeout)
+            r.raise_for_status()
+            return r.headers
         except Exception as e:
-            logger.debug('Exception when entering to the sub fh %s %s' % (self.cur_iobj, e))
-            logger.debug(traceback.format_exc())
+            logger.warning('Head request on %s failed, not cached: %s' % (iobj.url, e))
+            return None
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        super(MergedInputObject, self).__exit__(exc_type, exc_val, exc_tb)
-        for idx in range(len(self.iobjs)):
-            try:
-                self._close_sub(idx)
-            except Exception as e:
-                logger.debug('Exception when exiting from the sub fh %s %s' % (self.cur_iobj, e))
-                logger.debug(traceback.format_exc())
+    def _open_hit(self):
+        """
+        Opens the complete cache entry if exists
+        :return: True on hit
+        """
+        fname = self.cache.lookup(self.key)
+        if fname is None:
+            return False
 
-    def _enter_sub(self, idx):
+        if self._fill_lock is not None:
+            self._fill_lock.release()
+            self._fill_lock = None
+        self._source = FileInputObject(fname, use_mmap=True, digest=NO_DIGEST).__enter__()
+        self.hit = True
+        logger.debug('Cache hit %s for %s' % (fname, self.iobj.url))
+        return True
+
+    def _open_fill(self, headers):
         """
-        Enter the sub data source with given index
-        :param idx: 
-        :return: 
+        Starts filling the cache entry, continues the stored part if the link supports ranges
+        :param headers: HEAD response headers
+        :return:
         """
-        self.iobjs[idx].__enter__()
-        self._do_close[idx] = True
+        part_size = self.cache.part_size(self.key)
+        ranges = 'bytes' in (headers.get('Accept-Ranges') or '')
+        if part_size and (not ranges or (self.content_length is not None and part_size > self.content_length)):
+            logger.info('Cache part of %s cannot be resumed, discarding' % self.iobj.url)
+            self.cache.discard(self.key)
+            part_size = 0
 
-    def _close_sub(self, idx):
+        if part_size:
+            logger.debug('Cache fill of %s resumed at %s' % (self.iobj.url, part_size))
+            self._prefix = FileInputObject(self.cache.part_fname(self.key), digest=NO_DIGEST).__enter__()
+            self.iobj._resume_at(part_size)
+
+        self._part_fh = open(self.cache.part_fname(self.key), 'ab')
+        self._source = TeeInputObject(self.iobj, copy_fh=self._part_fh, digest=NO_DIGEST)
+        self._source.__enter__()
+
+    def _finish_fill(self):
         """
-        Close the source with the index if closable
-        :param idx: 
-        :return: 
+        Publishes the filled entry if complete
+        :return:
         """
-        if self._do_close[idx]:
-            self.iobjs[idx].__exit__(None, None, None)
-            self._do_close[idx] = False
+        self._part_fh.close()
+        self._part_fh = None
+        part_size = self.cache.part_size(self.key)
+        if self.content_length is None or part_size == self.content_length:
+            self.cache.commit(self.key)
+        else:
+            logger.warning('Cache entry of %s has %s bytes, expected %s, discarding'
+                           % (self.iobj.url, part_size, self.content_length))
+            self.cache.discard(self.key)
+        self._fill_lock.release()
+        self._fill_lock = None
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        super(CachedInputObject, self).__exit__(exc_type, exc_val, exc_tb)
+        try:
+            if self._prefix is not None:
+                self._prefix.__exit__(exc_type, exc_val, exc_tb)
+                self._prefix = None
+            if self._source is not None:
+                self._source.__exit__(exc_type, exc_val, exc_tb)
+        except Exception as e:
+            logger.debug('Exception when exiting to the parent fh %s' % e)
+            logger.debug(traceback.format_exc())
+
+        # interrupted fill, the part stays for the next run
+        if self._part_fh is not None:
+            self._part_fh.close()
+            self._part_fh = None
+        if self._fill_lock is not None:
+            self._fill_lock.release()
+            self._fill_lock = None
 
     def __repr__(self):
-        return 'MergedInputObject(iobjs=%r)' % (self.iobjs)
+        return 'CachedInputObject(iobj=%r, cache=%r)' % (self.iobj, self.cache)
 
     def __str__(self):
-        return self.__repr__()
+        return str(self.iobj)
 
     def check(self):
-        return self.iobjs[self.cur_iobj].check()
+        return self.iobj.check()
 
     def size(self):
-        return -1
+        if self.hit:
+            return self._source.size()
+        return self.content_length if self.content_length is not None else -1
+
+    def _read(self, size=None):
+        """
+        Reads the stored part first, then the source, publishes the entry at the end
+        :param size:
+        :return:
+        """
+        data = b''
+        if self._prefix is not None:
+            data = self._prefix.read(size)
+            if data and size is not None and size >= 0:
+                return data
+            self._prefix.__exit__(None, None, None)
+            self._prefix = None
+            if size is not None and size >= 0:
+                size = size - len(data)
+
+        data += self._source.read(size)
+        if self._fill_lock is not None and (not data or size is None or size < 0):
+            self._finish_fill()
+        return data
 
     def read(self, size=None):
-        while not self.finished:
-            data = self.iobjs[self.cur_iobj].read(size)
-            if is_empty(data):
-                if self.cur_iobj + 1 == len(self.iobjs):
-                    self.finished = True
-                    return data
+        data = self._read(size)
+        self._account(data)
+        return data
 
-                if self._close_after_use:
-                    self._close_sub(self.cur_iobj)
-                self.cur_iobj += 1
-                self._enter_sub(self.cur_iobj)
-                continue
+    def readinto(self, b):
+        if not self.hit:
+            return super(CachedInputObject, self).readinto(b)
 
-            self.sha256.update(data)
-            self.data_read += len(data)
-            return data
-        return None
+        n = self._source.readinto(b)
+        self._account(memoryview(b)[:n])
+        return n
+
+    def readline(self):
+        """
+        Read a single line, directly from the mapped cache file on a hit
+        :return:
+        """
+        if not self.hit:
+            return super(CachedInputObject, self).readline()
+
+        line = self._source.readline()
+        self._account(line)
+        return line
+
+    def seekable(self):
+        return self.hit
+
+    def _seek(self, position):
+        self._source.seek(position)
+        self.data_read = position
+
+    def tell(self):
+        if self.hit:
+            return self._source.tell()
+        return super(CachedInputObject, self).tell()
 
     def handle(self):
-        return self.iobjs[self.cur_iobj].handle()
+        return self._source.handle() if self._source is not None else None
+
+    def children(self):
+        return [self.iobj]
 
     def to_state(self):
-        js = super(MergedInputObject, self).to_state()
-        js['type'] = 'MergedInputObject'
-        js['cur_iobj_idx'] = self.cur_iobj
-        js['do_close'] = self._do_close
-        js['cur_iobj'] = self.iobjs[self.cur_iobj].to_state()
-        js['iobjs'] = [x.to_state() for x in self.iobjs]
+        js = super(CachedInputObject, self).to_state()
+        js['type'] = 'CachedInputObject'
+        js['cache'] = self.cache.to_state()
+        js['key'] = self.key
+        js['hit'] = self.hit
+        js['iobj'] = self.iobj.to_state()
         return js
 
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        # the cache resumes the fill itself, the link starts at the stored part
+        cache = js['cache']
+        return cls(build(js['iobj'], 0), ContentCache(cache['directory'], max_bytes=cache.get('max_bytes')),
+                   digest=js.get('digest', DEFAULT_DIGEST))
+
     def short_desc(self):
-        return 'MergedInputObject(data_read=%r, cur=%s)' % (self.data_read, self.iobjs[self.cur_iobj].short_desc())
+        return 'CachedInputObject(data_read=%r, hit=%r, iobj=%s)' % (self.data_read, self.hit, self.iobj.short_desc())
 
     def flush(self):
-        self.iobjs[self.cur_iobj].flush()
+        if self._part_fh is not None:
+            self._part_fh.flush()
 
 
-class GzipInputObject(InputObject):
+class PrefetchInputObject(InputObject):
     """
-    Input object for reading another input object in gzip form
+    Read-ahead wrapper - drains the wrapped input object on a background thread
+    to a queue of at most max_buffer_bytes, so e.g. network I/O overlaps with
+    decompression and parsing on the consumer thread.
+
+    Exceptions of the wrapped object are re-raised on read(). Reconnects of
+    the wrapped ReconnectingLinkInputObject still call its pre_data_reconnect_hook
+    on the reading thread, on_reconnect(iobj) is then called on the consumer
+    thread when the consumer reaches the reconnect position in the stream.
+    Setting stop_event (shared with the wrapped object if it has one) cancels the reading.
     """
-    def __init__(self, iobj, *args, **kwargs):
-        super(GzipInputObject, self).__init__(*args, **kwargs)
+    def __init__(self, iobj, max_buffer_bytes=PREFETCH_MAX_BYTES, chunk_size=PREFETCH_CHUNK_SIZE,
+                 on_reconnect=None, *args, **kwargs):
+        super(PrefetchInputObject, self).__init__(*args, **kwargs)
         self.iobj = iobj
-        self.gzip_fh = None
+        self.max_buffer_bytes = max_buffer_bytes
+        self.chunk_size = chunk_size
+        self.on_reconnect = on_reconnect
+        self.stop_event = getattr(iobj, 'stop_event', None) or threading.Event()
+        self.reconnect_events = 0
+        self.buffer = None
+        self._hook_installed = False
+        self._orig_reconnect_hook = None
 
     def __enter__(self):
-        super(GzipInputObject, self).__enter__()
-        try:
-            self.iobj.__enter__()
-            self.gzip_fh = GzipInputStream(fileobj=self.iobj)
-            return self
-        except Exception as e:
-            logger.debug('Exception when entering to the parent fh %s' % e)
-            logger.debug(traceback.format_exc())
+        super(PrefetchInputObject, self).__enter__()
+        self.iobj.__enter__()
+
+        if hasattr(self.iobj, 'pre_data_reconnect_hook'):
+            self._orig_reconnect_hook = self.iobj.pre_data_reconnect_hook
+            self.iobj.pre_data_reconnect_hook = self._reconnect_hook
+            self._hook_installed = True
+
+        self.buffer = ReadAheadBuffer(self.iobj.read, chunk_size=self.chunk_size, max_bytes=self.max_buffer_bytes,
+                                      stop_event=self.stop_event, on_event=self._on_event,
+                                      name='prefetch-%s' % self.iobj)
+        self.buffer.start()
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        super(GzipInputObject, self).__exit__(exc_type, exc_val, exc_tb)
+        super(PrefetchInputObject, self).__exit__(exc_type, exc_val, exc_tb)
         try:
-            self.iobj.__exit__(exc_type, exc_val, exc_tb)
-            self.gzip_fh.close()
+            self.stop_event.set()
+            self.buffer.close()
         except Exception as e:
-            logger.debug('Exception when exiting to the parent fh %s' % e)
+            logger.debug('Exception when stopping the prefetch thread %s' % e)
             logger.debug(traceback.format_exc())
 
+        if self._hook_installed:
+            self.iobj.pre_data_reconnect_hook = self._orig_reconnect_hook
+            self._hook_installed = False
+        self.iobj.__exit__(exc_type, exc_val, exc_tb)
+
+    def _reconnect_hook(self, iobj):
+        """
+        Reconnect hook installed to the wrapped object, called on the prefetch thread
+        :param iobj:
+        :return:
+        """
+        if self._orig_reconnect_hook is not None:
+            self._orig_reconnect_hook(iobj)
+        self.buffer.post_event(iobj)
+
+    def _on_event(self, iobj):
+        """
+        Reconnect event reached the consumer
+        :param iobj:
+        :return:
+        """
+        self.reconnect_events += 1
+        if self.on_reconnect is not None:
+            self.on_reconnect(iobj)
+
     def __repr__(self):
-        return 'GzipInputObject(iobj=%r)' % (self.iobj)
+        return 'PrefetchInputObject(iobj=%r)' % self.iobj
 
     def __str__(self):
-        return self.__repr__()
+        return str(self.iobj)
 
     def check(self):
         return self.iobj.check()
 
     def size(self):
-        return -1
+        return self.iobj.size()
 
     def read(self, size=None):
-        data = self.gzip_fh.read(size)
-        self.sha256.update(data)
-        self.data_read += len(data)
+        data = self.buffer.read(size)
+        if data:
+            self._account(data)
         return data
 
     def handle(self):
         return None
 
+    def children(self):
+        return [self.iobj]
+
     def to_state(self):
-        js = super(GzipInputObject, self).to_state()
-        js['type'] = 'GzipInputObject'
+        js = super(PrefetchInputObject, self).to_state()
+        js['type'] = 'PrefetchInputObject'
+        js['max_buffer_bytes'] = self.max_buffer_bytes
+        js['buffered'] = self.buffer.buffered if self.buffer is not None else 0
+        js['reconnect_events'] = self.reconnect_events
         js['iobj'] = self.iobj.to_state()
         return js
 
-    def short_desc(self):
-        return 'GzipInputObject(data_read=%r, iobj=%s)' % (self.data_read, self.iobj.short_desc())
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        # data read ahead but not consumed is read again
+        return cls(build(js['iobj'], js['data_read']), max_buffer_bytes=js.get('max_buffer_bytes'),
+                   digest=js.get('digest', DEFAULT_DIGEST))
+
+    def _resume_at(self, position):
+        super(PrefetchInputObject, self)._resume_at(position)
+        self.data_read = position
+
+    def short_desc(self):
+        return 'PrefetchInputObject(data_read=%r, buffered=%r, iobj=%s)' \
+               % (self.data_read, self.buffer.buffered if self.buffer is not None else 0, self.iobj.short_desc())
+
+    def flush(self):
+        self.iobj.flush()
+
+
+class MergedInputObject(InputObject):
+    """
+    Merges multiple file input objects into one. 
+    (e.g., a file)
+    With share_session the link objects in the sub stacks without own session
+    share one ConnectionPool (session, if given) so the connections are reused.
+
+    With open_ahead=K the next K sources are opened on background threads while
+    the current one is being read, so switching to the next source does not stall
+    on HEAD / GET. With prefetch_bytes the pre-opened sources also start reading
+    ahead up to prefetch_bytes each. Pre-opened sources never used are closed on exit.
+    """
+    def __init__(self, iobjs, close_after_use=True, session=None, share_session=True, open_ahead=0,
+                 prefetch_bytes=None, *args, **kwargs):
+        super(MergedInputObject, self).__init__(*args, **kwargs)
+        self.iobjs = iobjs
+        self.cur_iobj = 0
+        self.finished = False
+        self._close_after_use = close_after_use
+        self._do_close = [False] * len(self.iobjs)
+        self.session = session
+        self._own_session = False
+        if share_session:
+            self._share_session()
+
+        self.open_ahead = open_ahead or 0
+        self.prefetch_bytes = prefetch_bytes
+        self._opening = {}  # idx -> opening thread
+        self._open_errors = {}  # idx -> exception raised when opening ahead
+        self._readers = {}  # idx -> ReadAheadBuffer
+        self._consumed = [0] * len(self.iobjs)  # bytes consumed from each source
+
+    def _share_session(self):
+        """
+        Sets the shared session to all link objects without a session
+        :return:
+        """
+        links = [x for iobj in self.iobjs for x in iter_input_objects(iobj)
+                 if isinstance(x, (LinkInputObject, ReconnectingLinkInputObject)) and x.session is None]
+        if len(links) == 0:
+            return
+
+        if self.session is None:
+            self.session = ConnectionPool()
+            self._own_session = True
+        for x in links:
+            x.session = self.session
+
+    def __enter__(self):
+        super(MergedInputObject, self).__enter__()
+        if len(self.iobjs) == 0:
+            return
+
+        try:
+            self._enter_sub(self.cur_iobj)
+            return self
+        except Exception as e:
+            logger.debug('Exception when entering to the sub fh %s %s' % (self.cur_iobj, e))
+            logger.debug(traceback.format_exc())
+            if self._resume_offset is not None:
+                raise
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        super(MergedInputObject, self).__exit__(exc_type, exc_val, exc_tb)
+        for idx in range(len(self.iobjs)):
+            try:
+                self._close_sub(idx)
+            except Exception as e:
+                logger.debug('Exception when exiting from the sub fh %s %s' % (self.cur_iobj, e))
+                logger.debug(traceback.format_exc())
+
+        if self._own_session:
+            self.session.close()
+
+    def _enter_sub(self, idx):
+        """
+        Enter the sub data source with given index
+        :param idx: 
+        :return: 
+        """
+        if idx in self._opening:
+            self._wait_open(idx)
+        else:
+            self.iobjs[idx].__enter__()
+            self._do_close[idx] = True
+        self._open_next(idx)
+
+    def _open_next(self, idx):
+        """
+        Starts opening the open_ahead sources following the one with the index
+        :param idx:
+        :return:
+        """
+        for nxt in range(idx + 1, min(idx + 1 + self.open_ahead, len(self.iobjs))):
+            if nxt in self._opening or self._do_close[nxt]:
+                continue
+            t = threading.Thread(target=self._open_sub, args=(nxt,), name='merged-open-%s' % nxt)
+            t.daemon = True
+            self._opening[nxt] = t
+            t.start()
+
+    def _open_sub(self, idx):
+        """
+        Opens the source in the background, optionally starts reading ahead
+        :param idx:
+        :return:
+        """
+        try:
+            iobj = self.iobjs[idx]
+            iobj.__enter__()
+            self._do_close[idx] = True
+            if self.prefetch_bytes:
+                self._readers[idx] = ReadAheadBuffer(iobj.read, max_bytes=self.prefetch_bytes,
+                                                     stop_event=getattr(iobj, 'stop_event', None),
+                                                     name='merged-prefetch-%s' % idx).start()
+        except Exception as e:
+            logger.warning('Exception when opening ahead the sub fh %s %s' % (idx, e))
+            logger.debug(traceback.format_exc())
+            self._open_errors[idx] = e
+
+    def _wait_open(self, idx):
+        """
+        Waits for the background open of the source, re-raises its exception
+        :param idx:
+        :return:
+        """
+        self._opening.pop(idx).join()
+        if idx in self._open_errors:
+            raise self._open_errors.pop(idx)
+
+    def _read_sub(self, idx, size):
+        """
+        Reads from the source, through the read-ahead buffer if it has one
+        :param idx:
+        :param size:
+        :return:
+        """
+        reader = self._readers.get(idx)
+        if reader is not None:
+            return reader.read(size)
+        return self.iobjs[idx].read(size)
+
+    def _close_sub(self, idx):
+        """
+        Close the source with the index if closable
+        :param idx: 
+        :return: 
+        """
+        if idx in self._opening:
+            self._opening.pop(idx).join()
+            self._open_errors.pop(idx, None)
+
+        reader = self._readers.pop(idx, None)
+        if reader is not None:
+            stop_event = getattr(self.iobjs[idx], 'stop_event', None)
+            if stop_event is not None:
+                stop_event.set()
+            reader.close()
+
+        if self._do_close[idx]:
+            self.iobjs[idx].__exit__(None, None, None)
+            self._do_close[idx] = False
+
+    def __repr__(self):
+        return 'MergedInputObject(iobjs=%r)' % (self.iobjs)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def check(self):
+        return self.iobjs[self.cur_iobj].check()
+
+    def size(self):
+        return -1
+
+    def read(self, size=None):
+        while not self.finished:
+            data = self._read_sub(self.cur_iobj, size)
+            if is_empty(data):
+                if self.cur_iobj + 1 == len(self.iobjs):
+                    self.finished = True
+                    return data
+
+                if self._close_after_use:
+                    self._close_sub(self.cur_iobj)
+                self.cur_iobj += 1
+                self._enter_sub(self.cur_iobj)
+                continue
+
+            self._account(data)
+            self._consumed[self.cur_iobj] += len(data)
+            return data
+        return None
+
+    def handle(self):
+        return self.iobjs[self.cur_iobj].handle()
+
+    def children(self):
+        return list(self.iobjs)
+
+    def to_state(self):
+        js = super(MergedInputObject, self).to_state()
+        js['type'] = 'MergedInputObject'
+        js['open_ahead'] = self.open_ahead
+        js['cur_iobj_idx'] = self.cur_iobj
+        js['finished'] = self.finished
+        js['consumed'] = self._consumed
+        js['do_close'] = self._do_close
+        js['cur_iobj'] = self.iobjs[self.cur_iobj].to_state()
+        js['iobjs'] = [x.to_state() for x in self.iobjs]
+        return js
+
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        cur = js['cur_iobj_idx']
+        consumed = js.get('consumed') or [0] * len(js['iobjs'])
+        iobjs = [build(x, consumed[idx] if idx == cur else 0) for idx, x in enumerate(js['iobjs'])]
+        iobj = cls(iobjs, open_ahead=js.get('open_ahead'), session=session, digest=js.get('digest', DEFAULT_DIGEST))
+        iobj.cur_iobj = cur
+        iobj.finished = js.get('finished', False)
+        iobj._consumed = list(consumed)
+        return iobj
+
+    def _resume_at(self, position):
+        """
+        The sources resume on their own, only the counters are restored
+        :param position:
+        :return:
+        """
+        super(MergedInputObject, self)._resume_at(position)
+        self.data_read = position
+
+    def short_desc(self):
+        return 'MergedInputObject(data_read=%r, cur=%s)' % (self.data_read, self.iobjs[self.cur_iobj].short_desc())
+
+    def flush(self):
+        self.iobjs[self.cur_iobj].flush()
+
+
+class GzipInputObject(InputObject):
+    """
+    Input object for reading another input object in gzip form.
+    block_size sets the size of compressed blocks read from the underlying input object.
+
+    Seekable mode: with build_index the random access GzipIndex is built during
+    the first sequential pass and stored to the index_fname sidecar on exit
+    (defaults to <fname>.gzidx for file sources). An existing sidecar is loaded
+    and seek() then jumps to the nearest checkpoint instead of decompressing
+    the stream from the start. Requires a seekable underlying input object.
+
+    With pipelined the compressed data is read and decompressed on background threads,
+    see DecodePipeline, at most pipeline_bytes are buffered per stage. Pipelined object is not seekable.
+
+    With parallel_workers, BGZF streams (bgzip) are decompressed member by member on a pool of
+    worker threads, at most max_inflight_bytes are held in the members being processed.
+    Other streams are decompressed sequentially, also concatenated members.
+    """
+    metrics_kind = KIND_DECODE
+
+    def __init__(self, iobj, block_size=None, index=None, index_fname=None, build_index=False,
+                 index_spacing=INDEX_SPACING, pipelined=False, pipeline_bytes=PREFETCH_MAX_BYTES,
+                 parallel_workers=None, max_inflight_bytes=PARALLEL_MAX_INFLIGHT, *args, **kwargs):
+        super(GzipInputObject, self).__init__(*args, **kwargs)
+        self.iobj = iobj
+        self.block_size = block_size
+        self.gzip_fh = None
+        self.pipelined = pipelined
+        self.pipeline_bytes = pipeline_bytes
+        self.pipeline = None
+        self.parallel_workers = parallel_workers
+        self.max_inflight_bytes = max_inflight_bytes
+        self._source = iobj  # compressed data source
+
+        self.index = index
+        self.index_fname = index_fname
+        self.build_index = build_index
+        self.index_spacing = index_spacing
+        self._index_building = False
+
+    def __enter__(self):
+        super(GzipInputObject, self).__enter__()
+        try:
+            self.iobj.__enter__()
+            self._load_index()
+            if self.parallel_workers:
+                self._source = PeekReader(self.iobj)
+                self.pipeline = new_parallel_decoder(self._source, workers=self.parallel_workers,
+                                                     max_inflight=self.max_inflight_bytes, name='gzip-%s' % self.iobj)
+            if self.pipeline is not None:
+                self.pipeline.start()
+                self.data_read = skip_bytes(self.pipeline.read, self._resume_offset or 0)
+                return self
+
+            self.gzip_fh = self._new_stream()
+            if self._resume_offset:
+                self._seek(self._resume_offset)
+            if self.pipelined:
+                self.pipeline = DecodePipeline(self._source.read, self.gzip_fh, block_size=self.gzip_fh.block_size,
+                                               max_bytes=self.pipeline_bytes, name='gzip-%s' % self.iobj).start()
+            return self
+        except Exception as e:
+            logger.debug('Exception when entering to the parent fh %s' % e)
+            logger.debug(traceback.format_exc())
+            if self._resume_offset is not None:
+                raise
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        super(GzipInputObject, self).__exit__(exc_type, exc_val, exc_tb)
+        try:
+            if self.pipeline is not None:
+                self.pipeline.close()
+                self.pipeline = None
+            self.iobj.__exit__(exc_type, exc_val, exc_tb)
+            if self.gzip_fh is not None:
+                self.gzip_fh.close()
+        except Exception as e:
+            logger.debug('Exception when exiting to the parent fh %s' % e)
+            logger.debug(traceback.format_exc())
+
+        try:
+            self._save_index()
+        except Exception as e:
+            logger.warning('Exception when saving the gzip index %s: %s' % (self.index_fname, e))
+            logger.debug(traceback.format_exc())
+
+    def _load_index(self):
+        """
+        Loads the sidecar index if exists and is not older than the source, otherwise starts building a new one
+        :return:
+        """
+        if self.index_fname is None and (self.build_index or self.index is not None):
+            fname = getattr(self.iobj, 'fname', None)
+            self.index_fname = index_fname(fname) if fname is not None else None
+
+        if self.index is None and self.index_fname is not None and os.path.exists(self.index_fname):
+            fname = getattr(self.iobj, 'fname', None)
+            if fname is not None and os.path.getmtime(fname) > os.path.getmtime(self.index_fname):
+                logger.info('Gzip index %s is older than the source, rebuilding' % self.index_fname)
+            else:
+                self.index = GzipIndex.load(self.index_fname)
+
+        if self.index is None and self.build_index:
+            self.index = GzipIndex(spacing=self.index_spacing)
+
+        self._index_building = self.index is not None and not self.index.complete
+
+    def _save_index(self):
+        """
+        Stores the index built during reading to the sidecar file
+        :return:
+        """
+        if not self._index_building or self.index_fname is None or not self.index.complete:
+            return
+        self.index.save(self.index_fname)
+        self._index_building = False
+        logger.debug('Gzip index stored to %s: %s' % (self.index_fname, self.index))
+
+    def _new_stream(self, checkpoint=None):
+        """
+        Creates the gzip stream, optionally starting at the checkpoint
+        :param checkpoint:
+        :return:
+        """
+        return GzipInputStream(fileobj=self._source, block_size=self.block_size,
+                               index=self.index if self._index_building else None, checkpoint=checkpoint)
+
+    def __repr__(self):
+        return 'GzipInputObject(iobj=%r)' % (self.iobj)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def check(self):
+        return self.iobj.check()
+
+    def size(self):
+        return -1
+
+    def read(self, size=None):
+        if self.pipeline is not None:
+            data = self.pipeline.read(size)
+            if data:
+                self._account(data)
+            return data
+
+        data = self.gzip_fh.read(size)
+        self._account(data)
+        return data
+
+    def readinto(self, b):
+        if self.pipeline is not None:
+            return super(GzipInputObject, self).readinto(b)
+
+        n = self.gzip_fh.readinto(b)
+        self._account(memoryview(b)[:n])
+        return n
+
+    def seekable(self):
+        return not self.pipelined and not self.parallel_workers and (self.index is not None or self.iobj.seekable())
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset, whence = self.gzip_fh.tell() + offset, 0
+        return super(GzipInputObject, self).seek(offset, whence)
+
+    def tell(self):
+        if self.pipeline is not None:
+            return self.data_read - len(self._buffer)
+        if self.gzip_fh is None:
+            return self.data_read
+        return self.gzip_fh.tell()
+
+    def _seek(self, position):
+        """
+        Skips forward in the current stream if no closer checkpoint exists,
+        otherwise restarts the decompression at the checkpoint.
+        :param position:
+        :return:
+        """
+        current = self.gzip_fh.tell()
+        checkpoint = self.index.find(position) if self.index is not None else None
+        if position < current or (checkpoint is not None and checkpoint.uncomp_offset > current):
+            checkpoint = checkpoint or GzipCheckpoint(0, 0, None)
+            logger.debug('Gzip seek to %s from checkpoint %s:%s'
+                         % (position, checkpoint.comp_offset, checkpoint.uncomp_offset))
+            self.iobj.seek(checkpoint.comp_offset)
+            self._source = self.iobj
+            self.gzip_fh.close()
+            self.gzip_fh = self._new_stream(checkpoint)
+
+        self.gzip_fh.seek(position)
+        self.data_read = self.gzip_fh.tell()
+
+    def handle(self):
+        return None
+
+    def children(self):
+        return [self.iobj]
+
+    def to_state(self):
+        js = super(GzipInputObject, self).to_state()
+        js['type'] = 'GzipInputObject'
+        js['block_size'] = self.block_size
+        js['pipelined'] = self.pipelined
+        js['parallel_workers'] = self.parallel_workers
+        js['index_fname'] = self.index_fname
+        js['index'] = self.index.to_state() if self.index is not None else None
+        js['iobj'] = self.iobj.to_state()
+        return js
+
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        # the compressed stream is decompressed again from the start or the nearest index checkpoint
+        return cls(build(js['iobj'], 0), block_size=js.get('block_size'), index_fname=js.get('index_fname'),
+                   pipelined=js.get('pipelined', False), parallel_workers=js.get('parallel_workers'),
+                   digest=js.get('digest', DEFAULT_DIGEST))
+
+    def short_desc(self):
+        return 'GzipInputObject(data_read=%r, iobj=%s)' % (self.data_read, self.iobj.short_desc())
 
     def flush(self):
         self.iobj.flush()
@@ -951,13 +2632,997 @@ class GzipInputObject(InputObject):
         Read a single line
         :return: 
         """
-        return self.gzip_fh.readline()
+        if self.pipeline is not None:
+            return super(GzipInputObject, self).readline()
 
-    def readlines(self):
+        line = self.gzip_fh.readline()
+        self._account(line)
+        return line
+
+    def iter_lines(self, batch=None, keepends=True, block_size=LINES_BLOCK_SIZE):
         """
-        Return all lines as an array
-        :return: 
+        Yields lists of lines, each decompressed block is split at once
+        :param batch:
+        :param keepends:
+        :param block_size: read block size of the pipeline
+        :return:
         """
-        return self.gzip_fh.readlines()
+        if self.pipeline is not None:
+            return super(GzipInputObject, self).iter_lines(batch=batch, keepends=keepends, block_size=block_size)
+        return self.gzip_fh.iter_lines(batch=batch, keepends=keepends, account=self._account)
+
 
+class Lz4InputObject(InputObject):
+    """
+    Input object for reading another input object in LZ4 frame form, concatenated frames supported.
+    block_size sets the size of compressed blocks read from the underlying input object,
+    max_chunk_size bounds the output of a single decompression step.
+
+    comp_offset() and tell() report the compressed and uncompressed positions,
+    the state records the start of the current frame so from_state() resumes
+    decompressing from the frame start instead of the stream start.
+
+    With pipelined the compressed data is read and decompressed on background threads,
+    see DecodePipeline, at most pipeline_bytes are buffered per stage.
+
+    With parallel_workers, frames with independent blocks are decompressed block by block on a pool
+    of worker threads, at most max_inflight_bytes are held in the blocks being processed.
+    Frames with linked blocks are decompressed sequentially.
+    """
+    metrics_kind = KIND_DECODE
+
+    def __init__(self, iobj, block_size=None, max_chunk_size=None, pipelined=False,
+                 pipeline_bytes=PREFETCH_MAX_BYTES, parallel_workers=None, max_inflight_bytes=PARALLEL_MAX_INFLIGHT,
+                 *args, **kwargs):
+        super(Lz4InputObject, self).__init__(*args, **kwargs)
+        self.iobj = iobj
+        self.block_size = block_size
+        self.max_chunk_size = max_chunk_size
+        self.lz4_fh = None
+        self.pipelined = pipelined
+        self.pipeline_bytes = pipeline_bytes
+        self.pipeline = None
+        self.parallel_workers = parallel_workers
+        self.max_inflight_bytes = max_inflight_bytes
+        self._resume_frame = (0, 0)  # (compressed, uncompressed) offset of the frame to resume from
+
+    def __enter__(self):
+        super(Lz4InputObject, self).__enter__()
+        try:
+            self.iobj.__enter__()
+            source = self.iobj
+            if self.parallel_workers:
+                source = PeekReader(self.iobj)
+                self.pipeline = new_parallel_decoder(source, workers=self.parallel_workers,
+                                                     max_inflight=self.max_inflight_bytes, name='lz4-%s' % self.iobj)
+            if self.pipeline is not None:
+                self.pipeline.start()
+                skipped = skip_bytes(self.pipeline.read, (self._resume_offset or 0) - self._resume_frame[1])
+                self.data_read = self._resume_frame[1] + skipped
+                return self
+
+            self.lz4_fh = Lz4InputStream(fileobj=source, block_size=self.block_size,
+                                         max_chunk_size=self.max_chunk_size,
+                                         comp_offset=self._resume_frame[0], uncomp_offset=self._resume_frame[1])
+            if self._resume_offset:
+                self.lz4_fh.seek(self._resume_offset)
+                self.data_read = self.lz4_fh.tell()
+            if self.pipelined:
+                self.pipeline = DecodePipeline(source.read, self.lz4_fh, block_size=self.lz4_fh.block_size,
+                                               max_bytes=self.pipeline_bytes, name='lz4-%s' % self.iobj).start()
+            return self
+        except Exception as e:
+            logger.debug('Exception when entering to the parent fh %s' % e)
+            logger.debug(traceback.format_exc())
+            if self._resume_offset is not None:
+                raise
 
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        super(Lz4InputObject, self).__exit__(exc_type, exc_val, exc_tb)
+        try:
+            if self.pipeline is not None:
+                self.pipeline.close()
+                self.pipeline = None
+            self.iobj.__exit__(exc_type, exc_val, exc_tb)
+            if self.lz4_fh is not None:
+                self.lz4_fh.close()
+        except Exception as e:
+            logger.debug('Exception when exiting to the parent fh %s' % e)
+            logger.debug(traceback.format_exc())
+
+    def __repr__(self):
+        return 'Lz4InputObject(iobj=%r)' % (self.iobj)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def check(self):
+        return self.iobj.check()
+
+    def size(self):
+        return -1
+
+    def read(self, size=None):
+        if self.pipeline is not None:
+            data = self.pipeline.read(size)
+            if data:
+                self._account(data)
+            return data
+
+        data = self.lz4_fh.read(size)
+        self._account(data)
+        return data
+
+    def readinto(self, b):
+        if self.pipeline is not None:
+            return super(Lz4InputObject, self).readinto(b)
+
+        n = self.lz4_fh.readinto(b)
+        self._account(memoryview(b)[:n])
+        return n
+
+    def readline(self):
+        """
+        Read a single line
+        :return:
+        """
+        if self.pipeline is not None:
+            return super(Lz4InputObject, self).readline()
+
+        line = self.lz4_fh.readline()
+        self._account(line)
+        return line
+
+    def iter_lines(self, batch=None, keepends=True, block_size=LINES_BLOCK_SIZE):
+        """
+        Yields lists of lines, each decompressed block is split at once
+        :param batch:
+        :param keepends:
+        :param block_size: read block size of the pipeline
+        :return:
+        """
+        if self.pipeline is not None:
+            return super(Lz4InputObject, self).iter_lines(batch=batch, keepends=keepends, block_size=block_size)
+        return self.lz4_fh.iter_lines(batch=batch, keepends=keepends, account=self._account)
+
+    def comp_offset(self):
+        """
+        Position in the compressed stream, compressed bytes decompressed so far
+        :return:
+        """
+        if self.lz4_fh is None:
+            return self._resume_frame[0]
+        return self.lz4_fh.comp_offset
+
+    def tell(self):
+        if self.pipeline is not None:
+            return self.data_read - len(self._buffer)
+        if self.lz4_fh is None:
+            return self.data_read
+        return self.lz4_fh.tell()
+
+    def handle(self):
+        return None
+
+    def children(self):
+        return [self.iobj]
+
+    def to_state(self):
+        js = super(Lz4InputObject, self).to_state()
+        js['type'] = 'Lz4InputObject'
+        js['block_size'] = self.block_size
+        js['max_chunk_size'] = self.max_chunk_size
+        js['pipelined'] = self.pipelined
+        js['parallel_workers'] = self.parallel_workers
+        js['comp_offset'] = self.comp_offset()
+        frame = self._resume_frame
+        if self.lz4_fh is not None:
+            js['frames'] = self.lz4_fh.frames
+            frame = (self.lz4_fh.frame_comp_offset, self.lz4_fh.frame_uncomp_offset)
+
+        # pipelined decompression may be already in a frame past the consumer position
+        if frame[1] > self.tell():
+            frame = (0, 0)
+        js['frame_comp_offset'], js['frame_uncomp_offset'] = frame
+        js['iobj'] = self.iobj.to_state()
+        return js
+
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        # decompression restarts at the start of the frame being read
+        frame = (js.get('frame_comp_offset', 0), js.get('frame_uncomp_offset', 0))
+        iobj = cls(build(js['iobj'], frame[0]), block_size=js.get('block_size'),
+                   max_chunk_size=js.get('max_chunk_size'), pipelined=js.get('pipelined', False),
+                   parallel_workers=js.get('parallel_workers'), digest=js.get('digest', DEFAULT_DIGEST))
+        iobj._resume_frame = frame
+        return iobj
+
+    def short_desc(self):
+        return 'Lz4InputObject(data_read=%r, comp_offset=%r, iobj=%s)' \
+               % (self.data_read, self.comp_offset(), self.iobj.short_desc())
+
+    def flush(self):
+        self.iobj.flush()
+
+
+class DecompressInputObject(InputObject):
+    """
+    Input object for reading another input object compressed by a framed codec - zstd, bz2 or xz,
+    see codec.decompressor_factory(). Concatenated frames / streams are supported.
+    block_size sets the size of compressed blocks read from the underlying input object,
+    max_chunk_size bounds the output of a single decompression step if the decompressor allows it.
+
+    As with Lz4InputObject, the state records the start of the current frame,
+    pipelined decompresses on background threads, see DecodePipeline.
+    """
+    metrics_kind = KIND_DECODE
+
+    def __init__(self, iobj, codec, block_size=None, max_chunk_size=None, pipelined=False,
+                 pipeline_bytes=PREFETCH_MAX_BYTES, *args, **kwargs):
+        super(DecompressInputObject, self).__init__(*args, **kwargs)
+        self.iobj = iobj
+        self.codec = codec
+        self.block_size = block_size
+        self.max_chunk_size = max_chunk_size
+        self.dec_fh = None
+        self.pipelined = pipelined
+        self.pipeline_bytes = pipeline_bytes
+        self.pipeline = None
+        self._new_decompressor = decompressor_factory(codec)
+        self._resume_frame = (0, 0)  # (compressed, uncompressed) offset of the frame to resume from
+
+    def __enter__(self):
+        super(DecompressInputObject, self).__enter__()
+        try:
+            self.iobj.__enter__()
+            self.dec_fh = FramedInputStream(fileobj=self.iobj, new_decompressor=self._new_decompressor,
+                                            block_size=self.block_size, max_chunk_size=self.max_chunk_size,
+                                            comp_offset=self._resume_frame[0], uncomp_offset=self._resume_frame[1])
+            if self._resume_offset:
+                self.dec_fh.seek(self._resume_offset)
+                self.data_read = self.dec_fh.tell()
+            if self.pipelined:
+                self.pipeline = DecodePipeline(self.iobj.read, self.dec_fh, block_size=self.dec_fh.block_size,
+                                               max_bytes=self.pipeline_bytes,
+                                               name='%s-%s' % (self.codec, self.iobj)).start()
+            return self
+        except Exception as e:
+            logger.debug('Exception when entering to the parent fh %s' % e)
+            logger.debug(traceback.format_exc())
+            if self._resume_offset is not None:
+                raise
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        super(DecompressInputObject, self).__exit__(exc_type, exc_val, exc_tb)
+        try:
+            if self.pipeline is not None:
+                self.pipeline.close()
+                self.pipeline = None
+            self.iobj.__exit__(exc_type, exc_val, exc_tb)
+            if self.dec_fh is not None:
+                self.dec_fh.close()
+        except Exception as e:
+            logger.debug('Exception when exiting to the parent fh %s' % e)
+            logger.debug(traceback.format_exc())
+
+    def __repr__(self):
+        return 'DecompressInputObject(codec=%r, iobj=%r)' % (self.codec, self.iobj)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def check(self):
+        return self.iobj.check()
+
+    def size(self):
+        return -1
+
+    def read(self, size=None):
+        if self.pipeline is not None:
+            data = self.pipeline.read(size)
+            if data:
+                self._account(data)
+            return data
+
+        data = self.dec_fh.read(size)
+        self._account(data)
+        return data
+
+    def readinto(self, b):
+        if self.pipeline is not None:
+            return super(DecompressInputObject, self).readinto(b)
+
+        n = self.dec_fh.readinto(b)
+        self._account(memoryview(b)[:n])
+        return n
+
+    def readline(self):
+        """
+        Read a single line
+        :return:
+        """
+        if self.pipeline is not None:
+            return super(DecompressInputObject, self).readline()
+
+        line = self.dec_fh.readline()
+        self._account(line)
+        return line
+
+    def iter_lines(self, batch=None, keepends=True, block_size=LINES_BLOCK_SIZE):
+        """
+        Yields lists of lines, each decompressed block is split at once
+        :param batch:
+        :param keepends:
+        :param block_size: read block size of the pipeline
+        :return:
+        """
+        if self.pipeline is not None:
+            return super(DecompressInputObject, self).iter_lines(batch=batch, keepends=keepends, block_size=block_size)
+        return self.dec_fh.iter_lines(batch=batch, keepends=keepends, account=self._account)
+
+    def comp_offset(self):
+        """
+        Position in the compressed stream, compressed bytes decompressed so far
+        :return:
+        """
+        if self.dec_fh is None:
+            return self._resume_frame[0]
+        return self.dec_fh.comp_offset
+
+    def tell(self):
+        if self.pipeline is not None:
+            return self.data_read - len(self._buffer)
+        if self.dec_fh is None:
+            return self.data_read
+        return self.dec_fh.tell()
+
+    def handle(self):
+        return None
+
+    def children(self):
+        return [self.iobj]
+
+    def to_state(self):
+        js = super(DecompressInputObject, self).to_state()
+        js['type'] = 'DecompressInputObject'
+        js['codec'] = self.codec
+        js['block_size'] = self.block_size
+        js['max_chunk_size'] = self.max_chunk_size
+        js['pipelined'] = self.pipelined
+        js['comp_offset'] = self.comp_offset()
+        frame = self._resume_frame
+        if self.dec_fh is not None:
+            js['frames'] = self.dec_fh.frames
+            frame = (self.dec_fh.frame_comp_offset, self.dec_fh.frame_uncomp_offset)
+
+        # pipelined decompression may be already in a frame past the consumer position
+        if frame[1] > self.tell():
+            frame = (0, 0)
+        js['frame_comp_offset'], js['frame_uncomp_offset'] = frame
+        js['iobj'] = self.iobj.to_state()
+        return js
+
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        frame = (js.get('frame_comp_offset', 0), js.get('frame_uncomp_offset', 0))
+        iobj = cls(build(js['iobj'], frame[0]), js['codec'], block_size=js.get('block_size'),
+                   max_chunk_size=js.get('max_chunk_size'), pipelined=js.get('pipelined', False),
+                   digest=js.get('digest', DEFAULT_DIGEST))
+        iobj._resume_frame = frame
+        return iobj
+
+    def short_desc(self):
+        return 'DecompressInputObject(codec=%r, data_read=%r, comp_offset=%r, iobj=%s)' \
+               % (self.codec, self.data_read, self.comp_offset(), self.iobj.short_desc())
+
+    def flush(self):
+        self.iobj.flush()
+
+
+class PeekInputObject(InputObject):
+    """
+    Transparent wrapper which allows looking at the beginning of the input object without consuming it.
+    Entering is idempotent so the wrapped object can be entered early for peek() and again by the reader.
+    Not part of the state, to_state() returns the wrapped object state at the position of this one.
+    """
+    def __init__(self, iobj, *args, **kwargs):
+        super(PeekInputObject, self).__init__(digest=NO_DIGEST, *args, **kwargs)
+        self.iobj = iobj
+        self._head = b''
+        self._entered = False
+
+    def __enter__(self):
+        if not self._entered:
+            self.iobj.__enter__()
+            self._entered = True
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._entered:
+            self._entered = False
+            self.iobj.__exit__(exc_type, exc_val, exc_tb)
+
+    def __repr__(self):
+        return 'PeekInputObject(iobj=%r)' % self.iobj
+
+    def __str__(self):
+        return str(self.iobj)
+
+    @property
+    def fname(self):
+        return getattr(self.iobj, 'fname', None)
+
+    def peek(self, size):
+        """
+        Returns up to size bytes from the current position, the data is read again by read()
+        :param size:
+        :return:
+        """
+        while len(self._head) < size:
+            data = self.iobj.read(size - len(self._head))
+            if not data:
+                break
+            self._head += data
+        return self._head[:size]
+
+    def check(self):
+        return self.iobj.check()
+
+    def size(self):
+        return self.iobj.size()
+
+    def read(self, size=None):
+        if not self._head:
+            data = self.iobj.read(size)
+        elif size is None or size < 0 or size > len(self._head):
+            rest = None if size is None or size < 0 else size - len(self._head)
+            data, self._head = self._head + (self.iobj.read(rest) or b''), b''
+        else:
+            data, self._head = self._head[:size], self._head[size:]
+
+        if data:
+            self._account(data)
+        return data
+
+    def seekable(self):
+        return self.iobj.seekable()
+
+    def _seek(self, position):
+        self._head = b''
+        self.iobj.seek(position)
+        self.data_read = position
+
+    def handle(self):
+        return self.iobj.handle()
+
+    def children(self):
+        return [self.iobj]
+
+    def to_state(self):
+        js = self.iobj.to_state()
+        js['data_read'] = self.data_read
+        return js
+
+    def short_desc(self):
+        return self.iobj.short_desc()
+
+    def flush(self):
+        self.iobj.flush()
+
+
+class CodecInputObject(InputObject):
+    """
+    Decompresses the input object by the codec detected from the magic bytes at the stream start
+    (gzip, LZ4 frame, zstd, bz2, xz), uncompressed data is passed through.
+    The sniffed bytes are not lost, the decoder reads them again.
+
+    The decoder is the fastest one available for the codec: with parallel_workers gzip and LZ4
+    are decompressed in parallel if the stream allows it (BGZF, independent LZ4 blocks),
+    with pipelined the decompression runs on background threads.
+    Other keyword arguments in decoder_kwargs are passed to the decoder object.
+
+    The digest is computed here, over the decompressed data. Once entered, to_state()
+    returns the state of the decoder stack, so from_state() rebuilds it without detection.
+    """
+    metrics_kind = KIND_DECODE
+
+    def __init__(self, iobj, codec=CODEC_AUTO, parallel_workers=None, pipelined=False, decoder_kwargs=None,
+                 *args, **kwargs):
+        super(CodecInputObject, self).__init__(*args, **kwargs)
+        self.iobj = iobj
+        self.codec = codec
+        self.parallel_workers = parallel_workers
+        self.pipelined = pipelined
+        self.decoder_kwargs = decoder_kwargs or {}
+        self.decoder = None
+        self._peek = PeekInputObject(iobj)
+
+    def __enter__(self):
+        super(CodecInputObject, self).__enter__()
+        self._peek.__enter__()
+        if self.codec == CODEC_AUTO:
+            self.codec = detect_codec(self._peek.peek(MAGIC_SIZE))
+            logger.debug('Detected codec %s of %s' % (self.codec, self.iobj))
+
+        self.decoder = self._new_decoder()
+        if self._resume_offset and self.decoder is not self._peek:
+            self.decoder._resume_at(self._resume_offset)
+        self.decoder.__enter__()
+        if self._resume_offset and self.decoder is self._peek:
+            if self._peek.seekable():
+                self._peek.seek(self._resume_offset)
+            else:
+                skip_bytes(self._peek.read, self._resume_offset)
+        self.data_read = self.decoder.tell()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        super(CodecInputObject, self).__exit__(exc_type, exc_val, exc_tb)
+        if self.decoder is not None:
+            self.decoder.__exit__(exc_type, exc_val, exc_tb)
+        else:
+            self._peek.__exit__(exc_type, exc_val, exc_tb)
+
+    def _new_decoder(self):
+        """
+        Creates the decoder input object for the codec, reading from the peek wrapper
+        :return:
+        """
+        kwargs = dict(self.decoder_kwargs)
+        kwargs['digest'] = NO_DIGEST
+        if self.codec == CODEC_NONE:
+            return self._peek
+        if self.codec == CODEC_GZIP:
+            return GzipInputObject(self._peek, parallel_workers=self.parallel_workers, pipelined=self.pipelined,
+                                   **kwargs)
+        if self.codec == CODEC_LZ4:
+            return Lz4InputObject(self._peek, parallel_workers=self.parallel_workers, pipelined=self.pipelined,
+                                  **kwargs)
+        return DecompressInputObject(self._peek, self.codec, pipelined=self.pipelined, **kwargs)
+
+    def __repr__(self):
+        return 'CodecInputObject(codec=%r, iobj=%r)' % (self.codec, self.iobj)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def check(self):
+        return self.iobj.check()
+
+    def size(self):
+        return self.iobj.size() if self.codec == CODEC_NONE else -1
+
+    def read(self, size=None):
+        data = self.decoder.read(size)
+        self._account(data)
+        return data
+
+    def readinto(self, b):
+        n = self.decoder.readinto(b)
+        self._account(memoryview(b)[:n])
+        return n
+
+    def readline(self):
+        """
+        Read a single line
+        :return:
+        """
+        line = self.decoder.readline()
+        self._account(line)
+        return line
+
+    def seekable(self):
+        return self.decoder is not None and self.decoder.seekable()
+
+    def _seek(self, position):
+        self.decoder.seek(position)
+        self.data_read = position
+
+    def tell(self):
+        if self.decoder is None:
+            return self.data_read
+        return self.decoder.tell()
+
+    def handle(self):
+        return None
+
+    def children(self):
+        return [self.iobj]
+
+    def to_state(self):
+        if self.decoder is None:
+            js = super(CodecInputObject, self).to_state()
+            js['type'] = 'CodecInputObject'
+            js['codec'] = self.codec
+            js['parallel_workers'] = self.parallel_workers
+            js['pipelined'] = self.pipelined
+            js['iobj'] = self.iobj.to_state()
+            return js
+
+        # the detected decoder stack, digest of this object
+        js = self.decoder.to_state()
+        decoder_type = js['type']
+        js.update(super(CodecInputObject, self).to_state())
+        js['type'] = decoder_type
+        return js
+
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        return cls(build(js['iobj'], 0), codec=js.get('codec', CODEC_AUTO),
+                   parallel_workers=js.get('parallel_workers'), pipelined=js.get('pipelined', False),
+                   digest=js.get('digest', DEFAULT_DIGEST))
+
+    def short_desc(self):
+        if self.decoder is None:
+            return 'CodecInputObject(codec=%r, iobj=%s)' % (self.codec, self.iobj.short_desc())
+        return 'CodecInputObject(codec=%r, data_read=%r, decoder=%s)' \
+               % (self.codec, self.data_read, self.decoder.short_desc())
+
+    def flush(self):
+        self.iobj.flush()
+
+
+class ShardInputObject(InputObject):
+    """
+    Line aligned byte range [start, end) of another input object, see shard_input().
+    The shard contains the lines starting in the range - the line crossing start belongs to the previous
+    shard, the line crossing end is read to its end. The wrapped object is not entered yet, it is entered
+    positioned at start - 1 (files seek, links request the range) using the resume support, see from_state().
+    """
+    def __init__(self, iobj, start, end, block_size=65536, *args, **kwargs):
+        super(ShardInputObject, self).__init__(*args, **kwargs)
+        self.iobj = iobj
+        self.start = start
+        self.end = end
+        self.block_size = block_size
+        self.line_start = None  # offset of the first line of the shard
+        self._pos = None  # offset of the next byte in the wrapped object
+        self._pending = b''  # read after the first line start
+        self._tail = False  # reading the line crossing end
+        self._finished = False
+
+    def __enter__(self):
+        super(ShardInputObject, self).__enter__()
+        if self.line_start is not None:
+            position = self.line_start + (self._resume_offset or 0)
+        else:
+            position = max(self.start - 1, 0)
+
+        if position:
+            self.iobj._resume_at(position)
+        self.iobj.__enter__()
+        self._pos = position
+        if self.line_start is None:
+            self._snap()
+        else:
+            self._tail = self._tail or (not self._finished and position >= self.end)
+        if self._resume_offset:
+            self.data_read = self._resume_offset
+        return self
+
+    def _snap(self):
+        """
+        Skips the line crossing start, the rest of the read data stays pending
+        :return:
+        """
+        if self.start == 0:
+            self.line_start = 0
+            return
+
+        while True:
+            data = self.iobj.read(self.block_size)
+            if not data:
+                self.line_start = self._pos
+                break
+            idx = data.find(b'\n')
+            if idx >= 0:
+                self._pos += idx + 1
+                self._pending = data[idx + 1:]
+                self.line_start = self._pos
+                break
+            self._pos += len(data)
+
+        self._finished = self.line_start >= self.end
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        super(ShardInputObject, self).__exit__(exc_type, exc_val, exc_tb)
+        self.iobj.__exit__(exc_type, exc_val, exc_tb)
+
+    def __repr__(self):
+        return 'ShardInputObject(start=%r, end=%r, iobj=%r)' % (self.start, self.end, self.iobj)
+
+    def __str__(self):
+        return '%s[%s:%s]' % (self.iobj, self.start, self.end)
+
+    def check(self):
+        return self.iobj.check()
+
+    def size(self):
+        return -1
+
+    def _read_source(self, size):
+        if self._pending:
+            data, self._pending = self._pending[:size], self._pending[size:]
+            return data
+        return self.iobj.read(size)
+
+    def read(self, size=None):
+        if size is None or size < 0:
+            chunks = []
+            while not self._finished:
+                chunks.append(self._read_part(None))
+            return b''.join(chunks)
+        return self._read_part(size)
+
+    def _read_part(self, size):
+        """
+        Reads up to size bytes, stops at the range end and at the end of the line crossing it
+        :param size: None = to the range end / to the line end
+        :return:
+        """
+        if self._finished:
+            return b''
+
+        if not self._tail and self._pos >= self.end:
+            self._tail = True
+        if not self._tail:
+            remaining = self.end - self._pos
+            data = self._read_source(remaining if size is None else min(size, remaining))
+            self._pos += len(data)
+            if not data or (self._pos >= self.end and data[-1:] == b'\n'):
+                self._finished = True
+            elif self._pos >= self.end:
+                self._tail = True
+        else:
+            data = self._read_source(self.block_size if size is None else size)
+            idx = data.find(b'\n')
+            if idx >= 0:
+                data = data[:idx + 1]
+            self._pos += len(data)
+            self._finished = not data or idx >= 0
+
+        self._account(data)
+        return data
+
+    def handle(self):
+        return None
+
+    def children(self):
+        return [self.iobj]
+
+    def to_state(self):
+        js = super(ShardInputObject, self).to_state()
+        js['type'] = 'ShardInputObject'
+        js['start'] = self.start
+        js['end'] = self.end
+        js['line_start'] = self.line_start
+        js['tail'] = self._tail
+        js['finished'] = self._finished
+        js['iobj'] = self.iobj.to_state()
+        return js
+
+    @classmethod
+    def _from_state(cls, js, build, session=None):
+        # the wrapped object is positioned on enter
+        iobj = cls(build(js['iobj'], 0), js['start'], js['end'], digest=js.get('digest', DEFAULT_DIGEST))
+        iobj.line_start = js.get('line_start')
+        iobj._tail = js.get('tail', False)
+        iobj._finished = js.get('finished', False)
+        return iobj
+
+    def short_desc(self):
+        return 'ShardInputObject(data_read=%r, start=%r, end=%r, iobj=%s)' \
+               % (self.data_read, self.start, self.end, self.iobj.short_desc())
+
+    def flush(self):
+        self.iobj.flush()
+
+
+STATE_TYPES = {
+    'FileInputObject': FileInputObject,
+    'LinkInputObject': LinkInputObject,
+    'ReconnectingLinkInputObject': ReconnectingLinkInputObject,
+    'TeeInputObject': TeeInputObject,
+    'CachedInputObject': CachedInputObject,
+    'PrefetchInputObject': PrefetchInputObject,
+    'MergedInputObject': MergedInputObject,
+    'GzipInputObject': GzipInputObject,
+    'Lz4InputObject': Lz4InputObject,
+    'DecompressInputObject': DecompressInputObject,
+    'CodecInputObject': CodecInputObject,
+    'ShardInputObject': ShardInputObject,
+}
+"""Input object classes rebuilt by from_state(), by the to_state() type"""
+
+
+def from_state(js, factory=None, session=None, position=None):
+    """
+    Rebuilds the input object stack from the to_state() dictionary, e.g., after a crash.
+    The stack is returned not entered, entering it continues reading at the recorded position:
+    files seek, links request the rest with the Range header, merged objects continue
+    with the recorded source, gzip decompresses again from the nearest index checkpoint.
+    Digests start at the resume position, recorded as digest_offset in the state.
+
+    :param js: state dictionary
+    :param factory: optional callable(js) returning the input object for the state or None,
+                    required e.g. for FileLikeInputObject which cannot be rebuilt automatically
+    :param session: shared session for the link objects
+    :param position: resume position, overrides the recorded data_read
+    :return:
+    """
+    def build(sub_js, sub_position):
+        return from_state(sub_js, factory=factory, session=session, position=sub_position)
+
+    iobj = factory(js) if factory is not None else None
+    if iobj is None:
+        cls = STATE_TYPES.get(js['type'])
+        if cls is None:
+            raise ValueError('Input object %s cannot be rebuilt from the state, use factory' % js['type'])
+        iobj = cls._from_state(js, build, session=session)
+
+    iobj._resume_at(js.get('data_read', 0) if position is None else position)
+    return iobj
+
+
+def save_state(iobj, fname):
+    """
+    Stores the input object state to the JSON checkpoint file, atomically
+    :param iobj:
+    :param fname:
+    :return:
+    """
+    fname_tmp = '%s.%s.tmp' % (fname, os.getpid())
+    with open(fname_tmp, 'w') as fh:
+        json.dump(iobj.to_state(), fh)
+    os.rename(fname_tmp, fname)
+
+
+def load_state(fname, factory=None, session=None):
+    """
+    Rebuilds the input object stack from the JSON checkpoint file stored by save_state()
+    :param fname:
+    :param factory:
+    :param session:
+    :return:
+    """
+    with open(fname) as fh:
+        return from_state(json.load(fh, object_pairs_hook=collections.OrderedDict), factory=factory,
+                          session=session)
+
+
+def open_input(location, codec=CODEC_AUTO, use_mmap=True, parallel_workers=None, pipelined=False,
+               session=None, decoder_kwargs=None, cache=None, **kwargs):
+    """
+    Builds the input object stack for the path or URL, not entered.
+    http(s) URLs are read by ReconnectingLinkInputObject, cached locally with the cache, paths and file:// URLs
+    by FileInputObject, memory mapped unless use_mmap is False.
+    The compression is detected on enter, see CodecInputObject.
+
+    :param location: path or URL
+    :param codec: CODEC_AUTO detects the codec, CODEC_NONE reads the source as is
+    :param use_mmap: memory map files
+    :param parallel_workers: parallel decompression of BGZF / independent LZ4 blocks, see CodecInputObject
+    :param pipelined: decompression on background threads
+    :param session: shared ConnectionPool or requests.Session for URLs
+    :param decoder_kwargs: passed to the decoder input object
+    :param cache: ContentCache for URLs
+    :param kwargs: passed to ReconnectingLinkInputObject, e.g., timeout, max_reconnects, parallel_connections
+    :return:
+    """
+    scheme = urlparse(location).scheme.lower()
+    if scheme in ('http', 'https'):
+        source = ReconnectingLinkInputObject(location, session=session, **kwargs)
+        if cache is not None:
+            source = CachedInputObject(source, cache)
+    elif scheme == 'file':
+        source = FileInputObject(urlparse(location).path, use_mmap=use_mmap)
+    elif scheme and len(scheme) > 1:
+        raise ValueError('Unsupported scheme %s' % scheme)
+    else:  # local path, drive letters are parsed as schemes
+        source = FileInputObject(location, use_mmap=use_mmap)
+
+    if codec == CODEC_NONE:
+        return source
+    return CodecInputObject(source, codec=codec, parallel_workers=parallel_workers, pipelined=pipelined,
+                            decoder_kwargs=decoder_kwargs)
+
+
+def mirror(iobj, fname, block_size=1024 * 1024):
+    """
+    Copies the rest of the entered input object to the file, atomically.
+    File sources without digest are copied in the kernel, see fastcopy, other objects are read and written.
+    :param iobj: entered input object
+    :param fname: destination file
+    :param block_size: read size when not copied in the kernel
+    :return: number of bytes copied
+    """
+    fname_tmp = '%s.%s.tmp' % (fname, os.getpid())
+    copied = None
+    with open(fname_tmp, 'wb') as fh:
+        if isinstance(iobj, FileInputObject) and iobj.digest.name == DIGEST_NONE and len(iobj._buffer) == 0:
+            try:
+                offset = iobj.tell()
+                copied = copy_file(iobj.fh, fh, offset=offset)
+                iobj.seek(offset + copied)
+            except ZeroCopyUnsupported as e:
+                logger.debug('Kernel copy of %s not possible: %s' % (iobj, e))
+
+        if copied is None:
+            copied = 0
+            while True:
+                data = iobj.read(block_size)
+                if not data:
+                    break
+                fh.write(data)
+                copied += len(data)
+
+    os.rename(fname_tmp, fname)
+    return copied
+
+
+def split_ranges(size, shards):
+    """
+    Splits [0, size) to at most shards ranges of about the same size
+    :param size:
+    :param shards:
+    :return: list of (start, end)
+    """
+    shards = max(1, min(shards, size))
+    bounds = [size * i // shards for i in range(shards + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(shards)]
+
+
+def shard_input(factory, shards, size=None):
+    """
+    Splits an uncompressed line oriented source to line aligned shards, see ShardInputObject.
+    Each shard has its own source object, the shards can be read concurrently, e.g., by process_shards().
+    :param factory: path or URL, or callable returning a new not entered input object of the source
+    :param shards: number of shards
+    :param size: source size, loaded from the file or the HEAD request if not given
+    :return: list of not entered ShardInputObject
+    """
+    if not callable(factory):
+        location = factory
+        factory = lambda: open_input(location, codec=CODEC_NONE)  # noqa: E731
+
+    if size is None:
+        probe = factory()
+        if isinstance(probe, FileInputObject):
+            size = os.path.getsize(probe.fname)
+        elif isinstance(probe, ReconnectingLinkInputObject):
+            probe._load_info()
+            size = probe.content_length
+        if size is None:
+            raise ValueError('Size of %s is not known' % probe)
+
+    return [ShardInputObject(factory(), start, end) for start, end in split_ranges(size, shards)]
+
+
+def _process_shard(args):
+    """
+    Pool worker, rebuilds the shard from the state and applies the function
+    :param args: (function, shard state)
+    :return:
+    """
+    func, js = args
+    with from_state(js) as iobj:
+        return func(iobj)
+
+
+def process_shards(shards, func, processes=None, merge=None):
+    """
+    Processes the shards by a multiprocessing pool. The shards are passed to the workers as to_state()
+    dictionaries and rebuilt there, func has to be picklable - a module level function.
+    :param shards: list of not entered input objects, e.g., from shard_input()
+    :param func: func(entered input object) returning the shard result
+    :param processes: pool size, number of CPUs by default
+    :param merge: merge(results) of the shard results in the shard order, list of the results by default
+    :return:
+    """
+    pool = multiprocessing.Pool(processes=processes)
+    try:
+        results = pool.map(_process_shard, [(func, x.to_state()) for x in shards], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return merge(results) if merge is not None else results
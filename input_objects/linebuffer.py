@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Line buffer shared by the input objects for line reading
+"""
+
+import re
+
+
+COMPACT_THRESHOLD = 1024 * 1024
+"""Minimal number of consumed bytes before the buffer gets compacted"""
+
+LINES_BLOCK_SIZE = 262144
+"""Default size of the blocks split to lines at once by the batched line iterators"""
+
+CHUNK_SIZE = 65536
+"""Default size of the chunks of the chunk iterators"""
+
+SPLIT_WINDOW_MIN = 256
+"""Initial size of the data split to lines ahead by readline()"""
+
+SPLIT_WINDOW_MAX = 65536
+"""Maximal size of the data split to lines ahead by readline()"""
+
+_LINE_RE = re.compile(b'[^\n]*\n|[^\n]+$')
+
+
+def split_lines(data, keepends=True):
+    """
+    Splits the data to lines at once, the last line may miss the newline
+    :param data: bytes
+    :param keepends: keep the newlines at the line ends
+    :return: list of lines
+    """
+    if not keepends:
+        lines = data.split(b'\n')
+        if not lines[-1]:
+            lines.pop()
+        return lines
+
+    # splitlines() is the fastest, but it also splits at CR
+    if b'\r' not in data:
+        return data.splitlines(True)
+    return _LINE_RE.findall(data)
+
+
+def iter_buffer_lines(buf, fill, consume, batch=None, keepends=True):
+    """
+    Yields lists of lines of the line buffer, each refill is split to lines at once.
+    Lines stay in the buffer until their batch is yielded, so a stopped iteration
+    loses nothing, the next readline() continues after the last yielded line.
+    :param buf: LineBuffer
+    :param fill: fill() adds more data to the buffer, returns False at the end of the stream
+    :param consume: consume(size) drops the next size bytes from the buffer, called before the batch is yielded
+    :param batch: number of lines per list, None = all lines split from the refill
+    :param keepends: keep the newlines at the line ends
+    :return:
+    """
+    pending = []  # lines split from the buffer, not yielded yet
+    idx = 0
+    split = 0  # size of the buffered data split to the pending lines
+    more = True
+    while True:
+        if more and (len(pending) - idx < (batch or 1)):
+            more = fill()
+            lines, size = buf.split_lines(split, keepends)
+            if not more and len(buf) > split + size:  # the last line without a newline
+                lines.append(buf.peek(split + size, len(buf)))
+                size = len(buf) - split
+            if lines:
+                pending = pending[idx:] + lines if idx < len(pending) else lines
+                idx = 0
+                split += size
+            continue
+
+        if idx >= len(pending):
+            return
+
+        end = len(pending) if not batch else min(len(pending), idx + batch)
+        chunk = pending[idx:end] if idx or end < len(pending) else pending
+        idx = end
+        size = sum(map(len, chunk)) if keepends else sum(map(len, chunk)) + len(chunk)
+        size = min(size, split)  # the last line may miss the newline
+        split -= size
+        consume(size)
+        yield chunk
+
+
+class LineBuffer(object):
+    """
+    Growable byte buffer with a moving read cursor.
+    Data is appended at the end and consumed from the read cursor. The newline search
+    resumes where the previous one stopped so each byte is scanned only once.
+    The consumed prefix is dropped only when it dominates the buffer, which keeps
+    the amortized cost of reading linear in the size of the stream.
+
+    readline() splits the lines of a whole window ahead at once and returns them one by one.
+    The window doubles while only lines are read, other reads drop the split lines
+    and reset it, so mixing readline() and read() does not split data in vain.
+    """
+
+    def __init__(self, compact_threshold=COMPACT_THRESHOLD):
+        self._buf = bytearray()
+        self._pos = 0  # read cursor
+        self._scan = 0  # newline search resume position, always >= _pos
+        self._lines = []  # lines split ahead, starting at the read cursor
+        self._line_idx = 0  # next line to return from _lines
+        self._window = SPLIT_WINDOW_MIN
+        self.compact_threshold = compact_threshold
+
+    def __len__(self):
+        return len(self._buf) - self._pos
+
+    def __repr__(self):
+        return 'LineBuffer(size=%r, pos=%r)' % (len(self._buf), self._pos)
+
+    def clear(self):
+        """
+        Drops all buffered data
+        :return:
+        """
+        del self._buf[:]
+        self._pos = 0
+        self._scan = 0
+        self._reset_split()
+
+    def _reset_split(self):
+        """
+        Drops the lines split ahead
+        :return:
+        """
+        if self._lines:
+            self._lines = []
+            self._line_idx = 0
+        self._window = SPLIT_WINDOW_MIN
+
+    def feed(self, data):
+        """
+        Appends data to the buffer
+        :param data:
+        :return:
+        """
+        if self._pos >= self.compact_threshold and self._pos * 2 >= len(self._buf):
+            self._compact()
+        self._buf += data
+
+    def _compact(self):
+        """
+        Drops the consumed prefix of the buffer
+        :return:
+        """
+        del self._buf[:self._pos]
+        self._scan -= self._pos
+        self._pos = 0
+
+    def find_newline(self):
+        """
+        Returns position just after the next newline in the buffer, -1 if there is no complete line.
+        :return:
+        """
+        idx = self._buf.find(b'\n', self._scan)
+        if idx < 0:
+            self._scan = len(self._buf)
+            return -1
+
+        self._scan = idx
+        return idx + 1
+
+    def readline(self):
+        """
+        Returns the next complete line including the newline, None if there is no complete line buffered.
+        :return:
+        """
+        idx = self._line_idx
+        if idx < len(self._lines):
+            line = self._lines[idx]
+            self._line_idx = idx + 1
+            self._pos += len(line)
+            self._scan = self._pos
+            return line
+
+        # split the complete lines of the next window at once
+        end = self._buf.rfind(b'\n', self._scan, self._pos + self._window) + 1
+        if end > 0:
+            self._lines = split_lines(bytes(self._buf[self._pos:end]))
+            self._line_idx = 0
+            if self._window < SPLIT_WINDOW_MAX:
+                self._window *= 2
+            return self.readline()
+
+        # no newline in the window, a long line
+        end = self.find_newline()
+        if end < 0:
+            return None
+        return self._take(end)
+
+    def split_lines(self, offset=0, keepends=True):
+        """
+        Splits the complete lines buffered after the read cursor + offset, without consuming them
+        :param offset: buffered bytes to skip, already split
+        :param keepends: keep the newlines at the line ends
+        :return: (list of lines, size of the lines in the buffer)
+        """
+        start = self._pos + offset
+        end = self._buf.rfind(b'\n', max(start, self._scan)) + 1
+        if end <= start:
+            return [], 0
+        return split_lines(bytes(self._buf[start:end]), keepends), end - start
+
+    def peek(self, start, end):
+        """
+        Returns the buffered data between the positions relative to the read cursor, without consuming it
+        :param start:
+        :param end:
+        :return:
+        """
+        return bytes(self._buf[self._pos + start:self._pos + end])
+
+    def consume(self, size, account=None):
+        """
+        Drops the next size bytes
+        :param size:
+        :param account: account(memoryview) called with the dropped data before dropping
+        :return:
+        """
+        if account is not None:
+            view = memoryview(self._buf)
+            data = view[self._pos:self._pos + size]
+            try:
+                account(data)
+            finally:
+                data.release()
+                view.release()
+        self._consume(self._pos + size)
+
+    def read(self, size=0):
+        """
+        Consumes up to size bytes from the buffer
+        :param size: number of bytes, 0 = everything buffered
+        :return:
+        """
+        if not size:
+            return self._take(len(self._buf))
+        return self._take(min(self._pos + size, len(self._buf)))
+
+    def readinto(self, b):
+        """
+        Consumes buffered data directly into the pre-allocated writable buffer b
+        :param b:
+        :return: number of bytes written
+        """
+        n = min(len(b), len(self))
+        if n == 0:
+            return 0
+
+        memoryview(b)[:n] = memoryview(self._buf)[self._pos:self._pos + n]
+        self._consume(self._pos + n)
+        return n
+
+    def _take(self, end):
+        """
+        Consumes data from the read cursor up to the given buffer position
+        :param end:
+        :return:
+        """
+        data = bytes(self._buf[self._pos:end])
+        self._consume(end)
+        return data
+
+    def _consume(self, end):
+        """
+        Moves the read cursor to the given buffer position
+        :param end:
+        :return:
+        """
+        if end >= len(self._buf):
+            self.clear()
+            return
+
+        self._reset_split()
+        self._pos = end
+        if self._scan < end:
+            self._scan = end
+
+
+class MappedLines(object):
+    """
+    Line buffer of iter_buffer_lines() over a memory mapping, lines are split directly from the mapping.
+    fill() extends the buffered part of the mapping by a block.
+    """
+
+    def __init__(self, mm, pos=0, block_size=LINES_BLOCK_SIZE):
+        self.mm = mm
+        self.pos = pos  # read cursor
+        self.end = pos  # end of the buffered part
+        self.block_size = block_size
+        self._scan = pos  # no newline between the split start and here
+
+    def __len__(self):
+        return self.end - self.pos
+
+    def __repr__(self):
+        return 'MappedLines(pos=%r, end=%r)' % (self.pos, self.end)
+
+    def fill(self):
+        """
+        Buffers the next block of the mapping
+        :return: False at the end of the mapping
+        """
+        if self.end >= len(self.mm):
+            return False
+        self.end = min(len(self.mm), self.end + self.block_size)
+        return True
+
+    def split_lines(self, offset=0, keepends=True):
+        """
+        See LineBuffer.split_lines()
+        :param offset:
+        :param keepends:
+        :return:
+        """
+        start = self.pos + offset
+        end = self.mm.rfind(b'\n', max(start, self._scan), self.end) + 1
+        if end <= start:
+            self._scan = self.end
+            return [], 0
+        return split_lines(self.mm[start:end], keepends), end - start
+
+    def peek(self, start, end):
+        return self.mm[self.pos + start:self.pos + end]
+
+    def consume(self, size):
+        self.pos += size
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Line offset index - the byte offset of every spacing-th line of a line oriented stream.
+
+Built incrementally from the data read during a sequential pass, only newline counting
+per chunk, the offsets are located just in the chunks containing an indexed line,
+all of them in one vectorized pass with NumPy.
+Persisted as a compact sidecar - a header and the offsets as a little endian uint64 array.
+"""
+
+import array
+import bisect
+import collections
+import logging
+import os
+import struct
+import sys
+
+from newlines import count_newlines, nth_newlines, has_numpy
+
+
+logger = logging.getLogger(__name__)
+
+
+LINE_INDEX_SPACING = 1024
+"""Default number of lines between the indexed lines"""
+
+LINE_INDEX_BATCH = 1024 * 1024
+"""Bytes of a memory mapped file indexed at once"""
+
+LINE_INDEX_MAGIC = b'IOLNIX01'
+LINE_INDEX_HEADER = struct.Struct('<QQQBQ')
+
+try:
+    OFFSET_TYPECODE = 'Q'
+    array.array(OFFSET_TYPECODE)
+except ValueError:  # Python 2, unsigned long is 64 bit on LP64 platforms
+    OFFSET_TYPECODE = 'L'
+
+
+def line_index_fname(fname):
+    """
+    Returns the sidecar line index file name for the given file
+    :param fname:
+    :return:
+    """
+    return '%s.lidx' % fname
+
+
+def nth_newline(data, n, start=0):
+    """
+    Returns the position of the n-th newline (1 = the first one) in data from start, -1 if there are less
+    :param data:
+    :param n:
+    :param start:
+    :return:
+    """
+    # skip whole blocks by counting, newline counting runs at memchr speed
+    lo, size, step = start, len(data), 4096
+    while n > 64 and lo < size:
+        hi = min(size, lo + step)
+        cnt = data.count(b'\n', lo, hi)
+        if cnt < n:
+            n -= cnt
+            lo = hi
+            step *= 2
+        elif step > 4096:
+            step //= 4
+        else:
+            break
+
+    pos = lo - 1
+    for _ in range(n):
+        pos = data.find(b'\n', pos + 1)
+        if pos < 0:
+            return -1
+    return pos
+
+
+class LineIndex(object):
+    """
+    Offsets of the lines 0, spacing, 2 * spacing, ...
+    scanned is the number of stream bytes processed, lines the number of newlines in them.
+    """
+
+    def __init__(self, spacing=LINE_INDEX_SPACING):
+        self.spacing = spacing
+        self.offsets = array.array(OFFSET_TYPECODE, [0])
+        self.lines = 0
+        self.scanned = 0
+        self.complete = False
+        self.updated = False  # changed since loaded / saved
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __repr__(self):
+        return 'LineIndex(spacing=%r, offsets=%r, lines=%r, scanned=%r, complete=%r)' \
+               % (self.spacing, len(self.offsets), self.lines, self.scanned, self.complete)
+
+    def feed(self, data, offset):
+        """
+        Processes the data read at the stream offset. Data already processed are skipped,
+        data beyond the processed part (after a forward seek) are ignored.
+        :param data: bytes
+        :param offset:
+        :return:
+        """
+        if self.complete:
+            return
+        end = offset + len(data)
+        if offset > self.scanned or end <= self.scanned:
+            return
+        if offset < self.scanned:
+            data = data[self.scanned - offset:]
+
+        count = count_newlines(data)
+        if count:
+            next_line = len(self.offsets) * self.spacing  # next indexed line number
+            if self.lines + count >= next_line and has_numpy():
+                self.offsets.extend(self.scanned + pos + 1 for pos in
+                                    nth_newlines(data, next_line - self.lines, self.spacing))
+                self.lines += count
+            elif self.lines + count >= next_line:
+                pos = -1
+                lines = self.lines
+                while lines + count >= next_line:
+                    pos = nth_newline(data, next_line - lines, pos + 1)
+                    count -= next_line - lines
+                    lines = next_line
+                    self.offsets.append(self.scanned + pos + 1)
+                    next_line += self.spacing
+                self.lines = lines + count
+            else:
+                self.lines += count
+        self.scanned += len(data)
+        self.updated = True
+
+    def finish(self):
+        """
+        Marks the index as complete, the whole stream was processed
+        :return:
+        """
+        if not self.complete:
+            self.complete = True
+            self.updated = True
+
+    def find(self, line):
+        """
+        Returns the closest indexed line at or before the line
+        :param line: line number, 0 based
+        :return: (indexed line number, byte offset)
+        """
+        idx = min(line // self.spacing, len(self.offsets) - 1)
+        return idx * self.spacing, self.offsets[idx]
+
+    def line_at(self, offset):
+        """
+        Returns the closest indexed line starting at or before the byte offset
+        :param offset:
+        :return: (indexed line number, byte offset)
+        """
+        idx = bisect.bisect_right(self.offsets, offset) - 1
+        return idx * self.spacing, self.offsets[idx]
+
+    def to_state(self):
+        js = collections.OrderedDict()
+        js['type'] = 'LineIndex'
+        js['spacing'] = self.spacing
+        js['offsets'] = len(self.offsets)
+        js['lines'] = self.lines
+        js['scanned'] = self.scanned
+        js['complete'] = self.complete
+        return js
+
+    def save(self, fname):
+        """
+        Writes the index to the file, atomically
+        :param fname:
+        :return:
+        """
+        offsets = self.offsets
+        if sys.byteorder != 'little':
+            offsets = array.array(OFFSET_TYPECODE, offsets)
+            offsets.byteswap()
+
+        fname_tmp = '%s.%s.tmp' % (fname, os.getpid())
+        with open(fname_tmp, 'wb') as fh:
+            fh.write(LINE_INDEX_MAGIC)
+            fh.write(LINE_INDEX_HEADER.pack(self.spacing, self.lines, self.scanned, 1 if self.complete else 0,
+                                            len(offsets)))
+            fh.write(offsets.tobytes() if hasattr(offsets, 'tobytes') else offsets.tostring())
+        os.rename(fname_tmp, fname)
+        self.updated = False
+
+    @classmethod
+    def load(cls, fname):
+        """
+        Loads the index from the file
+        :param fname:
+        :return:
+        """
+        with open(fname, 'rb') as fh:
+            if fh.read(len(LINE_INDEX_MAGIC)) != LINE_INDEX_MAGIC:
+                raise ValueError('File %s is not a line index' % fname)
+
+            spacing, lines, scanned, complete, count = LINE_INDEX_HEADER.unpack(fh.read(LINE_INDEX_HEADER.size))
+            idx = cls(spacing=spacing)
+            idx.offsets = array.array(OFFSET_TYPECODE)
+            data = fh.read(count * idx.offsets.itemsize)
+            if hasattr(idx.offsets, 'frombytes'):
+                idx.offsets.frombytes(data)
+            else:
+                idx.offsets.fromstring(data)
+            if sys.byteorder != 'little':
+                idx.offsets.byteswap()
+
+        idx.lines = lines
+        idx.scanned = scanned
+        idx.complete = bool(complete)
+        return idx
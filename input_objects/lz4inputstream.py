@@ -0,0 +1,95 @@
+"""
+Streaming LZ4 frame decompression.
+
+Uses py-lz4framed, falls back to lz4.frame if py-lz4framed is not available
+(e.g., on Python 3).
+"""
+
+from framedstream import FramedInputStream, BLOCK_SIZE, MAX_CHUNK_SIZE
+
+try:
+    import lz4framed
+except ImportError:
+    lz4framed = None
+
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+
+
+LZ4F_HEADER_SIZE_MIN = 7
+"""Minimal LZ4 frame header size, the first input hint"""
+
+
+class FramedDecompressor(object):
+    """
+    py-lz4framed decompression context with the lz4.frame.LZ4FrameDecompressor interface.
+    Input is fed in pieces of at most the size hinted by the decompressor, so the
+    decompression never continues past the end of the frame, the rest is left in unused_data.
+    """
+
+    def __init__(self):
+        self._ctx = lz4framed.create_decompression_context()
+        self._hint = LZ4F_HEADER_SIZE_MIN
+        self._input = b''
+        self.eof = False
+        self.unused_data = b''
+
+    @property
+    def needs_input(self):
+        return not self._input and not self.eof
+
+    def decompress(self, data, max_length=-1):
+        """
+        Decompresses the data, stops at the end of the frame
+        or when at least max_length bytes were produced.
+        :param data:
+        :param max_length:
+        :return:
+        """
+        self._input = self._input + data if self._input else data
+
+        res = []
+        size = 0
+        while self._input and (max_length < 0 or size < max_length):
+            piece = self._input[:self._hint]
+            self._input = self._input[len(piece):]
+
+            chunks = lz4framed.decompress_update(self._ctx, piece, max(max_length, 65536))
+            self._hint = chunks.pop()
+            res.extend(chunks)
+            size += sum(len(x) for x in chunks)
+
+            if self._hint == 0:
+                self.eof = True
+                self.unused_data, self._input = self._input, b''
+                break
+
+        return res[0] if len(res) == 1 else b''.join(res)
+
+
+def new_decompressor():
+    """
+    Creates LZ4 frame decompressor
+    :return:
+    """
+    if lz4framed is not None:
+        return FramedDecompressor()
+    if lz4frame is not None:
+        return lz4frame.LZ4FrameDecompressor()
+    raise ImportError('LZ4 decompression requires py-lz4framed or lz4')
+
+
+class Lz4InputStream(FramedInputStream):
+    """
+    Streaming reads from LZ4 frame files, possibly several concatenated frames.
+    A single decompression step produces at most max_chunk_size bytes, plus at most
+    one LZ4 block with py-lz4framed.
+    """
+
+    def __init__(self, fileobj, block_size=BLOCK_SIZE, max_chunk_size=MAX_CHUNK_SIZE, comp_offset=0,
+                 uncomp_offset=0):
+        super(Lz4InputStream, self).__init__(fileobj, new_decompressor, block_size=block_size,
+                                             max_chunk_size=max_chunk_size, comp_offset=comp_offset,
+                                             uncomp_offset=uncomp_offset)
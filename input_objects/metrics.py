@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Per layer read metrics of input object stacks - calls, bytes and time in read(), readinto()
+and readline(), hashing time, read size and latency histograms, reconnect durations.
+
+Disabled metrics cost nothing: instrument() replaces the read methods and the digest
+of the instances by timed wrappers, uninstrument() removes them again.
+The exclusive (self) time of a layer is its read time minus the read time of the wrapped layers,
+for source layers it is the time blocked on I/O, for decoders the decompression.
+Layers reading their children on background threads (prefetch, pipelines) have no meaningful
+self time, the children time is spent elsewhere.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+clock = getattr(time, 'perf_counter', time.time)
+"""Monotonic high resolution clock"""
+
+KIND_IO = 'io'
+"""Source layer, the self time is the time blocked on I/O"""
+
+KIND_DECODE = 'decode'
+"""Decompressing layer"""
+
+KIND_OTHER = 'other'
+"""Other wrapping layers - tee, merge, cache, prefetch"""
+
+HISTOGRAM_BUCKETS = 64
+
+TIMED_OPS = ('read', 'readinto', 'readline')
+"""Input object methods timed by the metrics"""
+
+
+class Histogram(object):
+    """
+    Power of two bucket histogram of non-negative integers, bucket i counts values
+    in [2^(i-1), 2^i), bucket 0 counts zeros
+    """
+    def __init__(self, unit):
+        self.unit = unit
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def __repr__(self):
+        return 'Histogram(unit=%r, count=%r)' % (self.unit, self.count)
+
+    def add(self, value):
+        value = int(value)
+        idx = value.bit_length()
+        self.buckets[idx if idx < HISTOGRAM_BUCKETS else HISTOGRAM_BUCKETS - 1] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, pct):
+        """
+        Returns the upper bound of the bucket containing the percentile
+        :param pct: 0 - 100
+        :return:
+        """
+        if not self.count:
+            return None
+        rank = self.count * pct / 100.0
+        seen = 0
+        for idx, cnt in enumerate(self.buckets):
+            seen += cnt
+            if cnt and seen >= rank:
+                return min(self.max, (1 << idx) - 1) if idx else 0
+        return self.max
+
+    def to_state(self):
+        js = collections.OrderedDict()
+        js['unit'] = self.unit
+        js['count'] = self.count
+        js['mean'] = self.total / float(self.count) if self.count else None
+        js['p50'] = self.percentile(50)
+        js['p99'] = self.percentile(99)
+        js['max'] = self.max
+        js['buckets'] = collections.OrderedDict((str((1 << idx) - 1 if idx else 0), cnt)
+                                                for idx, cnt in enumerate(self.buckets) if cnt)
+        return js
+
+
+class LayerMetrics(object):
+    """
+    Metrics of one input object of the stack.
+    callback(metrics, op, size, elapsed) is called after every timed call.
+    """
+    def __init__(self, name, kind=KIND_OTHER, callback=None):
+        self.name = name
+        self.kind = kind
+        self.callback = callback
+        self.children = []  # LayerMetrics of the wrapped input objects
+
+        self.calls = 0
+        self.bytes = 0
+        self.time = 0.0
+        self.hash_time = 0.0
+        self.reconnects = 0
+        self.reconnect_time = 0.0
+        self.read_sizes = Histogram('bytes')
+        self.latencies = Histogram('us')
+        self.reconnect_durations = Histogram('ms')
+        self._depth = 0  # nested timed calls of the layer, e.g., readline calling read
+
+    def __repr__(self):
+        return 'LayerMetrics(name=%r, calls=%r, bytes=%r, time=%.6f)' % (self.name, self.calls, self.bytes, self.time)
+
+    def record(self, op, size, elapsed):
+        """
+        Records a finished call
+        :param op: read, readinto, readline
+        :param size: bytes returned
+        :param elapsed: seconds
+        :return:
+        """
+        self.calls += 1
+        self.bytes += size
+        self.time += elapsed
+        self.read_sizes.add(size)
+        self.latencies.add(elapsed * 1e6)
+        if self.callback is not None:
+            self.callback(self, op, size, elapsed)
+
+    def reconnect(self, duration):
+        """
+        Records a reconnect, seconds from the start of the reconnect to the response
+        :param duration:
+        :return:
+        """
+        self.reconnects += 1
+        self.reconnect_time += duration
+        self.reconnect_durations.add(duration * 1e3)
+
+    def self_time(self):
+        """
+        Read time not spent in the wrapped layers
+        :return:
+        """
+        return max(0.0, self.time - sum(x.time for x in self.children))
+
+    def short(self):
+        return 'calls=%d bytes=%d time=%.3fs self=%.3fs' % (self.calls, self.bytes, self.time, self.self_time())
+
+    def to_state(self):
+        js = collections.OrderedDict()
+        js['name'] = self.name
+        js['kind'] = self.kind
+        js['calls'] = self.calls
+        js['bytes'] = self.bytes
+        js['time'] = self.time
+        js['self_time'] = self.self_time()
+        js['hash_time'] = self.hash_time
+        js['reconnects'] = self.reconnects
+        js['reconnect_time'] = self.reconnect_time
+        js['read_sizes'] = self.read_sizes.to_state()
+        js['latencies'] = self.latencies.to_state()
+        js['reconnect_durations'] = self.reconnect_durations.to_state()
+        return js
+
+
+class MetricsRegistry(object):
+    """
+    Collects the layer metrics of instrumented stacks, reports the time breakdown and the bottleneck
+    """
+    def __init__(self):
+        self.layers = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'MetricsRegistry(layers=%r)' % len(self.layers)
+
+    def register(self, metrics):
+        with self._lock:
+            self.layers.append(metrics)
+
+    def unregister(self, metrics):
+        with self._lock:
+            if metrics in self.layers:
+                self.layers.remove(metrics)
+
+    def snapshot(self):
+        """
+        Returns the metrics of all layers
+        :return:
+        """
+        with self._lock:
+            return [x.to_state() for x in self.layers]
+
+    def breakdown(self):
+        """
+        Splits the exclusive time of the layers to I/O, decompression, hashing and the rest
+        :return:
+        """
+        js = collections.OrderedDict([('io_time', 0.0), ('decode_time', 0.0), ('hash_time', 0.0),
+                                      ('other_time', 0.0), ('reconnect_time', 0.0)])
+        with self._lock:
+            for x in self.layers:
+                own = max(0.0, x.self_time() - x.hash_time)
+                js['%s_time' % x.kind if x.kind in (KIND_IO, KIND_DECODE) else 'other_time'] += own
+                js['hash_time'] += x.hash_time
+                js['reconnect_time'] += x.reconnect_time
+        return js
+
+    def bottleneck(self):
+        """
+        Returns the layer with the largest exclusive time, None if nothing recorded
+        :return:
+        """
+        with self._lock:
+            layers = [x for x in self.layers if x.calls]
+        return max(layers, key=lambda x: x.self_time()) if layers else None
+
+
+class TimedDigest(object):
+    """
+    Digest wrapper measuring the hashing time of the layer
+    """
+    def __init__(self, digest, metrics):
+        self.digest = digest
+        self.metrics = metrics
+
+    def __getattr__(self, item):
+        return getattr(self.digest, item)
+
+    def update(self, data):
+        start = clock()
+        self.digest.update(data)
+        self.metrics.hash_time += clock() - start
+
+
+def _timed(op, method, metrics):
+    """
+    Returns the timed version of the bound input object method
+    :param op:
+    :param method:
+    :param metrics:
+    :return:
+    """
+    record = metrics.record
+
+    def timed(*args, **kwargs):
+        if metrics._depth:
+            return method(*args, **kwargs)
+
+        metrics._depth = 1
+        start = clock()
+        try:
+            res = method(*args, **kwargs)
+        finally:
+            metrics._depth = 0
+        elapsed = clock() - start
+        record(op, res if res.__class__ is int else len(res) if res is not None else 0, elapsed)
+        return res
+    return timed
+
+
+def _short_desc(desc, metrics):
+    def short_desc():
+        return '%s[%s]' % (desc(), metrics.short())
+    return short_desc
+
+
+def instrument(iobj, registry=None, callback=None, prefix=''):
+    """
+    Enables the metrics of the input object and the wrapped ones, see the module description
+    :param iobj: input object, not read yet or read with metrics disabled so far
+    :param registry: MetricsRegistry the layer metrics are registered to
+    :param callback: callback(metrics, op, size, elapsed) after every timed call
+    :param prefix: name prefix, the stack path
+    :return: LayerMetrics of the input object
+    """
+    if iobj.metrics is not None:
+        uninstrument(iobj, registry=registry, recursive=False)
+
+    name = '%s%s' % (prefix, iobj.__class__.__name__)
+    metrics = LayerMetrics(name, kind=getattr(iobj, 'metrics_kind', KIND_OTHER), callback=callback)
+    for idx, child in enumerate(iobj.children()):
+        metrics.children.append(instrument(child, registry=registry, callback=callback,
+                                           prefix='%s/%s.' % (name, idx)))
+
+    iobj.metrics = metrics
+    for op in TIMED_OPS:
+        setattr(iobj, op, _timed(op, getattr(iobj, op), metrics))
+    iobj.short_desc = _short_desc(iobj.short_desc, metrics)
+    iobj.digest = TimedDigest(iobj.digest, metrics)
+    if registry is not None:
+        registry.register(metrics)
+    return metrics
+
+
+def uninstrument(iobj, registry=None, recursive=True):
+    """
+    Disables the metrics of the input object, restores the original methods
+    :param iobj:
+    :param registry:
+    :param recursive: also the wrapped input objects
+    :return:
+    """
+    if iobj.metrics is not None:
+        for op in TIMED_OPS + ('short_desc',):
+            iobj.__dict__.pop(op, None)
+        if isinstance(iobj.digest, TimedDigest):
+            iobj.digest = iobj.digest.digest
+        if registry is not None:
+            registry.unregister(iobj.metrics)
+        iobj.metrics = None
+
+    if recursive:
+        for child in iobj.children():
+            uninstrument(child, registry=registry)
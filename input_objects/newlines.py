@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Vectorized newline scanning - the number and the positions of all newlines of a block in one pass.
+Uses NumPy when available, otherwise the C level bytes.count() and a regular expression scan.
+"""
+
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+NEWLINE = 10
+"""Newline byte value"""
+
+_NEWLINE_RE = re.compile(b'\n')
+
+
+def has_numpy():
+    """
+    Returns true if the NumPy scanning is available
+    :return:
+    """
+    return numpy is not None
+
+
+def _as_array(data, start, end):
+    """
+    Returns the uint8 NumPy array over the data range, without copying
+    :param data:
+    :param start:
+    :param end:
+    :return:
+    """
+    arr = numpy.frombuffer(data, dtype=numpy.uint8)
+    return arr[start:end] if start or end is not None else arr
+
+
+def count_newlines(data, start=0, end=None):
+    """
+    Returns the number of newlines in data[start:end]
+    :param data: bytes, bytearray, memoryview, mmap
+    :param start:
+    :param end:
+    :return:
+    """
+    if isinstance(data, (bytes, bytearray)):  # memchr speed, no copy
+        return data.count(b'\n', start, len(data) if end is None else end)
+    if numpy is not None:
+        return int(numpy.count_nonzero(_as_array(data, start, end) == NEWLINE))
+    return bytes(memoryview(data)[start:end]).count(b'\n')
+
+
+def newline_positions(data, start=0, end=None):
+    """
+    Returns the positions of all newlines in data[start:end], relative to data
+    :param data: bytes, bytearray, memoryview, mmap
+    :param start:
+    :param end:
+    :return: NumPy int64 array if NumPy is available, list otherwise
+    """
+    if numpy is not None:
+        positions = numpy.flatnonzero(_as_array(data, start, end) == NEWLINE)
+        return positions + start if start else positions
+
+    if end is None:
+        end = len(data)
+    return [m.start() for m in _NEWLINE_RE.finditer(data, start, end)]
+
+
+def nth_newlines(data, first, step, start=0, end=None):
+    """
+    Returns the positions of the first-th, (first + step)-th, ... newline of data[start:end], 1 based.
+    Line index offsets - every step-th line - located in one pass.
+    :param data:
+    :param first:
+    :param step:
+    :param start:
+    :param end:
+    :return: list of positions
+    """
+    positions = newline_positions(data, start, end)
+    return [int(x) for x in positions[first - 1::step]]
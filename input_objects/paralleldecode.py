@@ -0,0 +1,603 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Parallel decompression of streams made of independently compressed units -
+BGZF gzip members (bgzip) and LZ4 frames with independent blocks.
+
+A reader thread splits the compressed stream to units, a pool of worker threads
+decompresses them (zlib and lz4 release the GIL) and the consumer reads the output
+in the original order. From the first unit which cannot be split on, e.g., a plain gzip
+member after BGZF ones or a LZ4 frame with linked blocks, the rest of the stream
+is decompressed sequentially on the reader thread.
+
+LZ4 content checksums are not verified by the parallel decompression, block checksums
+only with py-lz4framed. The sequential decompression verifies both.
+"""
+
+import logging
+import struct
+import threading
+import traceback
+import zlib
+from gzipinputstream import GzipInputStream
+from lz4inputstream import Lz4InputStream
+
+try:
+    import lz4.block as lz4block
+except ImportError:
+    lz4block = None
+
+try:
+    import lz4framed
+except ImportError:
+    lz4framed = None
+
+
+logger = logging.getLogger(__name__)
+
+
+PARALLEL_MAX_INFLIGHT = 64 * 1024 * 1024
+"""Default maximal number of bytes held by units being read, decompressed or waiting for the consumer"""
+
+GZIP_MAGIC = b'\x1f\x8b'
+BGZF_MAX_MEMBER = 65536
+"""BGZF member and its decompressed content are at most 64 kB"""
+
+LZ4_MAGIC = 0x184D2204
+LZ4_SKIPPABLE_MASK = 0xFFFFFFF0
+LZ4_SKIPPABLE_MAGIC = 0x184D2A50
+LZ4_BLOCK_SIZES = {4: 64 * 1024, 5: 256 * 1024, 6: 1024 * 1024, 7: 4 * 1024 * 1024}
+LZ4_UNCOMPRESSED_BIT = 0x80000000
+
+FLG_BLOCK_INDEPENDENT = 0x20
+FLG_BLOCK_CHECKSUM = 0x10
+FLG_CONTENT_SIZE = 0x08
+FLG_CONTENT_CHECKSUM = 0x04
+FLG_DICT_ID = 0x01
+
+XXH_PRIME32 = (2654435761, 2246822519, 3266489917, 668265263, 374761393)
+
+
+class PeekReader(object):
+    """
+    File-like reader which allows looking at the beginning of the stream without consuming it
+    """
+
+    def __init__(self, fileobj, head=b''):
+        """
+        :param fileobj: file-like object
+        :param head: data already read from the fileobj, returned first
+        """
+        self._file = fileobj
+        self._head = head
+
+    def peek(self, size):
+        """
+        Returns up to size bytes from the current position, the data is read again by read()
+        :param size:
+        :return:
+        """
+        while len(self._head) < size:
+            data = self._file.read(size - len(self._head))
+            if not data:
+                break
+            self._head += data
+        return self._head[:size]
+
+    def read(self, size=None):
+        if not self._head:
+            return self._file.read(size)
+
+        if size is None or size < 0:
+            data, self._head = self._head, b''
+            return data + (self._file.read() or b'')
+
+        data, self._head = self._head[:size], self._head[size:]
+        return data
+
+
+def read_exactly(fh, size):
+    """
+    Reads exactly size bytes, less only at the end of the stream
+    :param fh:
+    :param size:
+    :return:
+    """
+    res = []
+    remaining = size
+    while remaining > 0:
+        data = fh.read(remaining)
+        if not data:
+            break
+        res.append(data)
+        remaining -= len(data)
+    return res[0] if len(res) == 1 else b''.join(res)
+
+
+def iter_sequential(stream, unit_size):
+    """
+    Reads the decompressed output of the sequential stream in units of at most unit_size bytes
+    :param stream: GzipInputStream / Lz4InputStream
+    :param unit_size:
+    :return: generator of the decompressed data
+    """
+    while True:
+        data = stream.read(unit_size)
+        if not data:
+            return
+        yield data
+
+
+def bgzf_member_size(header):
+    """
+    Returns the total member size from the BGZF gzip member header, None if it is not a BGZF member
+    :param header: at least 12 bytes of the member, better the whole extra field
+    :return:
+    """
+    if len(header) < 12 or header[:2] != GZIP_MAGIC or not ord(header[3:4]) & 0x04:
+        return None
+
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = header[12:12 + xlen]
+    pos = 0
+    while pos + 4 <= len(extra):
+        slen = struct.unpack('<H', extra[pos + 2:pos + 4])[0]
+        if extra[pos:pos + 2] == b'BC' and slen == 2:
+            return struct.unpack('<H', extra[pos + 4:pos + 6])[0] + 1
+        pos += 4 + slen
+    return None
+
+
+def is_bgzf(head):
+    """
+    Returns true if the stream head is a BGZF gzip member
+    :param head:
+    :return:
+    """
+    return bgzf_member_size(head) is not None
+
+
+def iter_bgzf_members(fh):
+    """
+    Splits BGZF stream to gzip members. The rest of the stream starting with a member
+    which is not BGZF is decompressed sequentially, yielded as already decompressed units.
+    :param fh:
+    :return: generator of (member, max decompressed size) or (decompressed data, None)
+    """
+    offset = 0
+    while True:
+        header = read_exactly(fh, 18)
+        if not header:
+            return
+
+        # extra field may be longer than the plain BGZF one
+        if len(header) >= 12:
+            xlen = struct.unpack('<H', header[10:12])[0]
+            if xlen > 6:
+                header += read_exactly(fh, xlen - 6)
+
+        size = bgzf_member_size(header)
+        if size is None:
+            logger.info('Not a BGZF gzip member at %s, decompressing the rest sequentially' % offset)
+            stream = GzipInputStream(PeekReader(fh, header), max_chunk_size=BGZF_MAX_MEMBER)
+            for data in iter_sequential(stream, BGZF_MAX_MEMBER):
+                yield data, None
+            return
+        if size < len(header):
+            raise IOError('Invalid BGZF member size %s at %s' % (size, offset))
+
+        member = header + read_exactly(fh, size - len(header))
+        if len(member) != size:
+            raise IOError('BGZF stream truncated at %s' % offset)
+        offset += size
+        yield member, BGZF_MAX_MEMBER
+
+
+def decode_bgzf_member(unit):
+    """
+    Decompresses a single gzip member, checks its CRC
+    :param unit:
+    :return:
+    """
+    member, max_size = unit
+    if max_size is None:  # decompressed by the sequential fallback
+        return member
+    return zlib.decompress(member, 16 + zlib.MAX_WBITS)
+
+
+def _rotl32(x, r):
+    return ((x << r) | (x >> (32 - r))) & 0xFFFFFFFF
+
+
+def xxh32(data, seed=0):
+    """
+    xxHash32 of the data, pure Python - used only for short LZ4 frame descriptors
+    :param data:
+    :param seed:
+    :return:
+    """
+    p1, p2, p3, p4, p5 = XXH_PRIME32
+    size = len(data)
+    pos = 0
+    if size >= 16:
+        acc = [(seed + p1 + p2) & 0xFFFFFFFF, (seed + p2) & 0xFFFFFFFF, seed, (seed - p1) & 0xFFFFFFFF]
+        while pos + 16 <= size:
+            for idx in range(4):
+                lane = struct.unpack('<I', data[pos:pos + 4])[0]
+                acc[idx] = (_rotl32((acc[idx] + lane * p2) & 0xFFFFFFFF, 13) * p1) & 0xFFFFFFFF
+                pos += 4
+        h = (_rotl32(acc[0], 1) + _rotl32(acc[1], 7) + _rotl32(acc[2], 12) + _rotl32(acc[3], 18)) & 0xFFFFFFFF
+    else:
+        h = (seed + p5) & 0xFFFFFFFF
+
+    h = (h + size) & 0xFFFFFFFF
+    while pos + 4 <= size:
+        h = (_rotl32((h + struct.unpack('<I', data[pos:pos + 4])[0] * p3) & 0xFFFFFFFF, 17) * p4) & 0xFFFFFFFF
+        pos += 4
+    while pos < size:
+        h = (_rotl32((h + ord(data[pos:pos + 1]) * p5) & 0xFFFFFFFF, 11) * p1) & 0xFFFFFFFF
+        pos += 1
+
+    h ^= h >> 15
+    h = (h * p2) & 0xFFFFFFFF
+    h ^= h >> 13
+    h = (h * p3) & 0xFFFFFFFF
+    h ^= h >> 16
+    return h
+
+
+def lz4_block_frame_header(head):
+    """
+    Header of a frame holding a single block of the frame with the given header -
+    content size and content checksum dropped, header checksum recomputed
+    :param head:
+    :return:
+    """
+    flg = ord(head[4:5]) & ~(FLG_CONTENT_SIZE | FLG_CONTENT_CHECKSUM)
+    descriptor = struct.pack('<BB', flg, ord(head[5:6]))
+    return head[:4] + descriptor + struct.pack('<B', (xxh32(descriptor) >> 8) & 0xFF)
+
+
+def lz4_frame_header(head):
+    """
+    Parses LZ4 frame header
+    :param head: frame start, at least the whole header (up to 19 bytes)
+    :return: (flags, block max size, header size), None if not LZ4 frame
+    """
+    if len(head) < 7 or struct.unpack('<I', head[:4])[0] != LZ4_MAGIC:
+        return None
+
+    flg, bd = ord(head[4:5]), ord(head[5:6])
+    size = 7 + (8 if flg & FLG_CONTENT_SIZE else 0) + (4 if flg & FLG_DICT_ID else 0)
+    block_max = LZ4_BLOCK_SIZES.get((bd >> 4) & 0x7)
+    if block_max is None:
+        return None
+    return flg, block_max, size
+
+
+def is_lz4_splittable(head):
+    """
+    Returns true if the stream head is LZ4 frame with independent blocks which can be decompressed here
+    :param head:
+    :return:
+    """
+    header = lz4_frame_header(head)
+    if header is None or len(head) < header[2]:
+        return False
+    return _lz4_frame_decodable(header[0])
+
+
+def _lz4_frame_decodable(flg):
+    """
+    Blocks are decompressed by lz4.block or, with py-lz4framed only, as single block frames
+    :param flg:
+    :return:
+    """
+    if not flg & FLG_BLOCK_INDEPENDENT or flg & FLG_DICT_ID:
+        return False
+    return lz4block is not None or lz4framed is not None
+
+
+def iter_lz4_blocks(fh):
+    """
+    Splits LZ4 stream (concatenated frames with independent blocks) to blocks.
+    Content checksums are skipped, block checksums are verified only with py-lz4framed.
+    The rest of the stream starting with a frame which cannot be split is decompressed sequentially,
+    yielded as already decompressed units.
+    :param fh:
+    :return: generator of (block, max decompressed size, single block frame header or None if uncompressed)
+    """
+    offset = 0
+    while True:
+        magic = read_exactly(fh, 4)
+        if not magic:
+            return
+        if len(magic) < 4:
+            raise IOError('LZ4 stream truncated at %s' % offset)
+
+        magic_num = struct.unpack('<I', magic)[0]
+        if magic_num & LZ4_SKIPPABLE_MASK == LZ4_SKIPPABLE_MAGIC:
+            skip = struct.unpack('<I', read_exactly(fh, 4))[0]
+            read_exactly(fh, skip)
+            offset += 8 + skip
+            continue
+
+        head = magic + read_exactly(fh, 3)
+        header = lz4_frame_header(head)
+        if header is None:
+            raise IOError('Not a LZ4 frame at %s' % offset)
+
+        flg, block_max, header_size = header
+        head += read_exactly(fh, header_size - len(head))
+        if not _lz4_frame_decodable(flg):
+            logger.info('LZ4 frame at %s cannot be split to independent blocks, decompressing the rest sequentially'
+                        % offset)
+            stream = Lz4InputStream(PeekReader(fh, head), max_chunk_size=block_max)
+            for data in iter_sequential(stream, block_max):
+                yield data, block_max, None
+            return
+
+        offset += header_size
+        block_head = lz4_block_frame_header(head)
+        checksum_size = 4 if flg & FLG_BLOCK_CHECKSUM else 0
+        while True:
+            size_data = read_exactly(fh, 4)
+            if len(size_data) < 4:
+                raise IOError('LZ4 stream truncated at %s' % offset)
+            size = struct.unpack('<I', size_data)[0]
+            if size == 0:  # end mark
+                break
+
+            data = read_exactly(fh, (size & ~LZ4_UNCOMPRESSED_BIT) + checksum_size)
+            if len(data) < (size & ~LZ4_UNCOMPRESSED_BIT) + checksum_size:
+                raise IOError('LZ4 stream truncated at %s' % offset)
+            offset += 4 + len(data)
+
+            if size & LZ4_UNCOMPRESSED_BIT:
+                yield data[:len(data) - checksum_size], block_max, None
+            else:
+                yield size_data + data, block_max, block_head
+
+        if flg & FLG_CONTENT_CHECKSUM:
+            read_exactly(fh, 4)
+        offset += 4 + (4 if flg & FLG_CONTENT_CHECKSUM else 0)
+
+
+def decode_lz4_block(unit):
+    """
+    Decompresses a single independent LZ4 block
+    :param unit:
+    :return:
+    """
+    data, block_max, head = unit
+    if head is None:
+        return data
+
+    if lz4block is not None:
+        size = struct.unpack('<I', data[:4])[0]
+        return lz4block.decompress(data[4:4 + size], uncompressed_size=block_max)
+
+    # single block frame, block checksum is verified
+    return lz4framed.decompress(head + data + b'\x00\x00\x00\x00')
+
+
+class ParallelDecoder(object):
+    """
+    Decompresses units produced by units (iterator, e.g., iter_bgzf_members()) using decode(unit)
+    on a pool of worker threads. read() returns the decompressed data in the original order.
+
+    Units are taken only when an in-flight slot is free, at most max_inflight // unit size
+    units are being read, decompressed or waiting for the consumer, so the memory stays bounded.
+    Errors of the splitting or decoding are re-raised to the consumer after the preceding data.
+    """
+
+    def __init__(self, units, decode, workers=4, max_inflight=PARALLEL_MAX_INFLIGHT, unit_size=BGZF_MAX_MEMBER,
+                 stop_event=None, name='parallel-decode'):
+        self.units = units
+        self.decode = decode
+        self.workers = max(1, workers)
+        self.max_inflight = max_inflight or PARALLEL_MAX_INFLIGHT
+        self.stop_event = stop_event or threading.Event()
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._threads = []
+        self._closed = False
+        self._tasks = {}  # idx -> unit waiting for a worker
+        self._results = {}  # idx -> (data, exception)
+        self._next_unit = 0  # index of the next unit read from units
+        self._next_task = 0  # index of the next unit to decompress
+        self._num_units = None  # number of units to decompress, known when units are exhausted
+        self._end = None  # number of results for the consumer
+        self._slots = max(2 * self.workers, self.max_inflight // max(1, unit_size))
+
+        # consumer state
+        self._cur = 0
+        self._cur_data = None
+        self._cur_pos = 0
+        self._buffered = 0
+
+    def __repr__(self):
+        return 'ParallelDecoder(unit=%r, read=%r, workers=%r)' % (self._cur, self._next_unit, self.workers)
+
+    @property
+    def buffered(self):
+        return self._buffered
+
+    def start(self):
+        """
+        Starts the reading and worker threads
+        :return:
+        """
+        threads = [threading.Thread(target=self._read_units, name='%s-read' % self.name)]
+        threads += [threading.Thread(target=self._work, name='%s-%s' % (self.name, idx))
+                    for idx in range(self.workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        self._threads = threads
+        return self
+
+    def close(self):
+        """
+        Stops the threads, drops decompressed data
+        :return:
+        """
+        with self._cond:
+            self._closed = True
+            self._tasks = {}
+            self._results = {}
+            self._cond.notify_all()
+
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def _is_stopped(self):
+        return self._closed or self.stop_event.is_set()
+
+    def _read_units(self):
+        """
+        Reader loop - reserve a slot, read the next unit
+        :return:
+        """
+        units = iter(self.units)
+        while True:
+            with self._cond:
+                while self._slots <= 0 and not self._is_stopped():
+                    self._cond.wait(0.5)
+                if self._is_stopped():
+                    return
+                self._slots -= 1
+
+            idx = self._next_unit
+            try:
+                unit = next(units)
+
+            except StopIteration:
+                with self._cond:
+                    self._num_units = self._end = idx
+                    self._cond.notify_all()
+                return
+
+            except Exception as e:
+                logger.error('Exception when reading compressed units: %s' % e)
+                logger.debug(traceback.format_exc())
+                with self._cond:
+                    self._results[idx] = (None, e)
+                    self._num_units, self._end = idx, idx + 1
+                    self._cond.notify_all()
+                return
+
+            with self._cond:
+                self._tasks[idx] = unit
+                self._next_unit = idx + 1
+                self._cond.notify_all()
+
+    def _work(self):
+        """
+        Worker loop - take the next unit in order, decompress it
+        :return:
+        """
+        while True:
+            with self._cond:
+                while self._next_task not in self._tasks and not self._is_stopped() \
+                        and (self._num_units is None or self._next_task < self._num_units):
+                    self._cond.wait(0.5)
+                if self._is_stopped() or self._next_task not in self._tasks:
+                    return
+
+                idx = self._next_task
+                unit = self._tasks.pop(idx)
+                self._next_task += 1
+
+            try:
+                res = (self.decode(unit), None)
+            except Exception as e:
+                logger.error('Exception when decompressing unit %s: %s' % (idx, e))
+                logger.debug(traceback.format_exc())
+                res = (None, e)
+
+            with self._cond:
+                if self._closed:
+                    return
+                self._results[idx] = res
+                self._buffered += len(res[0]) if res[0] is not None else 0
+                self._cond.notify_all()
+
+    def read(self, size=None):
+        """
+        Reads up to size bytes in order, blocks until decompressed.
+        Returns empty data at the end, None if interrupted by the stop event.
+        :param size: None or 0 = everything to the end
+        :return:
+        """
+        res = []
+        remaining = size or None
+        while remaining is None or remaining > 0:
+            if self._cur_data is None and not self._next_result():
+                if self._is_stopped():
+                    return None
+                break
+
+            if remaining is None:
+                res.append(self._cur_data[self._cur_pos:])
+                self._cur_pos = len(self._cur_data)
+            else:
+                res.append(self._cur_data[self._cur_pos:self._cur_pos + remaining])
+                self._cur_pos += len(res[-1])
+                remaining -= len(res[-1])
+
+            if self._cur_pos >= len(self._cur_data):
+                with self._cond:
+                    self._buffered -= len(self._cur_data)
+                    self._cur_data = None
+                    self._cur += 1
+                    self._slots += 1
+                    self._cond.notify_all()
+
+        return res[0] if len(res) == 1 else b''.join(res)
+
+    def _next_result(self):
+        """
+        Waits for the current unit, False at the end of data or when stopped
+        :return:
+        """
+        with self._cond:
+            while self._cur not in self._results:
+                if self._end is not None and self._cur >= self._end:
+                    return False
+                if self._is_stopped():
+                    return False
+                self._cond.wait(0.5)
+
+            data, error = self._results.pop(self._cur)
+            if error is not None:
+                self._end = self._cur
+                raise error
+
+            self._cur_data = data
+            self._cur_pos = 0
+            return True
+
+
+def new_parallel_decoder(fh, workers=4, max_inflight=PARALLEL_MAX_INFLIGHT, name='parallel-decode'):
+    """
+    Creates parallel decoder for the stream if its format allows it - BGZF or LZ4 frames with independent blocks
+    :param fh: PeekReader at the stream start
+    :param workers:
+    :param max_inflight:
+    :param name:
+    :return: ParallelDecoder, not started, or None if the stream cannot be decompressed in parallel
+    """
+    head = fh.peek(1024)
+    if is_bgzf(head):
+        return ParallelDecoder(iter_bgzf_members(fh), decode_bgzf_member, workers=workers,
+                               max_inflight=max_inflight, unit_size=2 * BGZF_MAX_MEMBER, name=name)
+
+    if is_lz4_splittable(head):
+        block_max = lz4_frame_header(head)[1]
+        return ParallelDecoder(iter_lz4_blocks(fh), decode_lz4_block, workers=workers,
+                               max_inflight=max_inflight, unit_size=2 * block_max, name=name)
+    return None
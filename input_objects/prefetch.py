@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Read-ahead buffer - drains a source on a background thread to a bounded chunk queue,
+so the source I/O overlaps with the consumption.
+"""
+
+import collections
+import logging
+import threading
+import traceback
+
+
+logger = logging.getLogger(__name__)
+
+
+PREFETCH_CHUNK_SIZE = 65536
+"""Default size of a single read from the source"""
+
+PREFETCH_MAX_BYTES = 4 * 1024 * 1024
+"""Default maximal number of bytes buffered ahead"""
+
+PIPELINE_CHUNK_SIZE = 256 * 1024
+"""Default size of a decoded chunk passed to the consumer by the decode pipeline"""
+
+ITEM_DATA = 0
+ITEM_EVENT = 1
+ITEM_ERROR = 2
+ITEM_EOF = 3
+
+
+class ReadAheadBuffer(object):
+    """
+    Background thread calls read(chunk_size) on the source and queues the chunks
+    until max_bytes are buffered. Exceptions raised by the source are re-raised to
+    the consumer after the data read before them, events posted by the source side
+    (e.g., reconnects) are delivered to on_event in the stream order.
+    Setting stop_event cancels the reading.
+    """
+
+    def __init__(self, read, chunk_size=PREFETCH_CHUNK_SIZE, max_bytes=PREFETCH_MAX_BYTES, stop_event=None,
+                 on_event=None, name='read-ahead'):
+        self.source_read = read
+        self.chunk_size = chunk_size
+        self.max_bytes = max(max_bytes, chunk_size)
+        self.stop_event = stop_event or threading.Event()
+        self.on_event = on_event
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._items = collections.deque()
+        self._bytes = 0  # bytes queued
+        self._front_pos = 0  # read offset in the front data chunk
+        self._closed = False
+        self._thread = None
+
+    def __repr__(self):
+        return 'ReadAheadBuffer(buffered=%r, items=%r)' % (self._bytes, len(self._items))
+
+    @property
+    def buffered(self):
+        return self._bytes
+
+    def start(self):
+        """
+        Starts the read-ahead thread
+        :return:
+        """
+        self._thread = threading.Thread(target=self._work, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self, timeout=None):
+        """
+        Stops the read-ahead thread, drops buffered data
+        :param timeout: join timeout, the thread may be blocked in the source read
+        :return:
+        """
+        with self._cond:
+            self._closed = True
+            self._items.clear()
+            self._bytes = 0
+            self._cond.notify_all()
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _is_stopped(self):
+        return self._closed or self.stop_event.is_set()
+
+    def _put(self, kind, payload=None, size=0):
+        with self._cond:
+            if self._closed:
+                return
+            self._items.append((kind, payload))
+            self._bytes += size
+            self._cond.notify_all()
+
+    def post_event(self, payload):
+        """
+        Queues an event to be delivered to the consumer at the current stream position.
+        Called from the source side.
+        :param payload:
+        :return:
+        """
+        self._put(ITEM_EVENT, payload)
+
+    def _work(self):
+        """
+        Read-ahead loop
+        :return:
+        """
+        while True:
+            with self._cond:
+                while self._bytes >= self.max_bytes and not self._is_stopped():
+                    self._cond.wait(0.5)
+                if self._is_stopped():
+                    return
+
+            try:
+                data = self.source_read(self.chunk_size)
+            except Exception as e:
+                logger.debug('Exception in read-ahead %s: %s' % (self.name, e))
+                logger.debug(traceback.format_exc())
+                self._put(ITEM_ERROR, e)
+                return
+
+            if data is None and self._is_stopped():
+                return
+            if not data:
+                self._put(ITEM_EOF)
+                return
+            self._put(ITEM_DATA, data, len(data))
+
+    def read(self, size=None):
+        """
+        Reads up to size bytes, blocks until size bytes or the end of the stream are available.
+        Returns empty data at the end, None when stopped with no data buffered.
+        :param size: None = the next buffered chunk
+        :return:
+        """
+        res = []
+        remaining = size
+        with self._cond:
+            while remaining is None or remaining > 0:
+                while not self._items and not self._is_stopped():
+                    self._cond.wait(0.5)
+                if not self._items:
+                    if not res:
+                        return None
+                    break
+
+                kind, payload = self._items[0]
+                if kind == ITEM_EVENT:
+                    self._items.popleft()
+                    if self.on_event is not None:
+                        self.on_event(payload)
+                    continue
+
+                if kind == ITEM_ERROR:
+                    if res:  # deliver the data first
+                        break
+                    self._items.popleft()
+                    raise payload
+
+                if kind == ITEM_EOF:
+                    break
+
+                chunk = payload[self._front_pos:] if remaining is None \
+                    else payload[self._front_pos:self._front_pos + remaining]
+                res.append(chunk)
+                self._front_pos += len(chunk)
+                if self._front_pos >= len(payload):
+                    self._items.popleft()
+                    self._front_pos = 0
+                self._bytes -= len(chunk)
+                self._cond.notify_all()
+
+                if remaining is None:
+                    break
+                remaining -= len(chunk)
+
+        if not res:
+            return b''
+        return res[0] if len(res) == 1 else b''.join(res)
+
+
+class DecodePipeline(object):
+    """
+    Pipelined decoding with a streaming decoder (GzipInputStream, Lz4InputStream).
+    Compressed blocks are read from the source on one thread, decoded on another one
+    and the decoded chunks are passed to the consumer through a bounded queue.
+    zlib and lz4 release the GIL, so reading, decoding and consuming run on separate cores.
+    Each stage buffers at most max_bytes.
+    """
+
+    def __init__(self, source_read, stream, block_size=PREFETCH_CHUNK_SIZE, chunk_size=PIPELINE_CHUNK_SIZE,
+                 max_bytes=PREFETCH_MAX_BYTES, name='pipeline'):
+        self.stop_event = threading.Event()
+        self.compressed = ReadAheadBuffer(source_read, chunk_size=block_size, max_bytes=max_bytes,
+                                          stop_event=self.stop_event, name='%s-read' % name)
+        self.decoded = ReadAheadBuffer(stream.read, chunk_size=chunk_size, max_bytes=max_bytes,
+                                       stop_event=self.stop_event, name='%s-decode' % name)
+        stream.set_fileobj(self.compressed)
+
+    def __repr__(self):
+        return 'DecodePipeline(compressed=%r, decoded=%r)' % (self.compressed, self.decoded)
+
+    @property
+    def buffered(self):
+        return self.decoded.buffered
+
+    def start(self):
+        """
+        Starts the reading and decoding threads
+        :return:
+        """
+        self.compressed.start()
+        self.decoded.start()
+        return self
+
+    def close(self):
+        """
+        Stops both stages, drops buffered data
+        :return:
+        """
+        self.stop_event.set()
+        self.compressed.close()
+        self.decoded.close()
+
+    def read(self, size=None):
+        """
+        Reads up to size decoded bytes, blocks until available
+        :param size: None or 0 = everything to the end of the stream
+        :return:
+        """
+        if size:
+            return self.decoded.read(size)
+
+        res = []
+        while True:
+            data = self.decoded.read(None)
+            if not data:
+                break
+            res.append(data)
+        return b''.join(res)
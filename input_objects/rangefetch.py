@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Parallel byte range downloader - fetches ranges of a remote object
+concurrently and hands the data out strictly in order.
+"""
+
+import logging
+import threading
+import traceback
+
+
+logger = logging.getLogger(__name__)
+
+
+RANGE_CHUNK_SIZE = 8 * 1024 * 1024
+"""Default size of a single byte range request"""
+
+
+class RangeFetcher(object):
+    """
+    Splits [start, end) to chunks of chunk_size bytes, workers fetch the chunks
+    in parallel using fetch(chunk_start, chunk_end) -> bytes, consumer reads them in order.
+
+    Chunks are assigned to workers in order and a worker has to reserve
+    in-flight memory before taking a chunk, so the chunk the consumer waits for
+    is always being fetched and the memory held by fetched-but-unread chunks
+    never exceeds max_inflight bytes.
+    """
+
+    def __init__(self, fetch, start, end, chunk_size=RANGE_CHUNK_SIZE, workers=4, max_inflight=None,
+                 stop_event=None):
+        self.fetch = fetch
+        self.start = start
+        self.end = end
+        self.chunk_size = chunk_size
+        self.workers = max(1, workers)
+        self.max_inflight = max_inflight or 2 * self.workers * chunk_size
+        self.stop_event = stop_event or threading.Event()
+
+        self._lock = threading.Condition()
+        self._threads = []
+        self._closed = False
+        self._chunks = {}  # chunk idx -> data
+        self._error = None
+        self._next_task = 0
+        self._num_chunks = (end - start + chunk_size - 1) // chunk_size if end > start else 0
+        self._slots = max(1, self.max_inflight // chunk_size)
+
+        # consumer state
+        self._cur = 0
+        self._cur_data = None
+        self._cur_pos = 0
+
+    def __repr__(self):
+        return 'RangeFetcher(start=%r, end=%r, chunk=%r/%r)' % (self.start, self.end, self._cur, self._num_chunks)
+
+    def start_workers(self):
+        """
+        Starts worker threads
+        :return:
+        """
+        for idx in range(min(self.workers, self._num_chunks)):
+            t = threading.Thread(target=self._work, name='range-fetch-%s' % idx)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def close(self):
+        """
+        Stops the workers, drops fetched data
+        :return:
+        """
+        with self._lock:
+            self._closed = True
+            self._chunks = {}
+            self._lock.notify_all()
+
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def _is_stopped(self):
+        return self._closed or self.stop_event.is_set()
+
+    def _work(self):
+        """
+        Worker loop - reserve a slot, take the next chunk, fetch it
+        :return:
+        """
+        while True:
+            with self._lock:
+                while self._slots <= 0 and not self._is_stopped():
+                    self._lock.wait(0.5)
+                if self._is_stopped() or self._next_task >= self._num_chunks or self._error is not None:
+                    return
+
+                self._slots -= 1
+                idx = self._next_task
+                self._next_task += 1
+
+            chunk_start = self.start + idx * self.chunk_size
+            chunk_end = min(self.end, chunk_start + self.chunk_size)
+            try:
+                data = self.fetch(chunk_start, chunk_end)
+                if data is not None and len(data) != chunk_end - chunk_start:
+                    raise ValueError('Range %s-%s returned %s bytes' % (chunk_start, chunk_end, len(data)))
+
+            except Exception as e:
+                logger.error('Exception when fetching range %s-%s: %s' % (chunk_start, chunk_end, e))
+                logger.debug(traceback.format_exc())
+                with self._lock:
+                    self._error = e
+                    self._lock.notify_all()
+                return
+
+            with self._lock:
+                if data is None or self._closed:  # interrupted
+                    return
+                self._chunks[idx] = data
+                self._lock.notify_all()
+
+    def read(self, size=None):
+        """
+        Reads up to size bytes in order, blocks until the data is fetched.
+        Returns empty data at the end, None if interrupted by the stop event.
+        :param size: None = rest of the current chunk
+        :return:
+        """
+        res = []
+        remaining = size
+        while remaining is None or remaining > 0:
+            if self._cur_data is None and not self._next_chunk():
+                if self._is_stopped():
+                    return None
+                break
+
+            if remaining is None:
+                res.append(self._cur_data[self._cur_pos:])
+                self._cur_pos = len(self._cur_data)
+            else:
+                res.append(self._cur_data[self._cur_pos:self._cur_pos + remaining])
+                self._cur_pos += len(res[-1])
+                remaining -= len(res[-1])
+
+            if self._cur_pos >= len(self._cur_data):
+                self._cur_data = None
+                self._cur += 1
+                with self._lock:
+                    self._slots += 1
+                    self._lock.notify_all()
+            if size is None:
+                break
+
+        return res[0] if len(res) == 1 else b''.join(res)
+
+    def _next_chunk(self):
+        """
+        Waits for the current chunk, False at the end of data or when stopped
+        :return:
+        """
+        if self._cur >= self._num_chunks:
+            return False
+
+        with self._lock:
+            while self._cur not in self._chunks:
+                if self._error is not None:
+                    raise self._error
+                if self._is_stopped():
+                    return False
+                self._lock.wait(0.5)
+
+            self._cur_data = self._chunks.pop(self._cur)
+            self._cur_pos = 0
+            return True
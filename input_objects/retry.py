@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Retry policies for reconnecting input objects - capped exponential backoff with jitter,
+time budgets and retry latency metrics.
+"""
+
+import collections
+import logging
+import random
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+RETRY_HISTORY = 256
+"""Default number of the recent retries and failure sequences kept in the metrics"""
+
+
+RetryRecord = collections.namedtuple('RetryRecord', ['op', 'attempt', 'delay', 'elapsed'])
+"""Single retry - operation, failed attempts in a row, seconds slept, seconds since the first failure"""
+
+OutageRecord = collections.namedtuple('OutageRecord', ['op', 'attempts', 'latency', 'recovered'])
+"""Finished failure sequence - operation, failed attempts, seconds from the first failure, success"""
+
+
+class RetryPolicy(object):
+    """
+    Capped exponential backoff with jitter.
+
+    The first retry waits first_delay, the n-th one base_delay * multiplier^(n - 2),
+    at most max_delay. jitter in [0, 1] is the randomized fraction of the delay,
+    the sleep is drawn uniformly from [delay * (1 - jitter), delay].
+
+    Retrying stops after max_attempts failed attempts in a row, when the time spent in failures
+    of the stream would exceed time_budget seconds, or when the next attempt would be after
+    the deadline (absolute time.time() value). None disables the limit.
+    """
+    def __init__(self, first_delay=0.1, base_delay=1.0, max_delay=60.0, multiplier=2.0, jitter=0.5,
+                 max_attempts=None, time_budget=None, deadline=None, history=RETRY_HISTORY):
+        self.first_delay = first_delay
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.max_attempts = max_attempts
+        self.time_budget = time_budget
+        self.deadline = deadline
+        self.history = history
+
+    def __repr__(self):
+        return 'RetryPolicy(first_delay=%r, base_delay=%r, max_delay=%r, multiplier=%r, jitter=%r, ' \
+               'max_attempts=%r, time_budget=%r, deadline=%r)' \
+               % (self.first_delay, self.base_delay, self.max_delay, self.multiplier, self.jitter,
+                  self.max_attempts, self.time_budget, self.deadline)
+
+    def delay(self, attempt):
+        """
+        Returns the sleep before the retry after the given failed attempt, jitter applied
+        :param attempt: failed attempts in a row, 1 = first failure
+        :return: seconds
+        """
+        if attempt <= 1:
+            delay = self.first_delay
+        else:
+            delay = min(self.max_delay, self.base_delay * self.multiplier ** min(attempt - 2, 64))
+        return delay * (1.0 - self.jitter * random.random())
+
+    def new_state(self, stop_event=None):
+        """
+        Returns the per-stream retry state
+        :param stop_event: threading.Event cancelling the sleeps
+        :return:
+        """
+        return RetryState(self, stop_event)
+
+    def to_state(self):
+        js = collections.OrderedDict()
+        js['first_delay'] = self.first_delay
+        js['base_delay'] = self.base_delay
+        js['max_delay'] = self.max_delay
+        js['multiplier'] = self.multiplier
+        js['jitter'] = self.jitter
+        js['max_attempts'] = self.max_attempts
+        js['time_budget'] = self.time_budget
+        js['deadline'] = self.deadline
+        return js
+
+    @classmethod
+    def from_state(cls, js):
+        return cls(**dict(js))
+
+
+class RetryState(object):
+    """
+    Retry state of a single stream, shared by all its connections, thread safe.
+    Callers count failed attempts in a row and remember the time of the first failure,
+    backoff() sleeps before the next attempt or refuses, finished() records the sequence.
+    """
+    def __init__(self, policy, stop_event=None):
+        self.policy = policy
+        self.stop_event = stop_event or threading.Event()
+        self._lock = threading.Lock()
+
+        self.retries = 0
+        self.sleep_time = 0.0
+        self.failure_time = 0.0  # seconds spent in finished failure sequences
+        self.gave_up = 0
+        self.records = collections.deque(maxlen=policy.history)
+        self.outages = collections.deque(maxlen=policy.history)
+
+    def __repr__(self):
+        return 'RetryState(retries=%r, sleep_time=%.3f, failure_time=%.3f, gave_up=%r)' \
+               % (self.retries, self.sleep_time, self.failure_time, self.gave_up)
+
+    def sleep(self, sleep_time):
+        """
+        Sleeps for the given amount of seconds, the stop event terminates the sleep at once
+        :param sleep_time:
+        :return: True if not stopped
+        """
+        if sleep_time:
+            self.stop_event.wait(sleep_time)
+        return not self.stop_event.is_set()
+
+    def backoff(self, op, attempt, since):
+        """
+        Sleeps before the next attempt if the policy allows it
+        :param op: operation name, for the metrics
+        :param attempt: failed attempts in a row, 1 = first failure
+        :param since: time.time() of the first failure in the row
+        :return: False if the caller should give up - limits exceeded or stopped
+        """
+        delay = self.next_delay(op, attempt, since)
+        if delay is None:
+            return False
+        return self.sleep(delay)
+
+    def next_delay(self, op, attempt, since):
+        """
+        Records the retry and returns the delay before the next attempt, the caller sleeps on its own,
+        e.g., asyncio.sleep()
+        :param op: operation name, for the metrics
+        :param attempt: failed attempts in a row, 1 = first failure
+        :param since: time.time() of the first failure in the row
+        :return: seconds, None if the caller should give up - limits exceeded
+        """
+        policy = self.policy
+        delay = policy.delay(attempt)
+        now = time.time()
+        give_up = policy.max_attempts is not None and attempt >= policy.max_attempts
+        if policy.time_budget is not None:
+            give_up |= self.failure_time + (now - since) + delay > policy.time_budget
+        if policy.deadline is not None:
+            give_up |= now + delay > policy.deadline
+
+        if give_up:
+            logger.warning('Giving up %s after %s attempts, %.3f s' % (op, attempt, now - since))
+            self.finished(op, attempt, since, recovered=False)
+            return None
+
+        logger.debug('Retry %s attempt %s in %.3f s' % (op, attempt, delay))
+        with self._lock:
+            self.retries += 1
+            self.sleep_time += delay
+            self.records.append(RetryRecord(op, attempt, delay, now - since))
+        return delay
+
+    def finished(self, op, attempts, since, recovered=True):
+        """
+        Records the finished failure sequence, no-op without failures
+        :param op:
+        :param attempts: failed attempts in the row
+        :param since: time.time() of the first failure
+        :param recovered: False when given up
+        :return:
+        """
+        if not attempts:
+            return
+
+        latency = time.time() - since
+        with self._lock:
+            self.failure_time += latency
+            if not recovered:
+                self.gave_up += 1
+            self.outages.append(OutageRecord(op, attempts, latency, recovered))
+
+    def stats(self):
+        """
+        Returns the retry metrics
+        :return:
+        """
+        with self._lock:
+            latencies = [x.latency for x in self.outages if x.recovered]
+            js = collections.OrderedDict()
+            js['retries'] = self.retries
+            js['sleep_time'] = self.sleep_time
+            js['failure_time'] = self.failure_time
+            js['gave_up'] = self.gave_up
+            js['recoveries'] = len(latencies)
+            js['max_latency'] = max(latencies) if latencies else None
+            js['mean_latency'] = sum(latencies) / len(latencies) if latencies else None
+            return js
+
+
+def to_retry_policy(retry, max_attempts=None):
+    """
+    Returns RetryPolicy, None creates the default policy with max_attempts
+    :param retry: RetryPolicy, dict from to_state() or None
+    :param max_attempts:
+    :return:
+    """
+    if retry is None:
+        return RetryPolicy(max_attempts=max_attempts)
+    if isinstance(retry, RetryPolicy):
+        return retry
+    return RetryPolicy.from_state(retry)
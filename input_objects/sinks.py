@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Write-behind sinks for TeeInputObject - the data is handed to a background writer thread
+through a bounded queue, so slow or failing sinks do not block the consumer.
+"""
+
+import collections
+import logging
+import threading
+import time
+import traceback
+
+from digest import to_policy, close_digest
+
+
+logger = logging.getLogger(__name__)
+
+
+SINK_BLOCK = 'block'
+"""Full queue blocks the consumer - backpressure, no data lost"""
+
+SINK_DROP = 'drop'
+"""Full queue drops the chunk, the sink copy has gaps"""
+
+SINK_FAIL = 'fail'
+"""Full queue or a write error raises SinkFailed to the consumer"""
+
+SINK_MAX_BYTES = 8 * 1024 * 1024
+"""Default maximal number of bytes queued per sink"""
+
+
+class SinkFailed(Exception):
+    """
+    Sink with the fail policy could not keep up or failed to write
+    """
+
+
+class FileSink(object):
+    """
+    Writes to a file like object, optionally opened by the file name and closed on close()
+    """
+    def __init__(self, fh=None, fname=None):
+        self.fh = fh if fh is not None else open(fname, 'wb')
+        self.fname = fname
+        self._own = fh is None
+
+    def __repr__(self):
+        return 'FileSink(fh=%r)' % self.fh
+
+    def write(self, data):
+        self.fh.write(data)
+
+    def flush(self):
+        self.fh.flush()
+
+    def close(self):
+        if self._own:
+            self.fh.close()
+
+
+class SocketSink(object):
+    """
+    Sends the data to a connected socket
+    """
+    def __init__(self, sock):
+        self.sock = sock
+
+    def __repr__(self):
+        return 'SocketSink(sock=%r)' % self.sock
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class DigestSink(object):
+    """
+    Hashes the data, DigestPolicy or algorithm name
+    """
+    def __init__(self, digest='sha256'):
+        self.digest = to_policy(digest).new_digest()
+
+    def __repr__(self):
+        return 'DigestSink(digest=%r)' % self.digest.name
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+    def write(self, data):
+        self.digest.update(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        close_digest(self.digest)
+
+
+class WriteBehindSink(object):
+    """
+    Queues the chunks for the sink written on a background thread, at most max_bytes are queued.
+    policy decides what happens when the queue is full - SINK_BLOCK, SINK_DROP or SINK_FAIL.
+    After a write error the sink is disabled, with SINK_FAIL put() raises SinkFailed.
+    stats() reports the lag - queued bytes and the age of the oldest queued chunk, also the maximum.
+    """
+
+    def __init__(self, sink, policy=SINK_BLOCK, max_bytes=SINK_MAX_BYTES, name='write-behind'):
+        self.sink = sink
+        self.policy = policy
+        self.max_bytes = max_bytes
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._items = collections.deque()  # (time queued, data)
+        self._bytes = 0
+        self._writing = False
+        self._closed = False
+        self._thread = None
+        self.error = None
+
+        self.bytes_written = 0
+        self.bytes_dropped = 0
+        self.chunks_dropped = 0
+        self.max_lag_bytes = 0
+        self.max_lag_time = 0.0
+        self.blocked_time = 0.0
+
+    def __repr__(self):
+        return 'WriteBehindSink(sink=%r, policy=%r, queued=%r)' % (self.sink, self.policy, self._bytes)
+
+    def start(self):
+        """
+        Starts the writer thread
+        :return:
+        """
+        self._thread = threading.Thread(target=self._work, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def put(self, data):
+        """
+        Queues the data for writing, applies the policy if the queue is full
+        :param data: immutable chunk
+        :return:
+        """
+        if not data:
+            return
+
+        with self._cond:
+            if self.error is not None:
+                self._failed(data)
+                return
+
+            if self._bytes and self._bytes + len(data) > self.max_bytes:
+                if self.policy == SINK_DROP:
+                    self._drop(data)
+                    return
+                if self.policy == SINK_FAIL:
+                    raise SinkFailed('Sink %s lags %s bytes' % (self.sink, self._bytes))
+
+                started = time.time()
+                while self._bytes and self._bytes + len(data) > self.max_bytes and self.error is None \
+                        and not self._closed:
+                    self._cond.wait(0.5)
+                self.blocked_time += time.time() - started
+                if self.error is not None:
+                    self._failed(data)
+                    return
+
+            self._items.append((time.time(), data))
+            self._bytes += len(data)
+            self.max_lag_bytes = max(self.max_lag_bytes, self._bytes)
+            self._cond.notify_all()
+
+    def full(self, size):
+        """
+        Returns True if putting size bytes would block or drop, the queue is full
+        :param size:
+        :return:
+        """
+        return bool(self._bytes) and self._bytes + size > self.max_bytes and self.error is None
+
+    def _drop(self, data):
+        self.chunks_dropped += 1
+        self.bytes_dropped += len(data)
+
+    def _failed(self, data):
+        """
+        Data put after the sink failed, lock held
+        :param data:
+        :return:
+        """
+        if self.policy == SINK_FAIL:
+            raise SinkFailed('Sink %s failed: %s' % (self.sink, self.error))
+        self._drop(data)
+
+    def _work(self):
+        """
+        Writer loop
+        :return:
+        """
+        while True:
+            with self._cond:
+                while not self._items and not self._closed:
+                    self._cond.wait(0.5)
+                if not self._items:
+                    return
+                queued, data = self._items[0]
+                self._writing = True
+
+            try:
+                self.sink.write(data)
+            except Exception as e:
+                logger.warning('Exception when writing %s bytes to the sink %s: %s' % (len(data), self.sink, e))
+                logger.debug(traceback.format_exc())
+                with self._cond:
+                    self.error = e
+                    for _, x in self._items:  # the chunk being written included
+                        self._drop(x)
+                    self._items.clear()
+                    self._bytes = 0
+                    self._writing = False
+                    self._cond.notify_all()
+                return
+
+            with self._cond:
+                if self._items and self._items[0][1] is data:  # not dropped by close() meanwhile
+                    self._items.popleft()
+                    self._bytes -= len(data)
+                self._writing = False
+                self.bytes_written += len(data)
+                self.max_lag_time = max(self.max_lag_time, time.time() - queued)
+                self._cond.notify_all()
+
+    def lag_time(self):
+        """
+        Returns the age of the oldest queued chunk in seconds
+        :return:
+        """
+        with self._cond:
+            return time.time() - self._items[0][0] if self._items else 0.0
+
+    def drain(self, timeout=None):
+        """
+        Waits until the queued data is written
+        :param timeout:
+        :return: True if drained
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while (self._items or self._writing) and self._thread is not None and self._thread.is_alive():
+                if deadline is not None and time.time() >= deadline:
+                    return False
+                self._cond.wait(0.5)
+            return not self._items
+
+    def flush(self):
+        """
+        Writes the queued data and flushes the sink
+        :return:
+        """
+        self.drain()
+        if self.error is None:
+            self.sink.flush()
+
+    def close(self, drain=True):
+        """
+        Stops the writer thread, writes the queued data first if drain is set, closes the sink
+        :param drain:
+        :return:
+        """
+        if drain:
+            self.flush()
+        with self._cond:
+            self._closed = True
+            if not drain:
+                # the chunk being written is finished, counted as written
+                keep = [self._items[0]] if self._writing and self._items else []
+                for _, x in list(self._items)[len(keep):]:
+                    self._drop(x)
+                self._items = collections.deque(keep)
+                self._bytes = sum(len(x) for _, x in keep)
+            self._cond.notify_all()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.sink.close()
+
+    def stats(self):
+        """
+        Returns the sink metrics
+        :return:
+        """
+        js = collections.OrderedDict()
+        js['sink'] = repr(self.sink)
+        js['policy'] = self.policy
+        js['queued_bytes'] = self._bytes
+        js['lag_time'] = self.lag_time()
+        js['max_lag_bytes'] = self.max_lag_bytes
+        js['max_lag_time'] = self.max_lag_time
+        js['blocked_time'] = self.blocked_time
+        js['bytes_written'] = self.bytes_written
+        js['bytes_dropped'] = self.bytes_dropped
+        js['chunks_dropped'] = self.chunks_dropped
+        js['error'] = str(self.error) if self.error is not None else None
+        return js
+
+
+def to_writer(sink, policy=SINK_BLOCK, max_bytes=SINK_MAX_BYTES, name='write-behind'):
+    """
+    Returns WriteBehindSink for the sink, WriteBehindSink is returned as is
+    :param sink:
+    :param policy:
+    :param max_bytes:
+    :param name:
+    :return:
+    """
+    if isinstance(sink, WriteBehindSink):
+        return sink
+    return WriteBehindSink(sink, policy=policy, max_bytes=max_bytes, name=name)
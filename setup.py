@@ -19,6 +19,10 @@ dev_extras = [
     'tox',
 ]
 
+zstd_extras = [
+    'zstandard',
+]
+
 docs_extras = [
     'Sphinx>=1.0',  # autodoc_member_order = 'bysource', autodoc_default_flags
     'sphinx_rtd_theme',
@@ -64,5 +68,6 @@ setup(
     extras_require={
         'dev': dev_extras,
         'docs': docs_extras,
+        'zstd': zstd_extras,
     }
 )
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+asyncio HTTP client tests against a local scripted server
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_objects'))
+from asynchttp import AsyncHttpClient, AsyncHttpError  # noqa: E402
+
+
+def response(body=b'', status='200 OK', headers=None):
+    """
+    Raw HTTP/1.1 response with Content-Length
+    :param body:
+    :param status:
+    :param headers:
+    :return:
+    """
+    lines = ['HTTP/1.1 %s' % status, 'Content-Length: %s' % len(body)]
+    lines += ['%s: %s' % x for x in (headers or {}).items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin1') + body
+
+
+class ScriptedServer(object):
+    """
+    asyncio HTTP server, handler(method, path, headers, idx) returns (raw response, close the connection),
+    idx is the number of the request on the connection
+    """
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+        self.connections = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, '127.0.0.1', 0)
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def url(self, path):
+        return 'http://127.0.0.1:%s%s' % (self._server.sockets[0].getsockname()[1], path)
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        idx = 0
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, path = line.decode('latin1').split(' ')[:2]
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                self.requests.append((method, path, headers))
+                data, close = self.handler(method, path, headers, idx)
+                idx += 1
+                writer.write(data)
+                await writer.drain()
+                if close:
+                    break
+        finally:
+            writer.close()
+
+
+class AsyncHttpRedirectTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.target = await ScriptedServer(lambda m, p, h, i: (response(b'target'), False)).start()
+        self.origin = await ScriptedServer(self._redirect).start()
+        self.client = AsyncHttpClient()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.origin.stop()
+        await self.target.stop()
+
+    def _redirect(self, method, path, headers, idx):
+        if path == '/cross':
+            return response(status='302 Found', headers={'Location': self.target.url('/t')}), False
+        if path == '/same':
+            return response(status='302 Found', headers={'Location': '/t'}), False
+        return response(b'origin'), False
+
+    async def test_cross_host_drops_credentials(self):
+        r = await self.client.get(self.origin.url('/cross'), auth=('user', 'secret'),
+                                  headers={'Authorization': 'Bearer x', 'X-Custom': '1'})
+        self.assertEqual(await r.read(), b'target')
+        self.assertIn('authorization', self.origin.requests[0][2])
+        headers = self.target.requests[0][2]
+        self.assertNotIn('authorization', headers)
+        self.assertEqual(headers.get('x-custom'), '1')
+
+    async def test_same_host_keeps_credentials(self):
+        r = await self.client.get(self.origin.url('/same'), auth=('user', 'secret'))
+        self.assertEqual(await r.read(), b'origin')
+        self.assertEqual(len(self.origin.requests), 2)
+        self.assertIn('authorization', self.origin.requests[1][2])
+
+
+class AsyncHttpProtocolTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.body = os.urandom(100000)
+        self.server = await ScriptedServer(self._handle).start()
+        self.client = AsyncHttpClient()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.server.stop()
+
+    def _handle(self, method, path, headers, idx):
+        if path == '/length':
+            data = response(self.body)
+            return (data if method != 'HEAD' else data[:-len(self.body)]), False
+        if path == '/chunked':
+            head = b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+            chunks = [b'%x;ext=1\r\n%s\r\n' % (len(x), x) for x in (self.body[:1000], self.body[1000:])]
+            return head + b''.join(chunks) + b'0\r\nX-Trailer: 1\r\n\r\n', False
+        if path == '/close':
+            return b'HTTP/1.1 200 OK\r\nConnection: close\r\n\r\n' + self.body, True
+        if path == '/short':
+            return b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % len(self.body) + self.body[:500], True
+        if path == '/stale':
+            # keep-alive response, the connection is closed when reused
+            return (response(self.body), False) if idx == 0 else (b'', True)
+        if path == '/see-other':
+            return response(status='303 See Other', headers={'Location': '/length'}), False
+        if path == '/loop':
+            return response(status='302 Found', headers={'Location': '/loop'}), False
+        return response(b'not found', status='404 Not Found'), False
+
+    async def test_content_length_keep_alive(self):
+        for _ in range(3):
+            r = await self.client.get(self.server.url('/length'))
+            self.assertEqual(await r.read(), self.body)
+        self.assertEqual(self.server.connections, 1)
+
+    async def test_head(self):
+        r = await self.client.head(self.server.url('/length'))
+        self.assertEqual(int(r.headers['Content-Length']), len(self.body))
+        self.assertEqual(await r.read(), b'')
+        r = await self.client.get(self.server.url('/length'))
+        self.assertEqual(await r.read(), self.body)
+        self.assertEqual(self.server.connections, 1)
+
+    async def test_chunked(self):
+        r = await self.client.get(self.server.url('/chunked'))
+        data = b''
+        while True:
+            chunk = await r.read(777)
+            if not chunk:
+                break
+            data += chunk
+        self.assertEqual(data, self.body)
+        r = await self.client.get(self.server.url('/length'))
+        self.assertEqual(await r.read(), self.body)
+        self.assertEqual(self.server.connections, 1)
+
+    async def test_read_until_close(self):
+        r = await self.client.get(self.server.url('/close'))
+        self.assertEqual(await r.read(), self.body)
+
+    async def test_short_body(self):
+        r = await self.client.get(self.server.url('/short'))
+        with self.assertRaises(AsyncHttpError):
+            await r.read()
+
+    async def test_stale_pooled_connection(self):
+        r = await self.client.get(self.server.url('/stale'))
+        self.assertEqual(await r.read(), self.body)
+        r = await self.client.get(self.server.url('/stale'))
+        self.assertEqual(await r.read(), self.body)
+        self.assertEqual(self.server.connections, 2)
+
+    async def test_redirects(self):
+        r = await self.client.request('POST', self.server.url('/see-other'))
+        self.assertEqual(await r.read(), self.body)
+        self.assertEqual(self.server.requests[-1][0], 'GET')
+        with self.assertRaises(AsyncHttpError):
+            await self.client.get(self.server.url('/loop'))
+
+    async def test_error_status(self):
+        r = await self.client.get(self.server.url('/missing'))
+        self.assertEqual(r.status_code, 404)
+        with self.assertRaises(AsyncHttpError):
+            r.raise_for_status()
+
+
+if __name__ == '__main__':
+    unittest.main()
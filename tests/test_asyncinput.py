@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+asyncio input object tests - reading and resume through async_from_state()
+against the local fault injecting server
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_objects'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from asyncinput import AsyncLinkInputObject, AsyncReconnectingLinkInputObject, AsyncGzipInputObject, \
+    AsyncTeeInputObject, async_from_state  # noqa: E402
+from retry import RetryPolicy  # noqa: E402
+from faultserver import FaultServer, FaultPlan  # noqa: E402
+
+
+async def read_all(iobj, size=65536):
+    res = []
+    while True:
+        data = await iobj.read(size)
+        if not data:
+            return b''.join(res)
+        res.append(data)
+
+
+class AsyncInputTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = b''.join(b'line %08d some payload\n' % i for i in range(100000))
+        comp = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self.gz = comp.compress(self.data) + comp.flush()
+        self.server = FaultServer({'/data': self.data, '/data.gz': self.gz}).start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    async def _resume(self, iobj, first_size):
+        """
+        Reads first_size bytes, rebuilds the stack from the state (crash, no exit) and reads the rest
+        :param iobj:
+        :param first_size:
+        :return: the whole data
+        """
+        await iobj.__aenter__()
+        first = await iobj.read(first_size)
+        iobj.flush()
+        js = json.loads(json.dumps(iobj.to_state()))
+        async with async_from_state(js) as resumed:
+            rest = await read_all(resumed)
+        return first + rest
+
+    async def test_link_resume(self):
+        iobj = AsyncLinkInputObject(self.server.url('/data'))
+        self.assertEqual(await self._resume(iobj, 12345), self.data)
+
+    async def test_reconnecting_link_faults(self):
+        self.server.set_plan(FaultPlan(truncate=0.5, max_faults=3, seed=1))
+        async with AsyncReconnectingLinkInputObject(self.server.url('/data'), retry=RetryPolicy(first_delay=0.01, base_delay=0.01)) as iobj:
+            self.assertEqual(await read_all(iobj), self.data)
+
+    async def test_reconnecting_link_resume(self):
+        iobj = AsyncReconnectingLinkInputObject(self.server.url('/data'))
+        self.assertEqual(await self._resume(iobj, 12345), self.data)
+
+    async def test_gzip_resume(self):
+        iobj = AsyncGzipInputObject(AsyncReconnectingLinkInputObject(self.server.url('/data.gz')))
+        self.assertEqual(await self._resume(iobj, len(self.data) // 2), self.data)
+
+    async def test_gzip_tee_resume(self):
+        copy_fname = os.path.join(self.tmpdir, 'copy.gz')
+        iobj = AsyncGzipInputObject(AsyncTeeInputObject(AsyncReconnectingLinkInputObject(self.server.url('/data.gz')),
+                                                        copy_fname=copy_fname))
+        self.assertEqual(await self._resume(iobj, len(self.data) // 2), self.data)
+        with open(copy_fname, 'rb') as fh:
+            self.assertEqual(fh.read(), self.gz)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Content cache tests - fill, hit, concurrent fill, resumed partial entries, invalidation and eviction
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_objects'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from input_obj import CachedInputObject, ReconnectingLinkInputObject  # noqa: E402
+from cache import ContentCache, FileLock, fcntl  # noqa: E402
+from faultserver import FaultServer  # noqa: E402
+
+
+class ContentCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ContentCache(os.path.join(self.tmpdir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_key(self):
+        url = 'http://example.com/x'
+        self.assertIsNone(ContentCache.key(url, {'Content-Length': '10'}))
+        key = ContentCache.key(url, {'ETag': '"a"', 'Content-Length': '10'})
+        self.assertEqual(key, ContentCache.key(url, {'ETag': '"a"', 'Content-Length': '10'}))
+        self.assertNotEqual(key, ContentCache.key(url, {'ETag': '"b"', 'Content-Length': '10'}))
+        self.assertNotEqual(key, ContentCache.key(url, {'ETag': '"a"', 'Content-Length': '11'}))
+
+    @unittest.skipIf(fcntl is None, 'flock not available')
+    def test_fill_lock_exclusive(self):
+        lock = self.cache.lock_fill('k')
+        self.assertIsNotNone(lock)
+        self.assertIsNone(self.cache.lock_fill('k'))
+        lock.release()
+        other = self.cache.lock_fill('k')
+        self.assertIsNotNone(other)
+        other.release()
+
+    def _entry(self, key, size, age):
+        with open(self.cache.part_fname(key), 'wb') as fh:
+            fh.write(b'x' * size)
+        with FileLock(self.cache.lock_fname(key)):
+            self.cache.commit(key)
+        mtime = time.time() - age
+        os.utime(self.cache.data_fname(key), (mtime, mtime))
+
+    def test_evict_lru(self):
+        self._entry('old', 1000, 300)
+        self._entry('mid', 1000, 200)
+        self._entry('new', 1000, 100)
+        self.assertIsNotNone(self.cache.lookup('old'))  # recently used now
+        self.assertEqual(self.cache.evict(2000), 1000)
+        self.assertIsNone(self.cache.lookup('mid'))
+        self.assertIsNotNone(self.cache.lookup('old'))
+        self.assertIsNotNone(self.cache.lookup('new'))
+
+    @unittest.skipIf(fcntl is None, 'flock not available')
+    def test_evict_skips_filled(self):
+        self._entry('a', 1000, 200)
+        self._entry('b', 1000, 100)
+        lock = self.cache.lock_fill('a')
+        try:
+            self.assertEqual(self.cache.evict(1000), 1000)
+        finally:
+            lock.release()
+        self.assertIsNotNone(self.cache.lookup('a'))
+        self.assertIsNone(self.cache.lookup('b'))
+
+
+class CachedInputObjectTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ContentCache(os.path.join(self.tmpdir, 'cache'))
+        self.data = os.urandom(500000)
+        self.server = FaultServer({'/data': self.data}).start()
+        self.url = self.server.url('/data')
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _cached(self):
+        return CachedInputObject(ReconnectingLinkInputObject(self.url), self.cache)
+
+    def _read(self, size=65536):
+        with self._cached() as iobj:
+            res = []
+            while True:
+                data = iobj.read(size)
+                if not data:
+                    return iobj, b''.join(res)
+                res.append(data)
+
+    def _key(self):
+        return ContentCache.key(self.url, {'ETag': '"%x"' % len(self.data), 'Content-Length': str(len(self.data))})
+
+    def test_fill_and_hit(self):
+        iobj, data = self._read()
+        self.assertFalse(iobj.hit)
+        self.assertEqual(data, self.data)
+        self.assertIsNotNone(self.cache.lookup(self._key()))
+        gets = self.server.stats()['get']
+
+        iobj, data = self._read()
+        self.assertTrue(iobj.hit)
+        self.assertEqual(data, self.data)
+        self.assertEqual(self.server.stats()['get'], gets)
+
+    @unittest.skipIf(fcntl is None, 'flock not available')
+    def test_concurrent_fill(self):
+        lock = self.cache.lock_fill(self._key())
+        try:
+            iobj, data = self._read()
+        finally:
+            lock.release()
+        self.assertFalse(iobj.hit)
+        self.assertEqual(data, self.data)
+        self.assertIsNone(self.cache.lookup(self._key()))
+        self.assertEqual(self.cache.part_size(self._key()), 0)
+
+    def test_resume_partial_entry(self):
+        iobj = self._cached()
+        iobj.__enter__()
+        self.assertEqual(iobj.read(200000), self.data[:200000])
+        iobj.__exit__(None, None, None)  # interrupted, the part stays
+        self.assertEqual(self.cache.part_size(self._key()), 200000)
+        sent = self.server.stats()['bytes']
+
+        iobj, data = self._read()
+        self.assertEqual(data, self.data)
+        self.assertEqual(self.server.stats()['bytes'] - sent, len(self.data) - 200000)
+        self.assertIsNotNone(self.cache.lookup(self._key()))
+
+    def test_oversized_partial_entry_discarded(self):
+        with open(self.cache.part_fname(self._key()), 'wb') as fh:
+            fh.write(b'x' * (len(self.data) + 1))
+        iobj, data = self._read()
+        self.assertEqual(data, self.data)
+        with open(self.cache.lookup(self._key()), 'rb') as fh:
+            self.assertEqual(fh.read(), self.data)
+
+    def test_invalidation(self):
+        self._read()
+        old_key = self._key()
+        self.data = os.urandom(400000)
+        self.server.files['/data'] = self.data
+
+        iobj, data = self._read()
+        self.assertFalse(iobj.hit)
+        self.assertEqual(data, self.data)
+        self.assertNotEqual(self._key(), old_key)
+        self.assertIsNotNone(self.cache.lookup(self._key()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Kernel copy tests
+"""
+
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_objects'))
+import fastcopy  # noqa: E402
+
+
+@unittest.skipUnless(fastcopy.HAS_COPY_FILE_RANGE and fastcopy.HAS_SENDFILE, 'copy_file_range or sendfile missing')
+class CopyRangeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = os.urandom(100000)
+        self.src = open(os.path.join(self.tmpdir, 'src'), 'w+b')
+        self.src.write(self.data)
+        self.src.flush()
+        self._copy_file_range = os.copy_file_range
+
+    def tearDown(self):
+        os.copy_file_range = self._copy_file_range
+        self.src.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _copy(self, name):
+        with open(os.path.join(self.tmpdir, name), 'w+b') as dst:
+            self.assertEqual(fastcopy.copy_file(self.src, dst), len(self.data))
+            dst.seek(0)
+            self.assertEqual(dst.read(), self.data)
+
+    def test_fallback_per_call(self):
+        calls = []
+
+        def copy_file_range(src_fd, dst_fd, count, offset_src=None, *args):
+            calls.append(count)
+            if len(calls) == 1:
+                raise OSError(errno.EXDEV, 'cross device')
+            return self._copy_file_range(src_fd, dst_fd, count, offset_src, *args)
+
+        os.copy_file_range = copy_file_range
+        self._copy('a')  # sendfile after the failure
+        self._copy('b')  # copy_file_range again
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(fastcopy.HAS_COPY_FILE_RANGE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gzip random access tests - seeks landing on window checkpoints
+"""
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_objects'))
+from input_obj import GzipInputObject, FileInputObject  # noqa: E402
+from gzipinputstream import GzipInputStream  # noqa: E402
+from gzipindex import GzipIndex  # noqa: E402
+
+
+def gzip_member(data, flush_every=65536):
+    """
+    Compresses data to a gzip member with full flushes, the index gets window checkpoints
+    :param data:
+    :param flush_every:
+    :return:
+    """
+    comp = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    out = []
+    for idx in range(0, len(data), flush_every):
+        out.append(comp.compress(data[idx:idx + flush_every]))
+        out.append(comp.flush(zlib.Z_FULL_FLUSH))
+    out.append(comp.flush())
+    return b''.join(out)
+
+
+class GzipSeekTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, 's.gz')
+        self.data = b''.join(b'line %08d some payload\n' % i for i in range(100000))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, gz):
+        with open(self.fname, 'wb') as fh:
+            fh.write(gz)
+
+    def _open(self, **kwargs):
+        return GzipInputObject(FileInputObject(self.fname), build_index=True, index_spacing=256 * 1024, **kwargs)
+
+    def _check_seek_to_end(self, data, **kwargs):
+        with self._open(**kwargs) as gz:
+            self.assertEqual(gz.read(), data)
+        with self._open(**kwargs) as gz:
+            self.assertTrue(gz.index.complete)
+            self.assertGreater(len([x for x in gz.index.checkpoints if x.window is not None]), 0)
+            for offset in (len(data) - 100, len(data) // 2):
+                gz.seek(offset)
+                self.assertEqual(gz.read(), data[offset:])
+
+    def test_seek_near_eof(self):
+        self._write(gzip_member(self.data))
+        self._check_seek_to_end(self.data)
+
+    def test_seek_near_eof_split_trailer(self):
+        # member trailer split between the compressed blocks
+        gz = gzip_member(self.data)
+        block_size = next(x for x in range(4096, 8192) if 0 < len(gz) % x < 8)
+        self._write(gz)
+        self._check_seek_to_end(self.data, block_size=block_size)
+
+    def test_seek_multi_member(self):
+        self._write(gzip_member(self.data) + b'\x00' * 3 + gzip_member(self.data))
+        self._check_seek_to_end(self.data + self.data)
+
+    def test_trailing_garbage(self):
+        self._write(gzip_member(self.data) + b'garbage')
+        with self._open() as gz:
+            self.assertRaises(IOError, gz.read)
+
+    def test_index_bounded_output(self):
+        # one compressed block of highly compressible data, restart points inside
+        data = b'\x00' * (8 * 1024 * 1024)
+        gz = gzip_member(data, flush_every=1024 * 1024)
+        index = GzipIndex(spacing=1024 * 1024)
+        stream = GzipInputStream(io.BytesIO(gz), block_size=len(gz) // 8, max_chunk_size=65536, index=index)
+        total, max_buffered = 0, 0
+        while True:
+            chunk = stream.read(4096)
+            if not chunk:
+                break
+            total += len(chunk)
+            max_buffered = max(max_buffered, len(stream._buffer))
+        self.assertEqual(total, len(data))
+        self.assertLessEqual(max_buffered, 2 * 65536)
+        self.assertTrue(index.complete)
+        self.assertGreater(len(index.checkpoints), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
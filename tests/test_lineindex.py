@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Line index tests - incremental building, sidecar round trip and seek_line() on file,
+memory mapped and indexed gzip sources
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_objects'))
+import lineindex  # noqa: E402
+from lineindex import LineIndex, line_index_fname  # noqa: E402
+from input_obj import FileInputObject, GzipInputObject  # noqa: E402
+
+
+def make_lines(count, last_newline=True):
+    rnd = random.Random(count)
+    lines = [b'%d %s\n' % (idx, b'x' * rnd.randint(0, 120)) for idx in range(count)]
+    if not last_newline:
+        lines[-1] = lines[-1][:-1]
+    return lines
+
+
+def line_offsets(lines):
+    res, pos = [], 0
+    for line in lines:
+        res.append(pos)
+        pos += len(line)
+    return res
+
+
+class LineIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.lines = make_lines(5000, last_newline=False)
+        self.data = b''.join(self.lines)
+        self.has_numpy = lineindex.has_numpy
+
+    def tearDown(self):
+        lineindex.has_numpy = self.has_numpy
+        shutil.rmtree(self.tmpdir)
+
+    def _feed(self, spacing, chunk_sizes):
+        index = LineIndex(spacing=spacing)
+        pos = 0
+        rnd = random.Random(spacing)
+        while pos < len(self.data):
+            size = rnd.choice(chunk_sizes)
+            index.feed(self.data[pos:pos + size], pos)
+            pos += size
+        index.finish()
+        return index
+
+    def _check(self, index, spacing):
+        expected = line_offsets(self.lines)[::spacing]
+        self.assertEqual(list(index.offsets), expected)
+        self.assertEqual(index.lines, len(self.lines) - 1)
+        self.assertEqual(index.scanned, len(self.data))
+        self.assertTrue(index.complete)
+
+    def test_feed(self):
+        for spacing in (1, 7, 100):
+            self._check(self._feed(spacing, (1, 13, 4096, 100000)), spacing)
+
+    def test_feed_without_numpy(self):
+        lineindex.has_numpy = lambda: False
+        for spacing in (1, 7, 100):
+            self._check(self._feed(spacing, (1, 13, 4096, 100000)), spacing)
+
+    def test_feed_overlap_and_gap(self):
+        index = LineIndex(spacing=10)
+        index.feed(self.data[:5000], 0)
+        index.feed(self.data[3000:8000], 3000)  # re-read, overlapping part skipped
+        index.feed(self.data[20000:30000], 20000)  # beyond the scanned part, ignored
+        self.assertEqual(index.scanned, 8000)
+        index.feed(self.data[8000:], 8000)
+        index.finish()
+        self._check(index, 10)
+
+    def test_find(self):
+        index = self._feed(10, (4096,))
+        offsets = line_offsets(self.lines)
+        self.assertEqual(index.find(25), (20, offsets[20]))
+        self.assertEqual(index.find(10 ** 9)[0], (len(self.lines) - 1) // 10 * 10)
+        self.assertEqual(index.line_at(offsets[25]), (20, offsets[20]))
+
+    def test_save_load(self):
+        index = self._feed(10, (4096,))
+        fname = os.path.join(self.tmpdir, 'x.lidx')
+        index.save(fname)
+        self.assertFalse(index.updated)
+        loaded = LineIndex.load(fname)
+        self.assertEqual(list(loaded.offsets), list(index.offsets))
+        self.assertEqual((loaded.spacing, loaded.lines, loaded.scanned, loaded.complete),
+                         (index.spacing, index.lines, index.scanned, index.complete))
+
+    def test_load_invalid(self):
+        fname = os.path.join(self.tmpdir, 'x.lidx')
+        with open(fname, 'wb') as fh:
+            fh.write(b'garbage' * 10)
+        self.assertRaises(ValueError, LineIndex.load, fname)
+
+
+class SeekLineTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.lines = make_lines(20000, last_newline=False)
+        self.data = b''.join(self.lines)
+        self.fname = os.path.join(self.tmpdir, 'lines.txt')
+        with open(self.fname, 'wb') as fh:
+            fh.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _check_seek(self, iobj):
+        offsets = line_offsets(self.lines)
+        for line in (0, 1, 999, 1000, 12345, len(self.lines) - 1):
+            self.assertEqual(iobj.seek_line(line), offsets[line])
+            self.assertEqual(iobj.readline(), self.lines[line])
+        self.assertEqual(iobj.seek_line(len(self.lines) + 10), len(self.data))
+        self.assertEqual(iobj.readline(), b'')
+
+    def _read_all(self, iobj):
+        while iobj.readline():
+            pass
+
+    def test_file(self):
+        for use_mmap in (False, True):
+            with FileInputObject(self.fname, use_mmap=use_mmap) as iobj:
+                iobj.build_line_index(spacing=1000, persist=False)
+                self._read_all(iobj)
+                self.assertTrue(iobj.line_index.complete)
+                self._check_seek(iobj)
+
+    def test_file_partial_index(self):
+        # lines beyond the indexed part are read forward
+        with FileInputObject(self.fname) as iobj:
+            index = iobj.build_line_index(spacing=1000, persist=False)
+            for _ in range(1500):
+                iobj.readline()
+            self._check_seek(iobj)
+            self.assertGreater(len(index), 2)
+
+    def test_file_sidecar(self):
+        with FileInputObject(self.fname) as iobj:
+            iobj.build_line_index(spacing=1000)
+            self._read_all(iobj)
+        sidecar = line_index_fname(self.fname)
+        self.assertTrue(os.path.exists(sidecar))
+
+        with FileInputObject(self.fname, use_mmap=True) as iobj:
+            index = iobj.build_line_index(spacing=1000)
+            self.assertTrue(index.complete)
+            self._check_seek(iobj)
+
+    def test_gzip(self):
+        comp = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        gz = []
+        for idx in range(0, len(self.data), 65536):
+            gz.append(comp.compress(self.data[idx:idx + 65536]))
+            gz.append(comp.flush(zlib.Z_FULL_FLUSH))
+        gz.append(comp.flush())
+        gz_fname = self.fname + '.gz'
+        with open(gz_fname, 'wb') as fh:
+            fh.write(b''.join(gz))
+
+        lidx_fname = gz_fname + '.lidx'
+        with GzipInputObject(FileInputObject(gz_fname), build_index=True, index_spacing=256 * 1024) as iobj:
+            iobj.build_line_index(spacing=1000, index_fname=lidx_fname)
+            self._read_all(iobj)
+
+        with GzipInputObject(FileInputObject(gz_fname), build_index=True, index_spacing=256 * 1024) as iobj:
+            self.assertTrue(iobj.index.complete)
+            self.assertTrue(iobj.build_line_index(spacing=1000, index_fname=lidx_fname).complete)
+            self._check_seek(iobj)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Parallel decompression tests - fallback to the sequential decompression
+"""
+
+import io
+import os
+import struct
+import sys
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_objects'))
+from paralleldecode import PeekReader, new_parallel_decoder  # noqa: E402
+
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+
+
+def bgzf(data, member_size=60000):
+    """
+    Compresses data to BGZF members
+    :param data:
+    :param member_size:
+    :return:
+    """
+    res = []
+    for idx in range(0, len(data), member_size):
+        chunk = data[idx:idx + member_size]
+        comp = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        body = comp.compress(chunk) + comp.flush()
+        header = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00' + struct.pack('<H', len(body) + 25)
+        res.append(header + body + struct.pack('<II', zlib.crc32(chunk) & 0xFFFFFFFF, len(chunk)))
+    return b''.join(res)
+
+
+def gzip_member(data):
+    comp = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return comp.compress(data) + comp.flush()
+
+
+class ParallelDecodeTest(unittest.TestCase):
+    def setUp(self):
+        self.data = b''.join(b'line %08d some payload\n' % i for i in range(50000))
+
+    def _decode(self, blob):
+        decoder = new_parallel_decoder(PeekReader(io.BytesIO(blob)), workers=3)
+        self.assertIsNotNone(decoder)
+        decoder.start()
+        try:
+            return decoder.read()
+        finally:
+            decoder.close()
+
+    def test_bgzf(self):
+        self.assertEqual(self._decode(bgzf(self.data)), self.data)
+
+    def test_bgzf_plain_member(self):
+        blob = bgzf(self.data) + gzip_member(self.data) + bgzf(self.data)
+        self.assertEqual(self._decode(blob), self.data * 3)
+
+    @unittest.skipIf(lz4frame is None, 'lz4 not available')
+    def test_lz4_linked_frame(self):
+        blob = lz4frame.compress(self.data, block_linked=False) + lz4frame.compress(self.data, block_linked=True) \
+            + lz4frame.compress(self.data, block_linked=False)
+        self.assertEqual(self._decode(blob), self.data * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Parallel range download tests - RangeFetcher and ReconnectingLinkInputObject
+with parallel_connections against the local fault injecting server
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_objects'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from input_obj import ReconnectingLinkInputObject, from_state  # noqa: E402
+from rangefetch import RangeFetcher  # noqa: E402
+from retry import RetryPolicy  # noqa: E402
+from faultserver import FaultServer, FaultPlan  # noqa: E402
+
+
+def read_all(read, size=None):
+    res = []
+    while True:
+        data = read(size)
+        if not data:
+            return b''.join(res)
+        res.append(data)
+
+
+class RangeFetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.data = os.urandom(300000)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def _fetch(self, start, end):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(random.random() * 0.01)  # ranges finish out of order
+        with self.lock:
+            self.active -= 1
+        return self.data[start:end]
+
+    def test_order(self):
+        for size in (None, 1, 4095, 100000):
+            fetcher = RangeFetcher(self._fetch, 1000, len(self.data), chunk_size=7000, workers=5).start_workers()
+            try:
+                self.assertEqual(read_all(fetcher.read, size), self.data[1000:])
+            finally:
+                fetcher.close()
+
+    def test_inflight_bound(self):
+        fetcher = RangeFetcher(self._fetch, 0, len(self.data), chunk_size=10000, workers=8,
+                               max_inflight=30000).start_workers()
+        try:
+            self.assertEqual(read_all(fetcher.read, 1000), self.data)
+        finally:
+            fetcher.close()
+        self.assertLessEqual(self.max_active, 3)
+
+    def test_error(self):
+        def fetch(start, end):
+            if start >= 50000:
+                raise IOError('range failed')
+            return self.data[start:end]
+
+        fetcher = RangeFetcher(fetch, 0, len(self.data), chunk_size=10000, workers=3).start_workers()
+        try:
+            self.assertEqual(fetcher.read(50000), self.data[:50000])
+            self.assertRaises(IOError, fetcher.read, 1)
+        finally:
+            fetcher.close()
+
+    def test_short_range(self):
+        fetcher = RangeFetcher(lambda s, e: self.data[s:e - 1], 0, 100000, chunk_size=10000).start_workers()
+        try:
+            self.assertRaises(ValueError, fetcher.read)
+        finally:
+            fetcher.close()
+
+
+class ParallelLinkTest(unittest.TestCase):
+    def setUp(self):
+        self.data = os.urandom(2 * 1024 * 1024 + 123)
+        self.server = FaultServer({'/data': self.data}).start()
+        self.url = self.server.url('/data')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _link(self, **kwargs):
+        return ReconnectingLinkInputObject(self.url, parallel_connections=4, range_chunk_size=256 * 1024,
+                                           retry=RetryPolicy(first_delay=0.01, base_delay=0.01, max_attempts=20),
+                                           **kwargs)
+
+    def test_parallel_order(self):
+        with self._link() as iobj:
+            self.assertIsNotNone(iobj.fetcher)
+            self.assertEqual(read_all(iobj.read, 10000), self.data)
+        self.assertGreaterEqual(self.server.stats()['get'], 9)
+
+    def test_failed_range_retried(self):
+        self.server.set_plan(FaultPlan(drop=0.3, truncate=0.3, seed=3, max_faults=5))
+        with self._link() as iobj:
+            self.assertEqual(read_all(iobj.read, 65536), self.data)
+        stats = self.server.stats()
+        self.assertEqual(stats.get('drop', 0) + stats.get('truncate', 0), 5)
+
+    def test_resume(self):
+        iobj = self._link()
+        iobj.__enter__()
+        first = iobj.read(1000000)
+        js = json.loads(json.dumps(iobj.to_state()))
+        iobj.__exit__(None, None, None)
+        self.assertEqual(js['parallel_connections'], 4)
+
+        with from_state(js) as resumed:
+            rest = read_all(resumed.read, 65536)
+        self.assertEqual(first + rest, self.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
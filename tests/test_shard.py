@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Shard tests - line aligned ranges and their resume
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_objects'))
+from input_obj import FileInputObject, ShardInputObject, from_state, shard_input  # noqa: E402
+
+
+class ShardTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, 'lines.txt')
+        self.data = b''.join(b'%s\n' % (b'x' * (i % 97)) for i in range(5000)) + b'y' * 10000 + b'\n'
+        with open(self.fname, 'wb') as fh:
+            fh.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _shard(self, start, end):
+        return ShardInputObject(FileInputObject(self.fname), start, end)
+
+    def _read_all(self, iobj):
+        with iobj:
+            return iobj.read()
+
+    def test_shards_cover_source(self):
+        shards = shard_input(self.fname, 7)
+        self.assertEqual(b''.join(self._read_all(x) for x in shards), self.data)
+
+    def _resume_from(self, start, end, first_size):
+        full = self._read_all(self._shard(start, end))
+        shard = self._shard(start, end)
+        shard.__enter__()
+        first = b''
+        while len(first) < first_size:
+            data = shard.read(min(1000, first_size - len(first)))
+            if not data:
+                break
+            first += data
+        js = json.loads(json.dumps(shard.to_state()))
+        shard.__exit__(None, None, None)
+        self.assertEqual(first + self._read_all(from_state(js)), full)
+        return full
+
+    def test_resume_in_tail(self):
+        # the long last line crosses the shard end
+        start, end = len(self.data) - 30000, len(self.data) - 5000
+        full = self._read_all(self._shard(start, end))
+        self.assertGreater(len(full), end - start + 100)
+        self._resume_from(start, end, len(full) - 100)
+
+    def test_resume_at_end(self):
+        start, end = 0, len(self.data) // 2
+        full = self._read_all(self._shard(start, end))
+        for first_size in (end, len(full)):
+            self._resume_from(start, end, first_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
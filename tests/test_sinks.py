@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Write-behind sink tests - full queue policies, write errors, flush and close ordering
+"""
+
+import io
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_objects'))
+from input_obj import FileLikeInputObject, TeeInputObject  # noqa: E402
+from sinks import WriteBehindSink, SinkFailed, SINK_BLOCK, SINK_DROP, SINK_FAIL  # noqa: E402
+
+
+class GatedSink(object):
+    """
+    Records the calls, writes wait for the gate, fail_at-th write raises
+    """
+    def __init__(self, fail_at=None):
+        self.gate = threading.Event()
+        self.events = []
+        self.data = []
+        self.fail_at = fail_at
+
+    def write(self, data):
+        self.gate.wait(10)
+        if self.fail_at is not None and len(self.data) == self.fail_at:
+            raise IOError('sink broken')
+        self.data.append(data)
+        self.events.append('write')
+
+    def flush(self):
+        self.events.append('flush')
+
+    def close(self):
+        self.events.append('close')
+
+
+def wait_for(cond, timeout=5):
+    deadline = time.time() + timeout
+    while not cond() and time.time() < deadline:
+        time.sleep(0.005)
+    return cond()
+
+
+class WriteBehindSinkTest(unittest.TestCase):
+    def _sink(self, policy, fail_at=None):
+        sink = GatedSink(fail_at=fail_at)
+        writer = WriteBehindSink(sink, policy=policy, max_bytes=10).start()
+        self.addCleanup(writer.close, False)
+        self.addCleanup(sink.gate.set)
+        return sink, writer
+
+    def test_block(self):
+        sink, writer = self._sink(SINK_BLOCK)
+        writer.put(b'a' * 8)
+        done = threading.Event()
+
+        def put():
+            writer.put(b'b' * 8)
+            done.set()
+
+        t = threading.Thread(target=put)
+        t.start()
+        self.assertFalse(done.wait(0.2))
+        sink.gate.set()
+        t.join(5)
+        self.assertTrue(done.is_set())
+        writer.close()
+        self.assertEqual(b''.join(sink.data), b'a' * 8 + b'b' * 8)
+        self.assertGreater(writer.stats()['blocked_time'], 0.1)
+
+    def test_drop(self):
+        sink, writer = self._sink(SINK_DROP)
+        writer.put(b'a' * 8)
+        self.assertTrue(writer.full(8))
+        writer.put(b'b' * 8)
+        writer.put(b'c' * 2)
+        sink.gate.set()
+        writer.close()
+        self.assertEqual(b''.join(sink.data), b'a' * 8 + b'c' * 2)
+        stats = writer.stats()
+        self.assertEqual((stats['chunks_dropped'], stats['bytes_dropped']), (1, 8))
+
+    def test_fail_full(self):
+        sink, writer = self._sink(SINK_FAIL)
+        writer.put(b'a' * 8)
+        self.assertRaises(SinkFailed, writer.put, b'b' * 8)
+        sink.gate.set()
+        writer.close()
+        self.assertEqual(sink.data, [b'a' * 8])
+
+    def test_write_error_fail(self):
+        sink, writer = self._sink(SINK_FAIL, fail_at=1)
+        sink.gate.set()
+        writer.put(b'a')
+        writer.put(b'b')
+        self.assertTrue(wait_for(lambda: writer.error is not None))
+        self.assertRaises(SinkFailed, writer.put, b'c')
+        self.assertEqual(writer.stats()['error'], 'sink broken')
+
+    def test_write_error_block(self):
+        sink, writer = self._sink(SINK_BLOCK, fail_at=0)
+        sink.gate.set()
+        writer.put(b'a')
+        self.assertTrue(wait_for(lambda: writer.error is not None))
+        writer.put(b'b')  # dropped, no exception
+        writer.close()
+        self.assertEqual(writer.stats()['bytes_dropped'], 2)
+        self.assertEqual(sink.events, ['close'])
+
+    def test_close_order(self):
+        sink, writer = self._sink(SINK_BLOCK)
+        writer.put(b'a' * 4)
+        writer.put(b'b' * 4)
+        sink.gate.set()
+        writer.close()
+        self.assertEqual(sink.events, ['write', 'write', 'flush', 'close'])
+        self.assertEqual(writer.stats()['bytes_written'], 8)
+
+    def test_close_without_drain(self):
+        sink, writer = self._sink(SINK_BLOCK)
+        writer.put(b'a' * 4)
+        writer.put(b'b' * 4)
+        self.assertTrue(wait_for(lambda: writer._writing))
+        closer = threading.Thread(target=writer.close, args=(False,))
+        closer.start()
+        sink.gate.set()
+        closer.join(5)
+        self.assertEqual(sink.events[-1], 'close')
+        self.assertNotIn('flush', sink.events)
+        self.assertEqual(writer.stats()['bytes_written'] + writer.stats()['bytes_dropped'], 8)
+
+    def test_flush(self):
+        sink, writer = self._sink(SINK_BLOCK)
+        writer.put(b'a' * 4)
+        sink.gate.set()
+        writer.flush()
+        self.assertEqual(sink.events, ['write', 'flush'])
+
+
+class TeeSinkTest(unittest.TestCase):
+    def test_sink_failed_propagates(self):
+        sink = GatedSink(fail_at=0)
+        sink.gate.set()
+        writer = WriteBehindSink(sink, policy=SINK_FAIL)
+        data = os.urandom(100000)
+        tee = TeeInputObject(FileLikeInputObject(io.BytesIO(data)), sinks=[writer])
+        with tee:
+            tee.read(1000)
+            self.assertTrue(wait_for(lambda: writer.error is not None))
+            self.assertRaises(SinkFailed, tee.read, 1000)
+
+    def test_sinks_get_data(self):
+        sinks = [GatedSink(), GatedSink()]
+        for x in sinks:
+            x.gate.set()
+        data = os.urandom(100000)
+        with TeeInputObject(FileLikeInputObject(io.BytesIO(data)), sinks=sinks, sink_policy=SINK_BLOCK) as tee:
+            while tee.read(1000):
+                pass
+        for x in sinks:
+            self.assertEqual(b''.join(x.data), data)
+            self.assertEqual(x.events[-2:], ['flush', 'close'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tee tests - copy made in the kernel
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input_objects'))
+import input_obj  # noqa: E402
+from input_obj import FileInputObject, TeeInputObject  # noqa: E402
+
+
+@unittest.skipUnless(input_obj.ZERO_COPY_SUPPORTED, 'kernel copy not supported')
+class TeeZeroCopyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, 'src')
+        self.copy_fname = os.path.join(self.tmpdir, 'copy')
+        self.data = os.urandom(1024 * 1024)
+        with open(self.fname, 'wb') as fh:
+            fh.write(self.data)
+        self._copy_range = input_obj.copy_range
+
+    def tearDown(self):
+        input_obj.copy_range = self._copy_range
+        shutil.rmtree(self.tmpdir)
+
+    def test_short_copy_order(self):
+        calls = []
+
+        def short_copy(src_fd, dst_fd, offset, count):
+            calls.append(count)
+            return self._copy_range(src_fd, dst_fd, offset, count // 2 if len(calls) == 2 else count)
+
+        input_obj.copy_range = short_copy
+        with TeeInputObject(FileInputObject(self.fname), copy_fname=self.copy_fname, zero_copy=True) as tee:
+            while tee.read(65536):
+                pass
+        self.assertEqual(len(calls), 2)
+        with open(self.copy_fname, 'rb') as fh:
+            self.assertEqual(fh.read(), self.data)
+
+    def test_zero_copy_opt_in(self):
+        def no_copy(src_fd, dst_fd, offset, count):
+            raise AssertionError('kernel copy used by default')
+
+        input_obj.copy_range = no_copy
+        with TeeInputObject(FileInputObject(self.fname), copy_fname=self.copy_fname) as tee:
+            while tee.read(65536):
+                pass
+        with open(self.copy_fname, 'rb') as fh:
+            self.assertEqual(fh.read(), self.data)
+
+
+if __name__ == '__main__':
+    unittest.main()